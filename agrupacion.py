@@ -0,0 +1,87 @@
+import math
+from collections import Counter
+import numpy as np
+
+# Tamaño de las teselas de Leaflet/OSM en píxeles
+TAMANO_TESELA_PX = 256
+# Latitud máxima representable en Web Mercator
+MAX_LAT_MERCATOR = 85.05112878
+ZOOM_MAXIMO = 18
+
+
+def a_pixeles(lats, lons, zoom):
+    """Convierte coordenadas a píxeles globales Web Mercator (los mismos que usa Leaflet) en ese zoom."""
+    escala = TAMANO_TESELA_PX * 2 ** zoom
+    lats = np.clip(np.asarray(lats, dtype=float), -MAX_LAT_MERCATOR, MAX_LAT_MERCATOR)
+    lons = np.asarray(lons, dtype=float)
+    x = (lons + 180) / 360 * escala
+    sen = np.sin(np.radians(lats))
+    y = (0.5 - np.log((1 + sen) / (1 - sen)) / (4 * math.pi)) * escala
+    return x, y
+
+
+def zoom_para_bbox(swlat, swlng, nelat, nelng, ancho_px=800, alto_px=400):
+    """Zoom con el que el bbox cabe en un mapa de ancho_px x alto_px, como L.map.fitBounds."""
+    for zoom in range(ZOOM_MAXIMO, -1, -1):
+        x, y = a_pixeles([swlat, nelat], [swlng, nelng], zoom)
+        if abs(x[1] - x[0]) <= ancho_px and abs(y[1] - y[0]) <= alto_px:
+            return zoom
+    return 0
+
+
+def agrupar(plantas, zoom, tamano_celda_px=60, zoom_puntos=15, max_puntos=500, max_grupos=400, max_generos=3):
+    """
+    Agrupa las plantas en celdas de `tamano_celda_px` píxeles en el zoom indicado.
+
+    Devuelve una lista de diccionarios con latitud y longitud (el centroide), cantidad y los
+    `max_generos` géneros más frecuentes de cada celda. Las celdas con una sola planta la
+    incluyen en "planta". Desde `zoom_puntos` se devuelven las plantas sueltas, siempre que
+    no pasen de `max_puntos`, así que el tamaño de la respuesta depende del zoom y del
+    tamaño del mapa y no del número de observaciones del área. Las plantas sin coordenadas
+    numéricas se omiten. Si salen más de `max_grupos` celdas se duplica su tamaño hasta
+    no superarlo.
+    """
+    con_coordenadas = [
+        p for p in plantas
+        if isinstance(p.get("latitud"), (int, float)) and isinstance(p.get("longitud"), (int, float))
+    ]
+    if not con_coordenadas:
+        return []
+    lats = np.array([p["latitud"] for p in con_coordenadas], dtype=float)
+    lons = np.array([p["longitud"] for p in con_coordenadas], dtype=float)
+
+    if zoom >= zoom_puntos and len(con_coordenadas) <= max_puntos:
+        return [
+            {"latitud": p["latitud"], "longitud": p["longitud"], "cantidad": 1,
+             "generos": {p.get("genero"): 1}, "planta": p}
+            for p in con_coordenadas
+        ]
+
+    x, y = a_pixeles(lats, lons, zoom)
+    while True:
+        celdas = np.floor(x / tamano_celda_px).astype(np.int64) * (2 ** 32) + np.floor(y / tamano_celda_px).astype(np.int64)
+        _, grupo, cantidades = np.unique(celdas, return_inverse=True, return_counts=True)
+        if len(cantidades) <= max_grupos:
+            break
+        tamano_celda_px *= 2
+    lat_media = np.bincount(grupo, weights=lats) / cantidades
+    lon_media = np.bincount(grupo, weights=lons) / cantidades
+
+    generos = [Counter() for _ in range(len(cantidades))]
+    primera = {}
+    for i, g in enumerate(grupo):
+        generos[g][con_coordenadas[i].get("genero")] += 1
+        primera.setdefault(g, con_coordenadas[i])
+
+    grupos = []
+    for g, cantidad in enumerate(cantidades):
+        grupo_celda = {
+            "latitud": float(lat_media[g]),
+            "longitud": float(lon_media[g]),
+            "cantidad": int(cantidad),
+            "generos": dict(generos[g].most_common(max_generos))
+        }
+        if cantidad == 1:
+            grupo_celda["planta"] = primera[g]
+        grupos.append(grupo_celda)
+    return grupos
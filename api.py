@@ -1,5 +1,8 @@
 import requests
-import time
+import cliente_http
+from registro import obtener_logger
+
+logger = obtener_logger(__name__)
 
 class ApiAvistamientos:
     def __init__(self, lat, lon, delay_inicial=1):
@@ -20,18 +23,12 @@ class ApiAvistamientos:
             'order': 'desc',
         }
 
-        retries = 0
-        delay = self.delay_inicial
-
-        while retries < 5:
-            try:
-                response = requests.get(self.url, params=params)
-                response.raise_for_status()
-                return response.json().get('results', [])
-            except requests.exceptions.RequestException as e:
-                print(f"Error al obtener datos para {grupo}: {e}")
-                retries += 1
-                time.sleep(delay)
-                delay = min(delay * 2, 300)
-
-        return []
+        try:
+            # El cliente compartido aplica el timeout y reintenta con espera exponencial y jitter
+            response = cliente_http.get(self.url, params=params, timeout=15, reintentos=4,
+                                        espera_base=self.delay_inicial)
+            response.raise_for_status()
+            return response.json().get('results', [])
+        except requests.exceptions.RequestException as e:
+            logger.warning("Error al obtener datos para %s: %s", grupo, e)
+            return []
@@ -1,12 +1,27 @@
-from flask import Flask, request, render_template, redirect, url_for, flash
-from procesador_archivo import ProcesadorDatos
+from flask import Flask, Response, g, request, render_template, redirect, url_for, flash, jsonify
+from procesador_archivo import ProcesadorDatos, COALESCEDOR_BUSQUEDAS
 from base_de_datos import BaseDeDatos
-from geopy.geocoders import Nominatim
 import json
-import requests
 from area_data import AreaDataAggregator
-from datetime import datetime
+from cache_observaciones import CacheObservaciones
+from cache_taxones import CacheTaxones
+from descripciones_wikipedia import CacheDescripciones, DescripcionesWikipedia
+from geocodificacion import CacheGeocodificacion, Geocodificador, cargar_nomenclator
+from resultados_area import CacheResultadosArea, redondear_bbox
+from respuestas_api import campos_pedidos, feature, feature_collection, respuesta_json
+from agrupacion import agrupar, zoom_para_bbox, ZOOM_MAXIMO
+from piramide_densidad import ZOOM_MAXIMO_PIRAMIDE
+from trabajos import GestorTrabajos, formato_sse
+from metricas import (BUCKETS_CANTIDAD, iniciar_peticion, medir, registro_metricas, server_timing,
+                      terminar_peticion)
 import math
+import os
+import time
+import logging
+from registro import obtener_logger
+import cliente_http
+
+logger = obtener_logger("app")
 
 app = Flask(__name__, template_folder="templates")
 app.secret_key = 'una_clave_secreta'  # Necesario para usar mensajes flash
@@ -14,6 +29,21 @@ app.secret_key = 'una_clave_secreta'  # Necesario para usar mensajes flash
 # Inicializar variables globales
 db = BaseDeDatos()
 db.initialize()
+# Observaciones históricas (tabla plantas) que sirve /tiles; la conexión se abre en la primera petición
+datos_plantas = BaseDeDatos(os.environ.get("DATOS_DB", "datos.db"))
+
+# Caché local de observaciones de iNaturalist compartida por /buscar y /buscar_area
+cache_observaciones = CacheObservaciones(
+    ttl=int(os.environ.get("CACHE_OBSERVACIONES_TTL", 3600)),
+    tamano_tesela=float(os.environ.get("CACHE_OBSERVACIONES_TESELA", 0.25)),
+    max_por_tesela=int(os.environ.get("CACHE_OBSERVACIONES_MAX_TESELA", 2000)),
+    max_peticiones=int(os.environ.get("CACHE_OBSERVACIONES_MAX_PETICIONES", 4))
+)
+# Ancestros por taxón, compartidos entre búsquedas para evitar una consulta por observación
+cache_taxones = CacheTaxones(
+    max_entradas=int(os.environ.get("CACHE_TAXONES_MAX", 5000)),
+    db_file=os.environ.get("CACHE_TAXONES_DB", "cache_taxones.db") or None
+)
 
 def cargar_categorias():
     """
@@ -47,56 +77,210 @@ CATEGORIAS_NOMBRES, CATEGORIAS = cargar_categorias()
 with open('grupos_plantas.json', 'r', encoding='utf-8') as f:
     GRUPOS_DATA = json.load(f)
 
+# Descripciones de Wikipedia con caché persistente y consultas por lotes
+descripciones_wikipedia = DescripcionesWikipedia(cache=CacheDescripciones(
+    ttl=int(os.environ.get("CACHE_DESCRIPCIONES_TTL", 7 * 24 * 3600))
+), max_busquedas=int(os.environ.get("WIKIPEDIA_MAX_BUSQUEDAS", 20)))
+# Si está activo, /buscar responde sin esperar a Wikipedia y la página pide luego /descripciones
+DESCRIPCIONES_DIFERIDAS = os.environ.get("DESCRIPCIONES_DIFERIDAS", "0") == "1"
+
 # Instancia del agregador para búsqueda por área (bounding box)
 CATEGORIA_POR_DEFECTO = CATEGORIAS_NOMBRES[0] if CATEGORIAS_NOMBRES else ""
-aggregator = AreaDataAggregator(generos_interes=CATEGORIAS.get(CATEGORIA_POR_DEFECTO, []))
+aggregator = AreaDataAggregator(generos_interes=CATEGORIAS.get(CATEGORIA_POR_DEFECTO, []),
+                                cache=cache_observaciones,
+                                timeout_total=float(os.environ.get("AREA_TIMEOUT_TOTAL", 20)),
+                                max_registros_por_genero=int(os.environ.get("AREA_MAX_REGISTROS_GENERO", 200)),
+                                tolerancia_duplicados_m=float(os.environ.get("AREA_TOLERANCIA_DUPLICADOS_M", 25)))
+# Resultados de /buscar_area ya ordenados, para servir cada página sin repetir la búsqueda
+cache_resultados_area = CacheResultadosArea(
+    max_entradas=int(os.environ.get("CACHE_RESULTADOS_AREA_MAX", 64)),
+    ttl=int(os.environ.get("CACHE_RESULTADOS_AREA_TTL", 300))
+)
+AREA_POR_PAGINA = 20
+# Si está activo, /buscar_area solo descarga las observaciones necesarias para la página pedida
+AREA_PAGINACION_BAJO_DEMANDA = os.environ.get("AREA_PAGINACION_BAJO_DEMANDA", "0") == "1"
+# Plazo de /buscar para recorrer páginas de iNaturalist y esperar turno en el limitador de peticiones
+BUSQUEDA_MAX_SEGUNDOS = float(os.environ.get("BUSQUEDA_MAX_SEGUNDOS", 20))
+# Modo trabajo: /buscar y /buscar_area responden al momento y los resultados llegan por SSE
+BUSQUEDAS_EN_SEGUNDO_PLANO = os.environ.get("BUSQUEDAS_EN_SEGUNDO_PLANO", "0") == "1"
+gestor_trabajos = GestorTrabajos(
+    max_hilos=int(os.environ.get("TRABAJOS_MAX_HILOS", 4)),
+    ttl=int(os.environ.get("TRABAJOS_TTL", 600)),
+    # Compartida por los workers de gunicorn: los eventos se piden a cualquiera de ellos
+    db_file=os.environ.get("TRABAJOS_DB", "trabajos.db")
+)
+
+# Geocodificador reutilizado, con caché persistente y nomenclátor local opcional (NOMENCLATOR_GEOGRAFICO=ruta)
+geocodificador = Geocodificador(
+    cache=CacheGeocodificacion(
+        db_file=os.environ.get("CACHE_GEOCODIFICACION_DB", "cache_geocodificacion.db"),
+        ttl=int(os.environ.get("CACHE_GEOCODIFICACION_TTL", 30 * 24 * 3600))
+    ),
+    nomenclator=cargar_nomenclator(os.environ["NOMENCLATOR_GEOGRAFICO"]) if os.environ.get("NOMENCLATOR_GEOGRAFICO") else None
+)
+
+# Cabecera Server-Timing con el desglose por etapas de cada petición (SERVER_TIMING=1)
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "0") == "1"
+DURACION_PETICIONES = registro_metricas.histograma(
+    "hunterleaf_peticion_segundos", "Duración de las peticiones web por ruta, método y código",
+    ("ruta", "metodo", "estado"))
+RESULTADOS_BUSQUEDA = registro_metricas.histograma(
+    "hunterleaf_resultados_busqueda", "Plantas encontradas por búsqueda", ("ruta",), BUCKETS_CANTIDAD)
+
+def recolectar_metricas():
+    """Contadores que ya llevan las cachés, los coalescedores, los trabajos y el cliente HTTP, para /metrics."""
+    geocodificacion = geocodificador.estadisticas()
+    caches = {
+        "observaciones": (cache_observaciones.aciertos, cache_observaciones.fallos),
+        "taxones": (cache_taxones.aciertos, cache_taxones.fallos),
+        "resultados_area": (cache_resultados_area.aciertos, cache_resultados_area.fallos),
+        "descripciones": (descripciones_wikipedia.cache.aciertos, descripciones_wikipedia.cache.fallos),
+        "imagen_generica": (aggregator.aciertos_imagen, aggregator.fallos_imagen),
+        "geocodificacion": (geocodificacion["aciertos_nomenclator"] + geocodificacion["aciertos_cache"],
+                            geocodificacion["consultas_nominatim"]),
+    }
+    coalescedores = {"area": aggregator.coalescedor.estadisticas(), "busquedas": COALESCEDOR_BUSQUEDAS.estadisticas()}
+    trabajos = gestor_trabajos.estadisticas()
+    http = cliente_http.cliente.estadisticas()
+    return [
+        ("hunterleaf_cache_consultas_total", "counter", "Consultas a cada caché por resultado",
+         [({"cache": c, "resultado": r}, n) for c, (aciertos, fallos) in caches.items()
+          for r, n in (("acierto", aciertos), ("fallo", fallos))]),
+        ("hunterleaf_busquedas_agrupadas_total", "counter", "Búsquedas ejecutadas y agrupadas con otra idéntica en curso",
+         [({"coalescedor": c, "resultado": r}, e[r]) for c, e in coalescedores.items()
+          for r in ("ejecutadas", "coalescidas")]),
+        ("hunterleaf_trabajos_total", "counter", "Trabajos en segundo plano lanzados y fallidos",
+         [({"resultado": r}, trabajos[r]) for r in ("lanzados", "fallidos")]),
+        ("hunterleaf_trabajos_en_curso", "gauge", "Trabajos en segundo plano sin terminar",
+         [({}, trabajos["en_curso"])]),
+        ("hunterleaf_reintentos_externos_total", "counter", "Reintentos de peticiones a servicios externos por host",
+         [({"host": h}, e["reintentos"]) for h, e in http.items()]),
+    ]
+
+registro_metricas.recolector(recolectar_metricas)
+
+@app.before_request
+def empezar_medida():
+    g.inicio_peticion = time.perf_counter()
+    g.token_metricas = iniciar_peticion()
+
+@app.after_request
+def terminar_medida(respuesta):
+    if getattr(g, "token_metricas", None) is None:
+        return respuesta
+    tiempos = terminar_peticion(g.token_metricas)
+    duracion = time.perf_counter() - g.inicio_peticion
+    ruta = request.url_rule.rule if request.url_rule is not None else "desconocida"
+    DURACION_PETICIONES.observar(duracion, ruta, request.method, str(respuesta.status_code))
+    if SERVER_TIMING:
+        tiempos["total"] = (duracion, 1)
+        respuesta.headers["Server-Timing"] = server_timing(tiempos)
+    return respuesta
 
 # Función para obtener coordenadas desde una dirección
 def obtener_coordenadas(direccion):
-    geolocalizador = Nominatim(user_agent="plantfinder_app")
-    ubicacion = geolocalizador.geocode(direccion, timeout=15)
-    if ubicacion:
-        return ubicacion.latitude, ubicacion.longitude
-    return None, None
+    with medir("geocodificacion"):
+        return geocodificador.obtener_coordenadas(direccion)
 
 # Función para obtener descripción de Wikipedia con manejo de errores.
 def obtener_descripcion_wikipedia(nombre_cientifico):
     """Consulta la API de Wikipedia para obtener una descripción general del taxón.
     Si no se encuentra la información, retorna una cadena vacía."""
-    base_url = "https://es.wikipedia.org/api/rest_v1/page/summary/"
-    url = base_url + nombre_cientifico.replace(" ", "_")
-    try:
-        response = requests.get(url, timeout=10)
-        if response.status_code == 404:
-            print(f"Página no encontrada para '{nombre_cientifico}'. Se intentará una búsqueda...")
-            search_url = "https://es.wikipedia.org/w/api.php"
-            params = {
-                "action": "query",
-                "list": "search",
-                "srsearch": nombre_cientifico,
-                "format": "json"
-            }
-            search_response = requests.get(search_url, params=params, timeout=10)
-            search_response.raise_for_status()
-            search_data = search_response.json()
-            search_results = search_data.get("query", {}).get("search", [])
-            if search_results:
-                title = search_results[0]["title"]
-                url = base_url + title.replace(" ", "_")
-                response = requests.get(url, timeout=10)
-                response.raise_for_status()
-                data = response.json()
-                return data.get("extract", "")
-            else:
-                print(f"No se encontraron resultados de búsqueda para '{nombre_cientifico}'.")
-                return ""
-        else:
-            response.raise_for_status()
-            data = response.json()
-            return data.get("extract", "")
-    except requests.exceptions.RequestException as e:
-        print(f"Error al obtener descripción de Wikipedia: {e}")
-        return ""
+    return descripciones_wikipedia.obtener(nombre_cientifico)
+
+def plantas_para_plantilla(registros):
+    """Convierte los registros de ProcesadorDatos en las plantas de resultados.html, omitiendo los que no tienen coordenadas válidas."""
+    plantas = []
+    for row in registros:
+        coords_str = row.get('coordenadas', '')
+        # Verificar que exista un string válido en 'coordenadas'
+        if not coords_str or not isinstance(coords_str, str):
+            logger.debug("Registro omitido por falta de coordenadas válidas: %s", row.get('nombre', 'Sin nombre'))
+            continue
+        coords = coords_str.split(',')
+        if len(coords) < 2:
+            logger.debug("Registro omitido por formato incorrecto de coordenadas: %s", coords_str)
+            continue
+        try:
+            planta_lat = float(coords[0].strip())
+            planta_lon = float(coords[1].strip())
+        except (ValueError, IndexError):
+            logger.debug("Registro omitido por error en la conversión de coordenadas: %s", coords_str)
+            continue
+
+        # Omitir registros con coordenadas (0,0)
+        if planta_lat == 0.0 and planta_lon == 0.0:
+            logger.debug("Registro omitido por coordenadas nulas (0,0): %s", row.get('nombre', 'Sin nombre'))
+            continue
+
+        planta = {
+            "nombre_cientifico": row['nombre'],
+            "nombre_comun": row.get('nombre_comun', 'N/A'),
+            "distancia": row['distancia'],
+            "fecha_observacion": row['fecha'],
+            "imagen_generica": row['imagen'],
+            "latitud": planta_lat,
+            "longitud": planta_lon,
+            "descripcion_wikipedia": ""
+        }
+        plantas.append(planta)
+    return plantas
+
+def en_segundo_plano(valor):
+    """Modo trabajo si la petición lo indica (en_segundo_plano=1 o 0) o, si no, según BUSQUEDAS_EN_SEGUNDO_PLANO."""
+    if valor in ("0", "1"):
+        return valor == "1"
+    return BUSQUEDAS_EN_SEGUNDO_PLANO
+
+def trabajo_buscar(trabajo, latitud, longitud, radio, categoria, genero):
+    """/buscar en segundo plano: publica las plantas de cada página según llegan y al final sus descripciones."""
+    procesador = ProcesadorDatos(
+        categoria=categoria,
+        genero=genero,
+        cache=cache_observaciones,
+        cache_taxones=cache_taxones
+    )
+    nombres = []
+
+    def al_procesar_pagina(registros):
+        plantas = plantas_para_plantilla(registros)
+        if not plantas:
+            return
+        # Las descripciones que ya están en caché van con la página; el resto llega al final
+        descripciones = descripciones_wikipedia.obtener_de_cache(p["nombre_cientifico"] for p in plantas)
+        for planta in plantas:
+            planta["descripcion_wikipedia"] = descripciones.get(planta["nombre_cientifico"], "")
+        nombres.extend(p["nombre_cientifico"] for p in plantas if not p["descripcion_wikipedia"])
+        trabajo.publicar("plantas", plantas)
+
+    with medir("inaturalist"):
+        procesador.procesar_inaturalist(
+            latitud, longitud, radio=radio,
+            max_registros=int(os.environ.get("INATURALIST_MAX_REGISTROS", 200)),
+            max_segundos=BUSQUEDA_MAX_SEGUNDOS,
+            al_procesar_pagina=al_procesar_pagina
+        )
+    if nombres:
+        with medir("wikipedia"):
+            descripciones = descripciones_wikipedia.obtener_lote(nombres)
+        trabajo.publicar("descripciones", {n: d for n, d in descripciones.items() if d})
+    return {"limite_tasa": procesador.espera_limite_tasa}
+
+def trabajo_area(trabajo, sw_lat, sw_lng, ne_lat, ne_lng, fuente, source_filter, order_date):
+    """
+    /buscar_area en segundo plano: publica las observaciones de cada género y deja el resultado
+    en la caché. La descarga se guarda también con el trabajo, porque la recarga final puede
+    llegar a otro worker, cuya caché de resultados no la tiene.
+    """
+    def progreso(fuente_genero, genero, plantas):
+        trabajo.publicar("plantas", {"fuente": fuente_genero, "genero": genero, "plantas": plantas})
+
+    def al_descargar(plantas, hay_mas, fuentes):
+        trabajo.guardar_resultado({"plantas": plantas, "hay_mas": hay_mas, "fuentes": fuentes})
+
+    resultado = obtener_resultados_area(sw_lat, sw_lng, ne_lat, ne_lng, fuente, source_filter, order_date, 1,
+                                        progreso=progreso, al_descargar=al_descargar)
+    return {"total": len(resultado.plantas), "fuentes": resultado.fuentes}
 
 @app.route('/')
 def home():
@@ -121,16 +305,17 @@ def buscar_direccion():
             radio = 10  # Valor por defecto
         
         # Depuración: Imprimir valores iniciales
-        print(f"Valores iniciales - Dirección: '{direccion}', Latitud: '{latitud}', Longitud: '{longitud}', Radio: '{radio}'")
+        logger.debug("Valores iniciales - Dirección: '%s', Latitud: '%s', Longitud: '%s', Radio: '%s'",
+                     direccion, latitud, longitud, radio)
         
         # Si se proporcionan coordenadas, convertir comas a puntos
         if latitud and longitud:
             latitud = float(latitud.replace(',', '.'))
             longitud = float(longitud.replace(',', '.'))
-            print(f"Coordenadas convertidas: Latitud = {latitud}, Longitud = {longitud}")
+            logger.debug("Coordenadas convertidas: Latitud = %s, Longitud = %s", latitud, longitud)
         elif direccion:
             latitud, longitud = obtener_coordenadas(direccion)
-            print(f"Coordenadas obtenidas de dirección: Latitud = {latitud}, Longitud = {longitud}")
+            logger.debug("Coordenadas obtenidas de dirección: Latitud = %s, Longitud = %s", latitud, longitud)
             if latitud is None or longitud is None:
                 flash("No se encontraron coordenadas para la dirección proporcionada.", "error")
                 return redirect(url_for('home'))
@@ -142,21 +327,42 @@ def buscar_direccion():
         try:
             latitud = float(latitud)
             longitud = float(longitud)
-            print(f"Coordenadas finales para búsqueda: Latitud = {latitud}, Longitud = {longitud}")
+            logger.info("Coordenadas finales para búsqueda: Latitud = %s, Longitud = %s", latitud, longitud)
         except (ValueError, TypeError) as e:
-            print(f"Error al convertir coordenadas finales: {e}")
+            logger.warning("Error al convertir coordenadas finales: %s", e)
             flash("Error en el formato de las coordenadas. Asegúrese de que sean números válidos.", "error")
             return redirect(url_for('home'))
 
+        if en_segundo_plano(request.form.get('en_segundo_plano')):
+            trabajo = gestor_trabajos.lanzar("buscar", trabajo_buscar, latitud, longitud, radio,
+                                             categoria_seleccionada, genero_seleccionado)
+            return render_template('resultados.html',
+                                   plantas=[],
+                                   latitud=latitud,
+                                   longitud=longitud,
+                                   categoria_seleccionada=categoria_seleccionada,
+                                   genero_seleccionado=genero_seleccionado,
+                                   trabajo_id=trabajo.id)
+
         # Crear el procesador con la categoría y opcionalmente el género
         procesador = ProcesadorDatos(
             categoria=categoria_seleccionada,
-            genero=genero_seleccionado
+            genero=genero_seleccionado,
+            cache=cache_observaciones,
+            cache_taxones=cache_taxones
         )
         
         # Procesar la búsqueda con un radio específico
-        df_plantas = procesador.procesar_inaturalist(latitud, longitud, radio=radio)
+        with medir("inaturalist"):
+            df_plantas = procesador.procesar_inaturalist(
+                latitud, longitud, radio=radio,
+                max_registros=int(os.environ.get("INATURALIST_MAX_REGISTROS", 200)),
+                max_segundos=BUSQUEDA_MAX_SEGUNDOS
+            )
         
+        if df_plantas.empty and procesador.espera_limite_tasa is not None:
+            flash("iNaturalist está recibiendo demasiadas consultas. Inténtelo de nuevo en unos segundos.", "error")
+            return redirect(url_for('home'))
         if df_plantas.empty:
             flash("No se encontraron plantas en la ubicación especificada.", "info")
             return render_template('resultados.html', 
@@ -167,57 +373,73 @@ def buscar_direccion():
                                    genero_seleccionado=genero_seleccionado)
 
         # Convertir DataFrame a lista de diccionarios
-        plantas = []
-        for _, row in df_plantas.iterrows():
-            coords_str = row.get('coordenadas', '')
-            # Verificar que exista un string válido en 'coordenadas'
-            if not coords_str or not isinstance(coords_str, str):
-                print(f"Registro omitido por falta de coordenadas válidas: {row.get('nombre', 'Sin nombre')}")
-                continue
-            coords = coords_str.split(',')
-            if len(coords) < 2:
-                print(f"Registro omitido por formato incorrecto de coordenadas: {coords_str}")
-                continue
-            try:
-                planta_lat = float(coords[0].strip())
-                planta_lon = float(coords[1].strip())
-            except (ValueError, IndexError):
-                print(f"Registro omitido por error en la conversión de coordenadas: {coords_str}")
-                continue
+        with medir("conversion"):
+            plantas = plantas_para_plantilla(df_plantas.to_dict('records'))
+        RESULTADOS_BUSQUEDA.observar(len(plantas), "/buscar")
 
-            # Omitir registros con coordenadas (0,0)
-            if planta_lat == 0.0 and planta_lon == 0.0:
-                print(f"Registro omitido por coordenadas nulas (0,0): {row.get('nombre', 'Sin nombre')}")
-                continue
+        # Las descripciones se piden de una vez; en modo diferido solo se usan las que ya están en caché
+        nombres = [planta["nombre_cientifico"] for planta in plantas]
+        diferidas = DESCRIPCIONES_DIFERIDAS or request.form.get('descripciones_diferidas') == '1'
+        with medir("wikipedia"):
+            if diferidas:
+                descripciones = descripciones_wikipedia.obtener_de_cache(nombres)
+            else:
+                descripciones = descripciones_wikipedia.obtener_lote(nombres)
+        for planta in plantas:
+            planta["descripcion_wikipedia"] = descripciones.get(planta["nombre_cientifico"], "")
 
-            planta = {
-                "nombre_cientifico": row['nombre'],
-                "nombre_comun": row.get('nombre_comun', 'N/A'),
-                "distancia": row['distancia'],
-                "fecha_observacion": row['fecha'],
-                "imagen_generica": row['imagen'],
-                "latitud": planta_lat,
-                "longitud": planta_lon,
-                "descripcion_wikipedia": obtener_descripcion_wikipedia(row['nombre'])
-            }
-            plantas.append(planta)
-
-        return render_template('resultados.html', 
-                               plantas=plantas,
-                               latitud=latitud,
-                               longitud=longitud,
-                               categoria_seleccionada=categoria_seleccionada,
-                               genero_seleccionado=genero_seleccionado)
+        with medir("plantilla"):
+            return render_template('resultados.html', 
+                                   plantas=plantas,
+                                   latitud=latitud,
+                                   longitud=longitud,
+                                   categoria_seleccionada=categoria_seleccionada,
+                                   genero_seleccionado=genero_seleccionado,
+                                   descripciones_pendientes=[n for n in dict.fromkeys(nombres) if n not in descripciones])
 
     except ValueError as e:
-        print(f"Error de valor: {str(e)}")
+        logger.warning("Error de valor: %s", e)
         flash("Error en el formato de las coordenadas. Use punto decimal en lugar de coma.", "error")
         return redirect(url_for('home'))
     except Exception as e:
-        print(f"Error inesperado: {str(e)}")
+        logger.exception("Error inesperado: %s", e)
         flash(f"Ocurrió un error inesperado: {str(e)}", "error")
         return redirect(url_for('home'))
 
+def obtener_resultados_area(sw_lat, sw_lng, ne_lat, ne_lng, fuente, source_filter, order_date, page, progreso=None,
+                            al_descargar=None, descargadas=None):
+    """
+    ResultadoArea filtrado y ordenado de un área, compartido por /buscar_area y /api/v1/area.
+    `progreso` se pasa a AreaDataAggregator.obtener_datos_area si hay que descargar y
+    `al_descargar(plantas, hay_mas, fuentes)` recibe lo descargado. Con `descargadas`, una
+    descarga ya hecha por un trabajo, se rellena la caché con ella en lugar de descargar.
+    """
+    limite = None
+    page = max(page, 1)
+    if AREA_PAGINACION_BAJO_DEMANDA:
+        # Se piden a la fuente las observaciones por género de la página actual y la siguiente,
+        # redondeadas a potencias de dos para no volver a descargar en cada página
+        limite = AREA_POR_PAGINA * 2 ** math.ceil(math.log2(page + 1))
+
+    def descargar(limite):
+        if descargadas is not None:
+            return descargadas["plantas"], descargadas["hay_mas"], descargadas["fuentes"]
+        estado = {}
+        with medir("descarga_area"):
+            plantas = aggregator.obtener_datos_area(sw_lat, sw_lng, ne_lat, ne_lng, fuente,
+                                                    estado=estado, max_registros=limite, progreso=progreso)
+        logger.info("Total de observaciones sin filtrar: %d", len(plantas))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Géneros obtenidos en las observaciones: %s", sorted({str(p.get("genero")) for p in plantas}))
+        hay_mas = limite is not None and any(estado.get("generos_truncados", {}).values())
+        if al_descargar is not None:
+            al_descargar(plantas, hay_mas, estado.get("fuentes"))
+        return plantas, hay_mas, estado.get("fuentes")
+
+    return cache_resultados_area.ordenadas(
+        redondear_bbox(sw_lat, sw_lng, ne_lat, ne_lng), fuente, source_filter, order_date, descargar, limite
+    )
+
 # Búsqueda por área (GET) con ordenación, filtrado por fuente y paginación
 @app.route('/buscar_area', methods=['GET'])
 def buscar_area():
@@ -237,65 +459,268 @@ def buscar_area():
     order_date = request.args.get('order_date', 'desc')
     source_filter = request.args.get('source_filter', 'mixta')
     try:
-        page = int(request.args.get('page', 1))
+        page = max(int(request.args.get('page', 1)), 1)
     except ValueError:
         page = 1
 
-    plantas = aggregator.obtener_datos_area(sw_lat, sw_lng, ne_lat, ne_lng, fuente)
-    
-    print(f"Total de observaciones sin filtrar: {len(plantas)}")
-    print("Generos obtenidos en las observaciones:")
-    for planta in plantas:
-        print(planta.get("genero"))
-    print("Categorías disponibles:", CATEGORIAS.keys())
-    print(f"Observaciones después del filtrado: {len(plantas)}")
-
-    for planta in plantas:
-        if "fuente" not in planta:
-            if planta.get("descripcion", "Sin descripción") == "Sin descripción":
-                planta["fuente"] = "iNaturalist"
-            else:
-                planta["fuente"] = "GBIF"
-    
-    if source_filter != 'mixta':
-        plantas = [p for p in plantas if p.get("fuente") == source_filter]
+    zoom = zoom_para_bbox(sw_lat, sw_lng, ne_lat, ne_lng)
+    en_cache = cache_resultados_area.tiene(redondear_bbox(sw_lat, sw_lng, ne_lat, ne_lng), fuente)
+    # En modo trabajo la primera página se muestra vacía y se rellena por SSE; al terminar se
+    # recarga con ?trabajo=id y se sirve desde la caché de resultados, como las páginas siguientes.
+    # Si la recarga llega a otro worker, la caché se rellena con la descarga guardada del trabajo
+    descargadas = None
+    if not en_cache and request.args.get('trabajo'):
+        descargadas = gestor_trabajos.resultado(request.args.get('trabajo'))
+    if (page == 1 and descargadas is None and en_segundo_plano(request.args.get('en_segundo_plano'))
+            and not en_cache):
+        trabajo = gestor_trabajos.lanzar("area", trabajo_area, sw_lat, sw_lng, ne_lat, ne_lng,
+                                         fuente, source_filter, order_date)
+        return render_template('resultado_area.html', plantas=[], swlat=sw_lat, swlng=sw_lng, nelat=ne_lat,
+                               nelng=ne_lng, center_lat=center_lat, center_lng=center_lng, page=1,
+                               total_pages=0, order_date=order_date, source_filter=source_filter,
+                               fuente=fuente, zoom=zoom, grupos=feature_collection([]),
+                               trabajo_id=trabajo.id, por_pagina=AREA_POR_PAGINA)
 
-    def get_fecha(p):
-        fecha_str = p.get("fecha_observacion", "Fecha desconocida")
-        try:
-            return datetime.strptime(fecha_str, "%Y-%m-%d")
-        except Exception:
-            return None
-
-    def sort_key(p):
-        fecha = get_fecha(p)
-        if fecha is None:
-            return (1, datetime.min)
+    with medir("resultados_area"):
+        resultado = obtener_resultados_area(sw_lat, sw_lng, ne_lat, ne_lng, fuente, source_filter, order_date, page,
+                                            descargadas=descargadas)
+    RESULTADOS_BUSQUEDA.observar(len(resultado.plantas), "/buscar_area")
+    total_pages = resultado.total_paginas(AREA_POR_PAGINA)
+    plantas_pag = resultado.pagina(page, AREA_POR_PAGINA)
+    # El mapa recibe grupos de todas las observaciones del área, no una capa por observación
+    with medir("agrupacion"):
+        grupos = features_agrupadas(agrupar(resultado.plantas, zoom), CAMPOS_API_AREA)
+
+    with medir("plantilla"):
+        return render_template('resultado_area.html', 
+                               plantas=plantas_pag,
+                               swlat=sw_lat,
+                               swlng=sw_lng,
+                               nelat=ne_lat,
+                               nelng=ne_lng,
+                               center_lat=center_lat,
+                               center_lng=center_lng,
+                               page=page,
+                               total_pages=total_pages,
+                               order_date=order_date,
+                               source_filter=source_filter,
+                               fuente=fuente,
+                               zoom=zoom,
+                               grupos=grupos,
+                               estado_fuentes=resultado.fuentes)
+
+# Propiedades que pueden pedirse con ?campos= en la API
+CAMPOS_API_BUSCAR = ("nombre", "nombre_comun", "distancia_km", "fecha", "imagen", "calidad")
+CAMPOS_API_AREA = ("nombre_cientifico", "genero", "fecha_observacion", "identificaciones", "calidad",
+                   "descripcion", "imagen_generica", "fuente")
+
+def error_api(mensaje, estado=400):
+    return respuesta_json({"error": mensaje}, request, estado, tipo="application/json")
+
+@app.route('/api/v1/buscar')
+def api_buscar():
+    """
+    Observaciones alrededor de un punto como FeatureCollection GeoJSON.
+    Parámetros: lat y lon (o direccion), radio (km), categoria, genero, ordenar=distancia
+    y campos (lista separada por comas de CAMPOS_API_BUSCAR).
+    """
+    try:
+        if request.args.get('lat') and request.args.get('lon'):
+            latitud = float(request.args['lat'].replace(',', '.'))
+            longitud = float(request.args['lon'].replace(',', '.'))
+        elif request.args.get('direccion'):
+            latitud, longitud = obtener_coordenadas(request.args['direccion'])
+            if latitud is None:
+                return error_api("No se encontraron coordenadas para la dirección proporcionada.", 404)
         else:
-            return (0, fecha)
-
-    reverse_order = True if order_date == 'desc' else False
-    plantas.sort(key=sort_key, reverse=reverse_order)
-
-    PER_PAGE = 20
-    total = len(plantas)
-    total_pages = math.ceil(total / PER_PAGE)
-    start = (page - 1) * PER_PAGE
-    end = start + PER_PAGE
-    plantas_pag = plantas[start:end]
-
-    return render_template('resultado_area.html', 
-                           plantas=plantas_pag,
-                           swlat=sw_lat,
-                           swlng=sw_lng,
-                           nelat=ne_lat,
-                           nelng=ne_lng,
-                           center_lat=center_lat,
-                           center_lng=center_lng,
-                           page=page,
-                           total_pages=total_pages,
-                           order_date=order_date,
-                           source_filter=source_filter)
+            return error_api("Indique lat y lon o una dirección.")
+        radio = float(request.args.get('radio', 10))
+    except ValueError:
+        return error_api("Coordenadas o radio no válidos.")
+
+    procesador = ProcesadorDatos(
+        categoria=request.args.get('categoria'),
+        genero=request.args.get('genero'),
+        cache=cache_observaciones,
+        cache_taxones=cache_taxones
+    )
+    with medir("inaturalist"):
+        df_plantas = procesador.procesar_inaturalist(
+            latitud, longitud, radio=radio,
+            ordenar_por_distancia=request.args.get('ordenar') == 'distancia',
+            max_registros=int(os.environ.get("INATURALIST_MAX_REGISTROS", 200)),
+            max_segundos=BUSQUEDA_MAX_SEGUNDOS
+        )
+    if df_plantas.empty and procesador.espera_limite_tasa is not None:
+        respuesta = error_api("Demasiadas consultas a iNaturalist; reintente más tarde.", 503)
+        respuesta.headers["Retry-After"] = str(math.ceil(procesador.espera_limite_tasa))
+        return respuesta
+    campos = campos_pedidos(request.args.get('campos'), CAMPOS_API_BUSCAR)
+    features = []
+    for registro in df_plantas.to_dict('records'):
+        try:
+            planta_lat, planta_lon = (float(c) for c in registro['coordenadas'].split(','))
+        except (AttributeError, ValueError):
+            continue
+        registro['distancia_km'] = float(registro['distancia'].split()[0])
+        features.append(feature(planta_lat, planta_lon, {c: registro.get(c) for c in campos}))
+    return respuesta_json(feature_collection(features, centro=[longitud, latitud], radio_km=radio), request)
+
+@app.route('/api/v1/area')
+def api_area():
+    """
+    Observaciones de un bbox como FeatureCollection GeoJSON, con la misma caché y paginación
+    que /buscar_area. Parámetros: swlat, swlng, nelat, nelng, fuente, source_filter,
+    order_date, page y campos (lista separada por comas de CAMPOS_API_AREA).
+    """
+    try:
+        sw_lat, sw_lng, ne_lat, ne_lng = (float(request.args[c]) for c in ('swlat', 'swlng', 'nelat', 'nelng'))
+        page = max(int(request.args.get('page', 1)), 1)
+    except (KeyError, ValueError):
+        return error_api("Indique swlat, swlng, nelat y nelng numéricos.")
+    fuente = request.args.get('fuente', 'inaturalist')
+    order_date = request.args.get('order_date', 'desc')
+    source_filter = request.args.get('source_filter', 'mixta')
+
+    resultado = obtener_resultados_area(sw_lat, sw_lng, ne_lat, ne_lng, fuente, source_filter, order_date, page)
+    campos = campos_pedidos(request.args.get('campos'), CAMPOS_API_AREA)
+    features = [
+        feature(planta['latitud'], planta['longitud'], {c: planta.get(c) for c in campos})
+        for planta in resultado.pagina(page, AREA_POR_PAGINA)
+    ]
+    return respuesta_json(feature_collection(
+        features, pagina=page, total_paginas=resultado.total_paginas(AREA_POR_PAGINA), fuente=fuente,
+        **({"fuentes": resultado.fuentes} if resultado.fuentes else {})
+    ), request)
+
+def features_agrupadas(grupos, campos):
+    """FeatureCollection con un punto por grupo; los grupos de una planta llevan sus propiedades."""
+    features = []
+    for grupo in grupos:
+        propiedades = {"cantidad": grupo["cantidad"], "generos": grupo["generos"]}
+        if "planta" in grupo:
+            propiedades.update({c: grupo["planta"].get(c) for c in campos})
+        features.append(feature(grupo["latitud"], grupo["longitud"], propiedades))
+    return feature_collection(features)
+
+@app.route('/api/v1/area/agrupada')
+def api_area_agrupada():
+    """
+    Observaciones de un bbox agrupadas en celdas según el zoom, para el mapa de /buscar_area.
+    Parámetros: los de /api/v1/area más zoom y, opcionalmente, vista=swlat,swlng,nelat,nelng
+    para agrupar solo lo que se ve en el mapa.
+    """
+    try:
+        sw_lat, sw_lng, ne_lat, ne_lng = (float(request.args[c]) for c in ('swlat', 'swlng', 'nelat', 'nelng'))
+        zoom = min(max(int(request.args.get('zoom', 10)), 0), ZOOM_MAXIMO)
+        vista = [float(v) for v in request.args['vista'].split(',')] if request.args.get('vista') else None
+    except (KeyError, ValueError):
+        return error_api("Indique swlat, swlng, nelat, nelng y zoom numéricos.")
+    resultado = obtener_resultados_area(sw_lat, sw_lng, ne_lat, ne_lng, request.args.get('fuente', 'inaturalist'),
+                                        request.args.get('source_filter', 'mixta'),
+                                        request.args.get('order_date', 'desc'), 1)
+    plantas = resultado.plantas
+    if vista and len(vista) == 4:
+        plantas = [
+            p for p in plantas
+            if isinstance(p.get("latitud"), (int, float)) and isinstance(p.get("longitud"), (int, float))
+            and vista[0] <= p["latitud"] <= vista[2] and vista[1] <= p["longitud"] <= vista[3]
+        ]
+    campos = campos_pedidos(request.args.get('campos'), CAMPOS_API_AREA)
+    datos = features_agrupadas(agrupar(plantas, zoom), campos)
+    datos["zoom"] = zoom
+    return respuesta_json(datos, request)
+
+@app.route('/tiles/<int:z>/<int:x>/<int:y>')
+def tesela_densidad(z, x, y):
+    """
+    Conteos precalculados de la tabla plantas en la tesela (z, x, y) de OSM: total, por género
+    y por celda de 16x16. Con ?genero= solo se cuentan las de ese género.
+    """
+    if not (0 <= z <= ZOOM_MAXIMO_PIRAMIDE and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return error_api(f"Tesela fuera de rango (zoom máximo {ZOOM_MAXIMO_PIRAMIDE}).", 404)
+    cuerpo = datos_plantas.tesela_densidad(z, x, y, request.args.get('genero', ''))
+    if cuerpo is None:
+        return error_api("La pirámide de densidad no existe; ejecute python base_de_datos.py datos.db", 503)
+    return respuesta_json(cuerpo, request, tipo="application/json")
+
+@app.route('/trabajos/<id_trabajo>')
+def estado_trabajo(id_trabajo):
+    """Estado de un trabajo y sus eventos desde ?desde=n, para clientes que prefieren consultar a escuchar."""
+    trabajo = gestor_trabajos.obtener(id_trabajo)
+    if trabajo is None:
+        return error_api("Trabajo no encontrado.", 404)
+    desde = request.args.get('desde', 0, type=int)
+    eventos, _ = trabajo.esperar_eventos(desde, timeout=0)
+    return jsonify(dict(trabajo.resumen(), desde=desde,
+                        lista=[{"evento": evento, "datos": datos} for evento, datos in eventos]))
+
+@app.route('/trabajos/<id_trabajo>/eventos')
+def eventos_trabajo(id_trabajo):
+    """
+    Eventos de un trabajo como Server-Sent Events: "plantas" con cada página o género,
+    "descripciones" y "fin" (o "error"). Acepta Last-Event-ID para reanudar tras una
+    reconexión. La conexión queda abierta mientras dura el trabajo, así que con workers
+    síncronos conviene gunicorn con --threads o un worker asíncrono.
+    """
+    trabajo = gestor_trabajos.obtener(id_trabajo)
+    if trabajo is None:
+        return error_api("Trabajo no encontrado.", 404)
+    try:
+        desde = int(request.headers.get('Last-Event-ID', -1)) + 1
+    except ValueError:
+        desde = 0
+
+    def generar():
+        indice = desde
+        while True:
+            eventos, terminado = trabajo.esperar_eventos(indice, timeout=15)
+            if not eventos and not terminado:
+                # Comentario SSE para que los proxies no cierren la conexión
+                yield ": sigue\n\n"
+                continue
+            for evento, datos in eventos:
+                yield formato_sse(indice, evento, datos)
+                indice += 1
+            if terminado:
+                return
+
+    return Response(generar(), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/descripciones', methods=['POST'])
+def descripciones():
+    """Devuelve {nombre: descripcion} para los nombres científicos enviados en el JSON {"nombres": [...]}."""
+    datos = request.get_json(silent=True) or {}
+    nombres = [n for n in datos.get("nombres", []) if isinstance(n, str)][:200]
+    return jsonify(descripciones_wikipedia.obtener_lote(nombres))
+
+@app.route('/cache/estadisticas')
+def estadisticas_cache():
+    """
+    Tasa de aciertos y antigüedad por tesela de la caché de observaciones, uso de las cachés de
+    taxones, resultados y geocodificación, y búsquedas idénticas agrupadas en una sola descarga.
+    """
+    return jsonify(dict(cache_observaciones.estadisticas(), taxones=cache_taxones.estadisticas(),
+                        resultados_area=cache_resultados_area.estadisticas(),
+                        geocodificacion=geocodificador.estadisticas(),
+                        descripciones=descripciones_wikipedia.cache.estadisticas(),
+                        coalescencia={"area": aggregator.coalescedor.estadisticas(),
+                                      "busquedas": COALESCEDOR_BUSQUEDAS.estadisticas()}))
+
+@app.route('/metrics')
+def metricas():
+    """
+    Métricas en el formato de texto de Prometheus: duración de las peticiones web y de cada
+    etapa de las búsquedas, peticiones externas por host (duración, tamaño y espera en el
+    limitador), consultas a las cachés, búsquedas agrupadas y trabajos en segundo plano.
+    """
+    return Response(registro_metricas.exponer(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.route('/http/estadisticas')
+def estadisticas_http():
+    """Peticiones, errores, reintentos, latencia y conexiones reutilizadas por servicio externo."""
+    return jsonify(cliente_http.cliente.estadisticas())
 
 @app.route('/seleccionar_area')
 def seleccionar_area():
@@ -1,25 +1,66 @@
+import contextvars
+import copy
 import os
-import requests
-from math import radians, cos, sin, sqrt, atan2
+import threading
+import time
+import cliente_http
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
+from math import radians, cos, sin, sqrt, atan2, floor
 from dotenv import load_dotenv  # Opcional: solo si quieres cargar un archivo .env
+from registro import obtener_logger
+from paginacion_inaturalist import iterar_observaciones
+from limitador_tasa import LimiteTasaExcedido
+from coalescencia import Coalescedor
+from resultados_area import redondear_bbox
+from metricas import medir
 
 base_dir = os.path.dirname(os.path.abspath(__file__))
 dotenv_path = os.path.join(base_dir, "api-keys.env")
 
 # Cargar variables de entorno desde un archivo .env (solo en desarrollo)
 load_dotenv("api-keys.env")
-print("TREFLE_API_KEY:", os.environ.get("TREFLE_API_KEY"))
+logger = obtener_logger(__name__)
+logger.debug("TREFLE_API_KEY configurada: %s", bool(os.environ.get("TREFLE_API_KEY")))
 
 class AreaDataAggregator:
+    # Consultas simultáneas por fuente (se pueden sobrescribir con `max_concurrencia`)
+    # En "todas" cada búsqueda ocupa un hilo por fuente mientras espera a sus géneros
+    MAX_CONCURRENCIA_POR_DEFECTO = {"inaturalist": 4, "plantnet": 4, "trefle": 4, "todas": 12}
+    FUENTES = ("inaturalist", "plantnet", "trefle")
+    # Segundos de más que se espera a una fuente tras el plazo para que recoja los géneros terminados
+    MARGEN_TODAS = 0.5
+    METROS_POR_GRADO = 111320
+    # Valores de relleno que no cuentan al elegir el registro más completo de un duplicado
+    VALORES_VACIOS = frozenset({"", "N/A", "Desconocida", "Desconocido", "Sin descripción", "Fecha desconocida",
+                                "No disponible", "Sin nombre común"})
+    GENEROS_NO_SOPORTADOS_TREFLE = {"Alga", "Hongo", "Líquen", "Briófito", "Pteridófito"}
+
     def __init__(self, generos_interes,
                  inaturalist_api_base_url="https://api.inaturalist.org/v1",
                  plantnet_api_base_url="https://api.plantnet.org/v2",
-                 trefle_api_base_url="https://trefle.io/api/v1"):
+                 trefle_api_base_url="https://trefle.io/api/v1",
+                 cache=None, max_concurrencia=None, timeout_total=20, max_registros_por_genero=200,
+                 tolerancia_duplicados_m=25):
         """
         Inicializa el agregador con la lista de géneros de interés y las URLs base de las APIs.
         Se ha reemplazado USDA/GBIF por Trefle, y se obtienen las API keys desde variables de entorno.
+        Si se indica `cache` (CacheObservaciones), las observaciones de iNaturalist se sirven desde él.
+        Las consultas por género se lanzan en paralelo (hasta `max_concurrencia[fuente]` a la vez)
+        y cada búsqueda espera como máximo `timeout_total` segundos.
+        De iNaturalist se recorren con cursor hasta `max_registros_por_genero` observaciones por género.
+        Al mezclar fuentes, la misma planta a menos de `tolerancia_duplicados_m` metros se une.
         """
         self.generos_interes = generos_interes
+        self.cache = cache
+        self.max_concurrencia = dict(self.MAX_CONCURRENCIA_POR_DEFECTO, **(max_concurrencia or {}))
+        self.timeout_total = timeout_total
+        self.max_registros_por_genero = max_registros_por_genero
+        self.tolerancia_duplicados_m = tolerancia_duplicados_m
+        self._pools = {}
+        self._pools_lock = threading.Lock()
+        # Búsquedas idénticas simultáneas (p. ej. un enlace compartido) comparten la descarga
+        self.coalescedor = Coalescedor("obtener_datos_area")
         self.inaturalist_api_base_url = inaturalist_api_base_url
         self.plantnet_api_base_url = plantnet_api_base_url
         self.trefle_api_base_url = trefle_api_base_url
@@ -29,6 +70,8 @@ class AreaDataAggregator:
         self.trefle_api_key = os.environ.get("TREFLE_API_KEY", "")
         
         self.imagen_generica_cache = {}
+        self.aciertos_imagen = 0
+        self.fallos_imagen = 0
 
     @staticmethod
     def extraer_genero(nombre_cientifico):
@@ -43,16 +86,19 @@ class AreaDataAggregator:
 
     def obtener_imagen_generica(self, genero):
         if genero in self.imagen_generica_cache:
+            self.aciertos_imagen += 1
             return self.imagen_generica_cache[genero]
+        self.fallos_imagen += 1
 
         headers = {'User-Agent': 'TuApp/1.0'}
         try:
-            response = requests.get(
-                f"{self.inaturalist_api_base_url}/taxa",
-                params={"q": genero, "per_page": 1},
-                headers=headers,
-                timeout=10
-            )
+            with medir("imagen_generica"):
+                response = cliente_http.get(
+                    f"{self.inaturalist_api_base_url}/taxa",
+                    params={"q": genero, "per_page": 1},
+                    headers=headers,
+                    timeout=10
+                )
             if response.ok:
                 resultados = response.json().get("results", [])
                 if resultados:
@@ -64,38 +110,142 @@ class AreaDataAggregator:
                         self.imagen_generica_cache[genero] = imagen_url
                         return imagen_url
         except Exception as e:
-            print(f"Error obteniendo imagen para {genero}: {e}")
+            logger.warning("Error obteniendo imagen para %s: %s", genero, e)
 
         default_img = "https://via.placeholder.com/100?text=No+Image"
         self.imagen_generica_cache[genero] = default_img
         return default_img
 
-    def procesar_inaturalist(self, swlat, swlng, nelat, nelng):
+    def _descargar_tesela_inaturalist(self, params, headers, swlat, swlng, nelat, nelng, max_registros,
+                                      deadline=None):
+        """Descarga las observaciones de una tesela de la caché con los filtros del género."""
+        params_tesela = dict(params, swlat=swlat, swlng=swlng, nelat=nelat, nelng=nelng)
+        return [
+            obs
+            for pagina in iterar_observaciones(
+                params_tesela,
+                url=f"{self.inaturalist_api_base_url}/observations",
+                max_registros=max_registros,
+                headers=headers,
+                timeout=15,
+                deadline=deadline
+            )
+            for obs in pagina
+        ]
+
+    def _pool(self, fuente):
+        """Devuelve el pool de hilos de una fuente, creándolo la primera vez."""
+        with self._pools_lock:
+            if fuente not in self._pools:
+                self._pools[fuente] = ThreadPoolExecutor(
+                    max_workers=self.max_concurrencia.get(fuente, 4),
+                    thread_name_prefix=f"area-{fuente}"
+                )
+            return self._pools[fuente]
+
+    def _repartir_generos(self, fuente, consultar_genero, bbox, deadline=None, estado=None, progreso=None):
+        """
+        Ejecuta `consultar_genero(genero, *bbox)` para cada género de interés en el pool de la fuente.
+
+        Los resultados se concatenan en el orden de `generos_interes`, igual que la versión
+        secuencial. Los géneros que no terminan antes de `deadline` (en time.monotonic) se
+        omiten y, si se pasa un diccionario `estado`, se anotan en estado["generos_pendientes"].
+        Con `progreso` se llama a progreso(fuente, genero, plantas) en cuanto termina cada
+        género a tiempo, desde el hilo que lo consultó.
+        """
+        if deadline is None:
+            deadline = time.monotonic() + self.timeout_total
+        pool = self._pool(fuente)
+        # Cada género se consulta con el contexto del llamador (prioridad en el limitador y Server-Timing)
+        futuros = [pool.submit(contextvars.copy_context().run, consultar_genero, genero, *bbox)
+                   for genero in self.generos_interes]
+        if progreso is not None:
+            for genero, futuro in zip(self.generos_interes, futuros):
+                futuro.add_done_callback(partial(self._avisar_progreso, progreso, fuente, genero, deadline))
+        wait(futuros, timeout=max(deadline - time.monotonic(), 0))
+
+        plantas = []
+        pendientes = []
+        for genero, futuro in zip(self.generos_interes, futuros):
+            if futuro.done() and futuro.exception() is None:
+                plantas.extend(futuro.result())
+            elif not futuro.done():
+                futuro.cancel()
+                pendientes.append(genero)
+        if pendientes:
+            logger.warning("Géneros sin respuesta a tiempo en %s: %s", fuente, pendientes)
+        if estado is not None:
+            estado.setdefault("generos_pendientes", {})[fuente] = pendientes
+        return plantas
+
+    @staticmethod
+    def _avisar_progreso(progreso, fuente, genero, deadline, futuro):
+        if not futuro.cancelled() and futuro.exception() is None and time.monotonic() <= deadline:
+            progreso(fuente, genero, futuro.result())
+
+    def procesar_inaturalist(self, swlat, swlng, nelat, nelng, deadline=None, estado=None, max_registros=None,
+                             progreso=None):
+        """
+        Con `max_registros` se piden como mucho esas observaciones por género en lugar de
+        `max_registros_por_genero`; los géneros que llegan al límite se anotan en
+        estado["generos_truncados"]["inaturalist"]. Los que no se consultan porque la cola del
+        limitador de peticiones no los atendería antes de `deadline` se anotan en
+        estado["generos_limitados"]["inaturalist"].
+        """
+        if deadline is None:
+            deadline = time.monotonic() + self.timeout_total
+        truncados = set()
+        limitados = set()
+        consultar = partial(self._consultar_inaturalist_genero, max_registros=max_registros, truncados=truncados,
+                            deadline=deadline, limitados=limitados)
+        plantas = self._repartir_generos("inaturalist", consultar, (swlat, swlng, nelat, nelng), deadline, estado,
+                                         progreso)
+        if estado is not None:
+            estado.setdefault("generos_truncados", {})["inaturalist"] = sorted(truncados)
+            estado.setdefault("generos_limitados", {})["inaturalist"] = sorted(limitados)
+        return plantas
+
+    def _consultar_inaturalist_genero(self, genero, swlat, swlng, nelat, nelng, max_registros=None, truncados=None,
+                                      deadline=None, limitados=None):
         plantas = []
+        max_registros = max_registros or self.max_registros_por_genero
         headers = {'User-Agent': 'TuApp/1.0'}
-        for genero in self.generos_interes:
-            params = {
-                "taxon_name": genero,
-                "per_page": 50,
-                "swlat": swlat,
-                "swlng": swlng,
-                "nelat": nelat,
-                "nelng": nelng,
-                "fields": "taxon,observed_on,description,identifications_count,quality_grade,latitude,longitude,location",
-                "iconic_taxa[]": "Plantae",  # Filtra solo observaciones de plantas
-                "order": "desc",            # Ordena resultados (más recientes primero)
-                "order_by": "created_at"
-            }
-            try:
-                response = requests.get(
-                    f"{self.inaturalist_api_base_url}/observations",
-                    params=params,
+        params = {
+            "taxon_name": genero,
+            "swlat": swlat,
+            "swlng": swlng,
+            "nelat": nelat,
+            "nelng": nelng,
+            "fields": "id,taxon,observed_on,description,identifications_count,quality_grade,latitude,longitude,location",
+            "iconic_taxa[]": "Plantae"  # Filtra solo observaciones de plantas
+        }
+        try:
+            paginas = None
+            if self.cache is not None:
+                resultados = self.cache.consultar(
+                    f"area:{genero}", swlat, swlng, nelat, nelng,
+                    lambda *bbox_y_limite: self._descargar_tesela_inaturalist(params, headers, *bbox_y_limite,
+                                                                              deadline=deadline),
+                    max_registros=max_registros
+                )
+                if resultados is not None:
+                    paginas = [resultados]
+            # Solo la consulta directa se corta en max_registros; la caché devuelve todo lo que tiene
+            limitadas = paginas is None
+            if limitadas:
+                # Se recorren todas las páginas necesarias con cursor hasta el límite por género
+                paginas = iterar_observaciones(
+                    params,
+                    url=f"{self.inaturalist_api_base_url}/observations",
+                    max_registros=max_registros,
                     headers=headers,
-                    timeout=15
+                    timeout=15,
+                    deadline=deadline
                 )
-                response.raise_for_status()
-                resultados = response.json().get("results", [])
-                print(f"Observaciones para '{genero}' en iNaturalist: {len(resultados)}")
+            recibidas = 0
+            for resultados in paginas:
+                logger.debug("Observaciones para '%s' en iNaturalist: %d", genero, len(resultados))
+                recibidas += len(resultados)
                 for obs in resultados:
                     # Verificar que el objeto 'taxon' exista y que iconic_taxon_name esté definido y sea 'Plantae'
                     taxon = obs.get("taxon", {})
@@ -120,7 +270,7 @@ class AreaDataAggregator:
 
                     # Solo incluir observaciones con coordenadas válidas
                     if planta_lat is None or planta_lng is None or (planta_lat == 0 and planta_lng == 0):
-                        print(f"Coordenadas no válidas para {nombre_cientifico}, saltando observación")
+                        logger.debug("Coordenadas no válidas para %s, saltando observación", nombre_cientifico)
                         continue
 
                     plantas.append({
@@ -136,156 +286,317 @@ class AreaDataAggregator:
                         "imagen_generica": self.obtener_imagen_generica(self.extraer_genero(nombre_cientifico)),
                         "fuente": "iNaturalist"
                     })
+            if truncados is not None and limitadas and recibidas >= max_registros:
+                truncados.add(genero)
 
-            except Exception as e:
-                print(f"Error en iNaturalist para {genero}: {e}")
+        except LimiteTasaExcedido as e:
+            logger.warning("iNaturalist para %s omitido por el limitador de peticiones: %s", genero, e)
+            if limitados is not None:
+                limitados.add(genero)
+        except Exception as e:
+            logger.warning("Error en iNaturalist para %s: %s", genero, e)
         return plantas
 
-    def procesar_trefle(self, swlat, swlng, nelat, nelng):
+    def procesar_trefle(self, swlat, swlng, nelat, nelng, deadline=None, estado=None, progreso=None):
         """
         Consulta la API de Trefle para obtener información de plantas.
         Como Trefle no permite búsqueda por coordenadas, se realiza una búsqueda
         por cada género de interés. Los campos de latitud y longitud se asignan como 'Desconocida'.
         """
-        generos_no_soportados = {"Alga", "Hongo", "Líquen", "Briófito", "Pteridófito"}
-        
+        plantas = self._repartir_generos("trefle", self._consultar_trefle_genero,
+                                         (swlat, swlng, nelat, nelng), deadline, estado, progreso)
+        logger.info("Total de plantas procesadas en Trefle: %d", len(plantas))
+        return plantas
+
+    def _consultar_trefle_genero(self, genero, swlat, swlng, nelat, nelng):
         plantas = []
         headers = {'User-Agent': 'TuApp/1.0'}
-        for genero in self.generos_interes:
-            if genero in generos_no_soportados:
-                print(f"El género '{genero}' no es compatible con Trefle. Se omite la consulta.")
-                continue
+        if genero in self.GENEROS_NO_SOPORTADOS_TREFLE:
+            logger.debug("El género '%s' no es compatible con Trefle. Se omite la consulta.", genero)
+            return plantas
 
-            params = {
-                "q": genero,
-                "token": self.trefle_api_key,
-                "limit": 50
-            }
-            try:
-                url = f"{self.trefle_api_base_url}/plants/search"
-                print(f"\nBuscando en Trefle para el género: {genero}")
-                print(f"URL: {url}")
-                print(f"Parámetros: {params}")
-                response = requests.get(url, params=params, headers=headers, timeout=15)
-                print(f"Status code: {response.status_code}")
-                if response.status_code != 200:
-                    print(f"Error en la respuesta de Trefle para {genero}")
-                    continue
+        params = {
+            "q": genero,
+            "token": self.trefle_api_key,
+            "limit": 50
+        }
+        try:
+            url = f"{self.trefle_api_base_url}/plants/search"
+            logger.debug("Buscando en Trefle para el género %s en %s (limit=%s)", genero, url, params["limit"])
+            response = cliente_http.get(url, params=params, headers=headers, timeout=15)
+            if response.status_code != 200:
+                logger.warning("Error en la respuesta de Trefle para %s: %s", genero, response.status_code)
+                return plantas
 
-                data = response.json()
-                plant_list = data.get("data", [])
-                print(f"Número de resultados para {genero}: {len(plant_list)}")
-                if plant_list:
-                    print(f"Ejemplo del primer resultado: {plant_list[0]}")
+            data = response.json()
+            plant_list = data.get("data", [])
+            logger.debug("Número de resultados para %s: %d", genero, len(plant_list))
 
-                for planta_data in plant_list:
-                    nombre_cientifico = planta_data.get("scientific_name")
-                    if not self.es_nombre_cientifico_valido(nombre_cientifico):
-                        print(f"Nombre científico no válido: {nombre_cientifico}")
-                        continue
+            for planta_data in plant_list:
+                nombre_cientifico = planta_data.get("scientific_name")
+                if not self.es_nombre_cientifico_valido(nombre_cientifico):
+                    logger.debug("Nombre científico no válido: %s", nombre_cientifico)
+                    continue
 
-                    common_name = planta_data.get("common_name", "Sin nombre común")
-                    family = planta_data.get("family", "Sin familia")
-                    descripcion = f"Nombre común: {common_name}. Familia: {family}."
+                common_name = planta_data.get("common_name", "Sin nombre común")
+                family = planta_data.get("family", "Sin familia")
+                descripcion = f"Nombre común: {common_name}. Familia: {family}."
 
-                    planta = {
-                        "nombre_cientifico": nombre_cientifico.strip(),
-                        "genero": self.extraer_genero(nombre_cientifico),
-                        "latitud": "Desconocida",
-                        "longitud": "Desconocida",
-                        "distancia": "N/A",
-                        "fecha_observacion": "No disponible",
-                        "identificaciones": 1,
-                        "calidad": "Datos oficiales Trefle",
-                        "descripcion": descripcion,
-                        "imagen_generica": planta_data.get("image_url") or self.obtener_imagen_generica(self.extraer_genero(nombre_cientifico)),
-                        "fuente": "Trefle"
-                    }
-                    plantas.append(planta)
-                    print(f"Planta agregada: {planta}")
-
-            except Exception as e:
-                print(f"Error en Trefle para {genero}: {e}")
-        print(f"Total de plantas procesadas en Trefle: {len(plantas)}")
+                planta = {
+                    "nombre_cientifico": nombre_cientifico.strip(),
+                    "genero": self.extraer_genero(nombre_cientifico),
+                    "latitud": "Desconocida",
+                    "longitud": "Desconocida",
+                    "distancia": "N/A",
+                    "fecha_observacion": "No disponible",
+                    "identificaciones": 1,
+                    "calidad": "Datos oficiales Trefle",
+                    "descripcion": descripcion,
+                    "imagen_generica": planta_data.get("image_url") or self.obtener_imagen_generica(self.extraer_genero(nombre_cientifico)),
+                    "fuente": "Trefle"
+                }
+                plantas.append(planta)
+
+        except Exception as e:
+            logger.warning("Error en Trefle para %s: %s", genero, e)
         return plantas
 
-    def procesar_plantnet(self, swlat, swlng, nelat, nelng):
+    def procesar_plantnet(self, swlat, swlng, nelat, nelng, deadline=None, estado=None, progreso=None):
+        return self._repartir_generos("plantnet", self._consultar_plantnet_genero,
+                                      (swlat, swlng, nelat, nelng), deadline, estado, progreso)
+
+    def _consultar_plantnet_genero(self, genero, swlat, swlng, nelat, nelng):
         plantas = []
         headers = {'User-Agent': 'TuApp/1.0'}
-        for genero in self.generos_interes:
-            params = {
-                "taxon_name": genero,
-                "per_page": 50,
-                "swlat": swlat,
-                "swlng": swlng,
-                "nelat": nelat,
-                "nelng": nelng,
-                "api-key": self.plantnet_api_key
-            }
-            try:
-                response = requests.get(
-                    f"{self.plantnet_api_base_url}/observations",
-                    params=params,
-                    headers=headers,
-                    timeout=15
-                )
-                response.raise_for_status()
-                resultados = response.json().get("results", [])
-                print(f"Observaciones para '{genero}' en PlantNet: {len(resultados)}")
-                for obs in resultados:
-                    taxon = obs.get("taxon", {})
-                    nombre_cientifico = taxon.get("name", "Desconocido")
-                    if not self.es_nombre_cientifico_valido(nombre_cientifico):
-                        continue
+        params = {
+            "taxon_name": genero,
+            "per_page": 50,
+            "swlat": swlat,
+            "swlng": swlng,
+            "nelat": nelat,
+            "nelng": nelng,
+            "api-key": self.plantnet_api_key
+        }
+        try:
+            response = cliente_http.get(
+                f"{self.plantnet_api_base_url}/observations",
+                params=params,
+                headers=headers,
+                timeout=15
+            )
+            response.raise_for_status()
+            resultados = response.json().get("results", [])
+            logger.debug("Observaciones para '%s' en PlantNet: %d", genero, len(resultados))
+            for obs in resultados:
+                taxon = obs.get("taxon", {})
+                nombre_cientifico = taxon.get("name", "Desconocido")
+                if not self.es_nombre_cientifico_valido(nombre_cientifico):
+                    continue
 
-                    planta_lat = obs.get("latitude")
-                    planta_lng = obs.get("longitude")
-                    if planta_lat is None or planta_lng is None:
-                        loc = obs.get("location", "")
-                        if loc and "," in loc:
-                            try:
-                                planta_lat, planta_lng = map(float, loc.split(","))
-                            except ValueError:
-                                planta_lat, planta_lng = None, None
+                planta_lat = obs.get("latitude")
+                planta_lng = obs.get("longitude")
+                if planta_lat is None or planta_lng is None:
+                    loc = obs.get("location", "")
+                    if loc and "," in loc:
+                        try:
+                            planta_lat, planta_lng = map(float, loc.split(","))
+                        except ValueError:
+                            planta_lat, planta_lng = None, None
 
-                    plantas.append({
-                        "nombre_cientifico": nombre_cientifico,
-                        "genero": self.extraer_genero(nombre_cientifico),
-                        "latitud": planta_lat or "Desconocida",
-                        "longitud": planta_lng or "Desconocida",
-                        "distancia": "N/A",
-                        "fecha_observacion": obs.get("observed_on", "Fecha desconocida"),
-                        "identificaciones": obs.get("identifications_count", 0),
-                        "calidad": obs.get("quality_grade", "Desconocido"),
-                        "descripcion": obs.get("description", "Sin descripción"),
-                        "imagen_generica": self.obtener_imagen_generica(self.extraer_genero(nombre_cientifico)),
-                        "fuente": "PlantNet"
-                    })
+                plantas.append({
+                    "nombre_cientifico": nombre_cientifico,
+                    "genero": self.extraer_genero(nombre_cientifico),
+                    "latitud": planta_lat or "Desconocida",
+                    "longitud": planta_lng or "Desconocida",
+                    "distancia": "N/A",
+                    "fecha_observacion": obs.get("observed_on", "Fecha desconocida"),
+                    "identificaciones": obs.get("identifications_count", 0),
+                    "calidad": obs.get("quality_grade", "Desconocido"),
+                    "descripcion": obs.get("description", "Sin descripción"),
+                    "imagen_generica": self.obtener_imagen_generica(self.extraer_genero(nombre_cientifico)),
+                    "fuente": "PlantNet"
+                })
 
-            except Exception as e:
-                print(f"Error en PlantNet para {genero}: {e}")
+        except Exception as e:
+            logger.warning("Error en PlantNet para %s: %s", genero, e)
         return plantas
 
-    def agregar_resultados(self, resultados_listas):
-        resultados_combinados = []
-        vistas = set()
-        for fuente in resultados_listas:
-            for planta in fuente:
-                clave = (planta["nombre_cientifico"], planta["latitud"], planta["longitud"])
-                if clave not in vistas:
-                    vistas.add(clave)
-                    resultados_combinados.append(planta)
-        return resultados_combinados
-
-    def obtener_datos_area(self, swlat, swlng, nelat, nelng, fuente):
+    def procesar_todas(self, swlat, swlng, nelat, nelng, deadline=None, estado=None, max_registros=None,
+                       progreso=None):
+        """
+        Consulta todas las fuentes a la vez con el mismo `deadline` y mezcla sus observaciones
+        con agregar_resultados, en el orden de FUENTES.
+
+        Cada fuente omite los géneros que no terminan a tiempo, así que se devuelve en cuanto
+        han terminado todas o vence el plazo, con lo que haya llegado. En estado["fuentes"]
+        queda la situación de cada una: "completa", "parcial" (faltan géneros), "agotada" (no
+        llegó nada a tiempo) o "error"; el resto del estado de cada fuente se añade también.
+        """
+        if deadline is None:
+            deadline = time.monotonic() + self.timeout_total
+        bbox = (swlat, swlng, nelat, nelng)
+        consultas = {
+            "inaturalist": partial(self.procesar_inaturalist, *bbox, deadline, max_registros=max_registros,
+                                   progreso=progreso),
+            "plantnet": partial(self.procesar_plantnet, *bbox, deadline, progreso=progreso),
+            "trefle": partial(self.procesar_trefle, *bbox, deadline, progreso=progreso),
+        }
+        estados = {fuente: {} for fuente in self.FUENTES}
+        pool = self._pool("todas")
+        futuros = {fuente: pool.submit(contextvars.copy_context().run, consultas[fuente], estado=estados[fuente])
+                   for fuente in self.FUENTES}
+        wait(futuros.values(), timeout=max(deadline - time.monotonic(), 0) + self.MARGEN_TODAS)
+
+        listas = []
+        situacion = {}
+        for fuente, futuro in futuros.items():
+            if not futuro.done():
+                situacion[fuente] = "agotada"
+                continue
+            if futuro.exception() is not None:
+                logger.warning("Error en %s durante la búsqueda en todas las fuentes: %s", fuente, futuro.exception())
+                situacion[fuente] = "error"
+                continue
+            listas.append(futuro.result())
+            faltan = any(estados[fuente].get(clave, {}).get(fuente)
+                         for clave in ("generos_pendientes", "generos_limitados"))
+            if not faltan:
+                situacion[fuente] = "completa"
+            else:
+                situacion[fuente] = "parcial" if futuro.result() else "agotada"
+            if estado is not None:
+                for clave, valor in estados[fuente].items():
+                    if isinstance(valor, dict):
+                        estado.setdefault(clave, {}).update(valor)
+                    else:
+                        estado[clave] = valor
+        if estado is not None:
+            estado["fuentes"] = situacion
+        logger.info("Búsqueda en todas las fuentes: %s", situacion)
+        return self.agregar_resultados(listas)
+
+    @staticmethod
+    def _coordenadas(planta):
+        lat, lon = planta.get("latitud"), planta.get("longitud")
+        if isinstance(lat, (int, float)) and isinstance(lon, (int, float)):
+            return float(lat), float(lon)
+        return None
+
+    @classmethod
+    def _riqueza(cls, planta):
+        """Campos con información real y, para desempatar, identificaciones."""
+        campos = sum(1 for v in planta.values()
+                     if v is not None and not (isinstance(v, str) and v in cls.VALORES_VACIOS))
+        identificaciones = planta.get("identificaciones")
+        return campos, identificaciones if isinstance(identificaciones, (int, float)) else 0
+
+    def agregar_resultados(self, resultados_listas, tolerancia_m=None):
+        """
+        Une las listas de varias fuentes quitando los duplicados, en tiempo lineal.
+
+        Dos registros son la misma planta si tienen el mismo nombre científico y están a
+        `tolerancia_m` metros o menos (por defecto `tolerancia_duplicados_m`), y vienen de
+        fuentes distintas o tienen exactamente las mismas coordenadas: dos observaciones
+        cercanas de la misma fuente son plantas distintas. Las coordenadas se reparten en
+        una rejilla de celdas de al menos la tolerancia de lado, así que cada registro solo
+        se compara con los de su nombre en su celda y las ocho vecinas. Los registros sin
+        coordenadas (Trefle) se unen solo con los de igual nombre, fuente y fecha.
+
+        De cada grupo se conserva el registro más completo (ver _riqueza) en la posición
+        del primero que llegó.
+        """
+        tolerancia = self.tolerancia_duplicados_m if tolerancia_m is None else tolerancia_m
+        registros = [(planta, self._coordenadas(planta)) for lista in resultados_listas for planta in lista]
+        # Lado de celda en grados: en longitud se usa el de la latitud más alejada del ecuador,
+        # donde un grado mide menos, para que ninguna celda quede más estrecha que la tolerancia
+        paso_lat = max(tolerancia, 1e-3) / self.METROS_POR_GRADO
+        lat_maxima = max((abs(c[0]) for _, c in registros if c is not None), default=0)
+        paso_lon = paso_lat / max(cos(radians(min(lat_maxima + paso_lat, 90))), 1e-6)
+        tolerancia_cuadrada = tolerancia ** 2
+
+        combinados = []
+        celdas = {}
+        sin_coordenadas = {}
+        for planta, coordenadas in registros:
+            nombre = planta.get("nombre_cientifico")
+            fuente = planta.get("fuente")
+            if coordenadas is None:
+                clave = (nombre, fuente, planta.get("fecha_observacion"))
+                indice = sin_coordenadas.get(clave)
+                if indice is None:
+                    sin_coordenadas[clave] = len(combinados)
+                    combinados.append(planta)
+                elif self._riqueza(planta) > self._riqueza(combinados[indice]):
+                    combinados[indice] = planta
+                continue
+
+            lat, lon = coordenadas
+            fila, columna = floor(lat / paso_lat), floor(lon / paso_lon)
+            grupo = None
+            for df in (-1, 0, 1):
+                for dc in (-1, 0, 1):
+                    for candidato in celdas.get((nombre, fila + df, columna + dc), ()):
+                        lat2, lon2, _, fuentes = candidato
+                        if fuente in fuentes and (lat, lon) != (lat2, lon2):
+                            continue
+                        dy = (lat - lat2) * self.METROS_POR_GRADO
+                        dx = (lon - lon2) * self.METROS_POR_GRADO * cos(radians((lat + lat2) / 2))
+                        if dx * dx + dy * dy <= tolerancia_cuadrada:
+                            grupo = candidato
+                            break
+                    if grupo is not None:
+                        break
+                if grupo is not None:
+                    break
+
+            if grupo is None:
+                celdas.setdefault((nombre, fila, columna), []).append((lat, lon, len(combinados), {fuente}))
+                combinados.append(planta)
+                continue
+            grupo[3].add(fuente)
+            indice = grupo[2]
+            if self._riqueza(planta) > self._riqueza(combinados[indice]):
+                combinados[indice] = planta
+        return combinados
+
+    def obtener_datos_area(self, swlat, swlng, nelat, nelng, fuente, timeout=None, estado=None, max_registros=None,
+                           progreso=None):
+        """
+        Observaciones del bbox en `fuente`, de más a menos identificaciones.
+
+        Las llamadas simultáneas con el mismo bbox redondeado, fuente, límite y géneros se
+        resuelven con una sola descarga; cada una recibe su propia lista y una copia del estado.
+        Con `progreso` (ver _repartir_generos) se avisa de cada género según termina; esas
+        llamadas no se agrupan con otras, porque solo la que descarga recibiría los avisos.
+        """
+        if progreso is not None:
+            resultados, estado_descarga = self._descargar_area(swlat, swlng, nelat, nelng, fuente, timeout,
+                                                               max_registros, progreso)
+            if estado is not None:
+                estado.update(estado_descarga)
+            return resultados
+        clave = (redondear_bbox(swlat, swlng, nelat, nelng), fuente, max_registros, tuple(self.generos_interes))
+        resultados, estado_descarga = self.coalescedor.ejecutar(
+            clave, lambda: self._descargar_area(swlat, swlng, nelat, nelng, fuente, timeout, max_registros)
+        )
+        if estado is not None:
+            estado.update(copy.deepcopy(estado_descarga))
+        return list(resultados)
+
+    def _descargar_area(self, swlat, swlng, nelat, nelng, fuente, timeout, max_registros, progreso=None):
+        estado = {}
+        deadline = time.monotonic() + (self.timeout_total if timeout is None else timeout)
         if fuente == "inaturalist":
-            resultados = self.procesar_inaturalist(swlat, swlng, nelat, nelng)
+            resultados = self.procesar_inaturalist(swlat, swlng, nelat, nelng, deadline, estado, max_registros,
+                                                   progreso)
         elif fuente == "plantnet":
-            resultados = self.procesar_plantnet(swlat, swlng, nelat, nelng)
+            resultados = self.procesar_plantnet(swlat, swlng, nelat, nelng, deadline, estado, progreso)
         elif fuente == "trefle":
-            resultados = self.procesar_trefle(swlat, swlng, nelat, nelng)
+            resultados = self.procesar_trefle(swlat, swlng, nelat, nelng, deadline, estado, progreso)
+        elif fuente == "todas":
+            resultados = self.procesar_todas(swlat, swlng, nelat, nelng, deadline, estado, max_registros, progreso)
         else:
             resultados = []
         
         resultados.sort(key=lambda x: x.get("identificaciones", 0), reverse=True)
-        return resultados
+        return resultados, estado
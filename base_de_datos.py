@@ -1,60 +1,462 @@
+import math
+import os
+import re
 import sqlite3
+import sys
+import threading
+import time
+import weakref
+import numpy as np
 import pandas as pd
+from distancias import RADIO_TIERRA_KM, calcular_distancias
+import piramide_densidad
+from registro import obtener_logger
+
+logger = obtener_logger(__name__)
+
+# Dos números con signo y decimales opcionales, separados por coma, espacio o punto y coma
+PATRON_UBICACION = re.compile(r"(-?\d+(?:\.\d+)?)\s*[,; ]\s*(-?\d+(?:\.\d+)?)")
+# Kilómetros por grado de latitud
+KM_POR_GRADO = math.pi * RADIO_TIERRA_KM / 180
+COLUMNAS_PLANTAS = ("id", "nombre", "genero", "ubicacion", "fecha", "latitud", "longitud")
+
+# Ajustes de cada conexión: WAL deja leer mientras otro proceso escribe y synchronous=NORMAL
+# es seguro con WAL; la caché de páginas (KiB en negativo) y mmap evitan releer el archivo
+PRAGMAS_CONEXION = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": int(os.environ.get("SQLITE_CACHE_KIB", -20000)),
+    "mmap_size": int(os.environ.get("SQLITE_MMAP_BYTES", 256 * 1024 * 1024)),
+    "temp_store": "MEMORY",
+}
+# Segundos que una escritura espera a que se libere el bloqueo antes de dar "database is locked"
+TIMEOUT_BLOQUEO = float(os.environ.get("SQLITE_TIMEOUT_BLOQUEO", 30))
+
+# Consultas frecuentes como constantes: sqlite3 guarda la sentencia preparada por texto SQL
+# en cada conexión, así que al reutilizar la conexión no se vuelven a compilar
+SQL_NOMBRES_POR_GENERO = "SELECT nombre_cientifico FROM grupos_plantas WHERE genero = ?"
+SQL_GENEROS = "SELECT DISTINCT genero FROM grupos_plantas"
+
+
+def interpretar_ubicacion(texto):
+    """
+    Convierte el texto libre de `ubicacion` en (lat, lon) o (None, None) si no se entiende.
+    Acepta "lat, lon", "lat lon", "(lat; lon)" y "POINT(lon lat)" (WKT, con la longitud primero).
+    """
+    if not texto:
+        return None, None
+    m = PATRON_UBICACION.search(texto)
+    if not m:
+        return None, None
+    lat, lon = float(m.group(1)), float(m.group(2))
+    if texto.lstrip().upper().startswith("POINT"):
+        lat, lon = lon, lat
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None, None
+    return lat, lon
+
+
+def bbox_desde_radio_km(lat, lon, radio_km):
+    """Rectángulo (swlat, swlng, nelat, nelng) que contiene el círculo de `radio_km` alrededor del punto."""
+    dlat = radio_km / KM_POR_GRADO
+    cos_lat = math.cos(math.radians(lat))
+    # Si el círculo alcanza un polo abarca todas las longitudes
+    if lat + dlat >= 90 or lat - dlat <= -90 or cos_lat < 1e-9:
+        dlon = 180
+    else:
+        dlon = min(radio_km / (KM_POR_GRADO * cos_lat), 180)
+    swlng, nelng = lon - dlon, lon + dlon
+    if dlon >= 180:
+        swlng, nelng = -180, 180
+    else:
+        # Se devuelve en [-180, 180]; si cruza el antimeridiano swlng > nelng
+        swlng = (swlng + 180) % 360 - 180
+        nelng = (nelng + 180) % 360 - 180
+    return max(lat - dlat, -90), swlng, min(lat + dlat, 90), nelng
+
+
+class _ConexionHilo:
+    """Conexión de un hilo; al terminar el hilo se libera y su finalizador cierra la conexión."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.pid = os.getpid()
+
+
+def _cerrar_conexion_hilo(conn, pid, conexiones, lock):
+    with lock:
+        conexiones.discard(conn)
+    # Una conexión heredada de otro proceso no se toca: cerrarla afectaría a la del padre
+    if os.getpid() != pid:
+        return
+    try:
+        conn.close()
+    except sqlite3.Error:
+        pass
+
 
 class BaseDeDatos:
+    """
+    Acceso a la base SQLite con una conexión persistente por hilo.
+
+    Cada hilo reutiliza su conexión (ya con el esquema cargado y la caché de páginas
+    caliente) en lugar de abrir una por consulta. La conexión se cierra cuando su hilo
+    termina, así que los hilos de vida corta del servidor threaded no acumulan conexiones
+    abiertas. Si el proceso se bifurca, como hacen los
+    workers de gunicorn con --preload, el hijo abre conexiones nuevas en vez de heredar
+    las del padre.
+    """
+
     def __init__(self, db_file='plantas.db'):
         self.db_file = db_file
+        self._local = threading.local()
+        self._conexiones = set()
+        # Reentrante: el finalizador de una conexión puede ejecutarse en cualquier punto del hilo
+        self._lock = threading.RLock()
+
+    def _conexion(self):
+        """Devuelve la conexión del hilo actual, abriéndola y configurándola la primera vez."""
+        propia = getattr(self._local, "propia", None)
+        if propia is not None and propia.pid == os.getpid():
+            return propia.conn
+        conn = sqlite3.connect(self.db_file, timeout=TIMEOUT_BLOQUEO, cached_statements=256,
+                               check_same_thread=False)
+        for pragma, valor in PRAGMAS_CONEXION.items():
+            conn.execute(f"PRAGMA {pragma} = {valor}")
+        propia = _ConexionHilo(conn)
+        # El hilo es el único que guarda `propia` (en su threading.local): al terminar se recoge
+        weakref.finalize(propia, _cerrar_conexion_hilo, conn, propia.pid, self._conexiones, self._lock)
+        self._local.propia = propia
+        with self._lock:
+            self._conexiones.add(conn)
+        return conn
+
+    def cerrar(self):
+        """Cierra todas las conexiones abiertas por esta instancia."""
+        with self._lock:
+            conexiones = list(self._conexiones)
+            self._conexiones.clear()
+        for conn in conexiones:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+
+    def migrar_plantas_espaciales(self, tamano_lote=10000):
+        """
+        Prepara la tabla `plantas` (datos.db) para consultas geográficas. Es idempotente:
+          - añade las columnas numéricas latitud/longitud y las rellena interpretando `ubicacion`;
+          - crea el índice R*Tree `plantas_rtree` y los triggers que lo mantienen al día;
+          - crea índices sobre genero y fecha;
+          - recalcula la pirámide de densidad que sirve /tiles (piramide_densidad).
+        Devuelve el número de filas con coordenadas válidas.
+        """
+        conn = self._conexion()
+        try:
+            columnas = {fila[1] for fila in conn.execute("PRAGMA table_info(plantas)")}
+            if "latitud" not in columnas:
+                conn.execute("ALTER TABLE plantas ADD COLUMN latitud REAL")
+            if "longitud" not in columnas:
+                conn.execute("ALTER TABLE plantas ADD COLUMN longitud REAL")
+
+            # Se interpretan por lotes de id solo las filas que aún no tienen coordenadas
+            ultimo_id = -1
+            while True:
+                filas = conn.execute(
+                    "SELECT id, ubicacion FROM plantas WHERE id > ? AND latitud IS NULL ORDER BY id LIMIT ?",
+                    (ultimo_id, tamano_lote)
+                ).fetchall()
+                if not filas:
+                    break
+                ultimo_id = filas[-1][0]
+                coordenadas = [(*interpretar_ubicacion(ubicacion), fila_id) for fila_id, ubicacion in filas]
+                conn.executemany("UPDATE plantas SET latitud = ?, longitud = ? WHERE id = ?",
+                                 [c for c in coordenadas if c[0] is not None])
+
+            conn.executescript('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS plantas_rtree USING rtree(
+                    id, min_lat, max_lat, min_lon, max_lon
+                );
+                CREATE TRIGGER IF NOT EXISTS plantas_rtree_insertar AFTER INSERT ON plantas
+                WHEN NEW.latitud IS NOT NULL AND NEW.longitud IS NOT NULL BEGIN
+                    INSERT INTO plantas_rtree VALUES (NEW.id, NEW.latitud, NEW.latitud, NEW.longitud, NEW.longitud);
+                END;
+                CREATE TRIGGER IF NOT EXISTS plantas_rtree_actualizar AFTER UPDATE OF latitud, longitud ON plantas BEGIN
+                    DELETE FROM plantas_rtree WHERE id = OLD.id;
+                    INSERT INTO plantas_rtree
+                    SELECT NEW.id, NEW.latitud, NEW.latitud, NEW.longitud, NEW.longitud
+                    WHERE NEW.latitud IS NOT NULL AND NEW.longitud IS NOT NULL;
+                END;
+                CREATE TRIGGER IF NOT EXISTS plantas_rtree_borrar AFTER DELETE ON plantas BEGIN
+                    DELETE FROM plantas_rtree WHERE id = OLD.id;
+                END;
+                CREATE INDEX IF NOT EXISTS idx_plantas_genero ON plantas(genero);
+                CREATE INDEX IF NOT EXISTS idx_plantas_fecha ON plantas(fecha);
+            ''')
+            # El R*Tree se reconstruye entero para recoger filas anteriores a los triggers
+            conn.execute("DELETE FROM plantas_rtree")
+            conn.execute('''
+                INSERT INTO plantas_rtree
+                SELECT id, latitud, latitud, longitud, longitud FROM plantas
+                WHERE latitud IS NOT NULL AND longitud IS NOT NULL
+            ''')
+            piramide_densidad.reconstruir(conn)
+            conn.commit()
+            total = conn.execute("SELECT COUNT(*) FROM plantas_rtree").fetchone()[0]
+            logger.info("Migración espacial de %s completada: %d filas con coordenadas.", self.db_file, total)
+            return total
+        except Exception:
+            conn.rollback()
+            raise
+
+    def importar_plantas(self, df):
+        """
+        Añade observaciones a la tabla `plantas` (columnas nombre, genero, ubicacion, fecha y,
+        opcionalmente, latitud y longitud) ya migrada con migrar_plantas_espaciales.
+        Si no vienen coordenadas se interpretan de `ubicacion`. En la misma transacción se
+        actualiza la pirámide de densidad, así que /tiles refleja la importación sin recalcularla.
+        """
+        if df.empty:
+            logger.warning("No se encontraron datos válidos para importar.")
+            return 0
+        filas = []
+        for registro in df.to_dict("records"):
+            lat, lon = registro.get("latitud"), registro.get("longitud")
+            if lat is None or lon is None or pd.isna(lat) or pd.isna(lon):
+                lat, lon = interpretar_ubicacion(registro.get("ubicacion"))
+            filas.append((registro["nombre"], registro["genero"], registro.get("ubicacion"),
+                          registro.get("fecha"), lat, lon))
+        conn = self._conexion()
+        with conn:
+            conn.executemany(
+                "INSERT INTO plantas (nombre, genero, ubicacion, fecha, latitud, longitud) VALUES (?, ?, ?, ?, ?, ?)",
+                filas
+            )
+            con_coordenadas = [f for f in filas if f[4] is not None]
+            if con_coordenadas and piramide_densidad.existe(conn):
+                piramide_densidad.acumular(conn, [f[4] for f in con_coordenadas],
+                                           [f[5] for f in con_coordenadas], [f[1] for f in con_coordenadas])
+        logger.info("Importadas %d plantas (%d con coordenadas).", len(filas), len(con_coordenadas))
+        return len(filas)
+
+    def tesela_densidad(self, z, x, y, genero=""):
+        """JSON de la tesela (z, x, y) de la pirámide de densidad, o None si la pirámide no existe."""
+        conn = self._conexion()
+        if not piramide_densidad.existe(conn):
+            return None
+        return piramide_densidad.leer_tesela(conn, z, x, y, genero)
+
+    def buscar_en_bbox(self, swlat, swlng, nelat, nelng, genero=None, limite=None):
+        """
+        Devuelve las plantas dentro del rectángulo como lista de diccionarios, usando el R*Tree.
+        Si swlng > nelng el rectángulo cruza el antimeridiano.
+        """
+        if swlng <= nelng:
+            rangos = [(swlng, nelng)]
+        else:
+            rangos = [(swlng, 180), (-180, nelng)]
+        condicion = " OR ".join(
+            "(r.min_lat <= ? AND r.max_lat >= ? AND r.min_lon <= ? AND r.max_lon >= ?)" for _ in rangos
+        )
+        parametros = [v for oeste, este in rangos for v in (nelat, swlat, este, oeste)]
+        query = (f"SELECT {', '.join('p.' + c for c in COLUMNAS_PLANTAS)} "
+                 # CROSS JOIN fija el R*Tree como tabla exterior: sin él, con un género muy común
+                 # SQLite prefiere idx_plantas_genero y recorre todas las filas de ese género
+                 f"FROM plantas_rtree r CROSS JOIN plantas p ON p.id = r.id WHERE ({condicion})")
+        if genero:
+            query += " AND p.genero = ?"
+            parametros.append(genero)
+        if limite is not None:
+            query += " LIMIT ?"
+            parametros.append(int(limite))
+        filas = self._conexion().execute(query, parametros).fetchall()
+        return [dict(zip(COLUMNAS_PLANTAS, fila)) for fila in filas]
+
+    def buscar_en_radio(self, lat, lon, radio_km, genero=None, limite=None):
+        """
+        Devuelve las plantas a `radio_km` o menos de (lat, lon), de la más cercana a la más lejana,
+        con su distancia en `distancia_km`. El R*Tree descarta lo que queda fuera del rectángulo
+        que contiene al círculo y la distancia exacta se calcula solo para los candidatos.
+        """
+        candidatas = self.buscar_en_bbox(*bbox_desde_radio_km(lat, lon, radio_km), genero=genero)
+        if not candidatas:
+            return []
+        distancias = calcular_distancias(lat, lon, [p["latitud"] for p in candidatas],
+                                         [p["longitud"] for p in candidatas])
+        indices = np.flatnonzero(distancias <= radio_km)
+        indices = indices[np.argsort(distancias[indices], kind="stable")]
+        if limite is not None:
+            indices = indices[:limite]
+        return [dict(candidatas[i], distancia_km=float(distancias[i])) for i in indices]
+
+    def buscar_mas_cercanas(self, lat, lon, k=10, genero=None, radio_inicial_km=1):
+        """
+        Devuelve las `k` plantas más cercanas a (lat, lon), de la más cercana a la más lejana.
+        El radio de búsqueda se duplica hasta reunir k plantas o cubrir todo el planeta.
+        """
+        radio = radio_inicial_km
+        while True:
+            plantas = self.buscar_en_radio(lat, lon, radio, genero=genero, limite=k)
+            if len(plantas) >= k or radio >= math.pi * RADIO_TIERRA_KM:
+                return plantas
+            radio *= 2
 
     def initialize(self):
         """Crea la tabla en la base de datos si no existe."""
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS grupos_plantas (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                nombre_cientifico TEXT,
-                nombre_comun TEXT,
-                familia TEXT,
-                genero TEXT,
-                descripcion TEXT
-            )
-        ''')
-        conn.commit()
-        conn.close()
+        conn = self._conexion()
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS grupos_plantas (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    nombre_cientifico TEXT,
+                    nombre_comun TEXT,
+                    familia TEXT,
+                    genero TEXT,
+                    descripcion TEXT
+                )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_grupos_plantas_genero ON grupos_plantas(genero)")
+
+    def _columnas_grupos(self, conn):
+        return [fila[1] for fila in conn.execute("PRAGMA table_info(grupos_plantas)")]
+
+    def _asegurar_clave_nombre(self, conn):
+        """
+        Crea el índice único sobre nombre_cientifico que usan las inserciones con upsert.
+        Si la tabla ya tenía nombres repetidos se conserva la última fila de cada uno.
+        """
+        existe = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_grupos_plantas_nombre'"
+        ).fetchone()
+        if existe:
+            return
+        with conn:
+            borradas = conn.execute('''
+                DELETE FROM grupos_plantas WHERE rowid NOT IN (
+                    SELECT MAX(rowid) FROM grupos_plantas GROUP BY nombre_cientifico
+                )
+            ''').rowcount
+            if borradas:
+                logger.warning("Eliminadas %d filas con nombre_cientifico repetido.", borradas)
+            conn.execute("CREATE UNIQUE INDEX idx_grupos_plantas_nombre ON grupos_plantas(nombre_cientifico)")
 
-    def importar_datos_iniciales(self, ruta_csv):
-        """Importa datos iniciales desde un archivo CSV."""
+    def _sql_upsert(self, columnas):
+        actualizar = [c for c in columnas if c != "nombre_cientifico"]
+        return (
+            f"INSERT INTO grupos_plantas ({', '.join(columnas)}) VALUES ({', '.join('?' * len(columnas))}) "
+            "ON CONFLICT(nombre_cientifico) DO "
+            + (f"UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in actualizar)}" if actualizar else "NOTHING")
+        )
+
+    def _filas_lote(self, df, columnas):
+        """Filas del DataFrame en el orden de `columnas`, con None en lugar de NaN."""
+        df = df[columnas].astype(object)
+        return list(df.where(df.notna(), None).itertuples(index=False, name=None))
+
+    def _columnas_importables(self, conn, columnas_origen):
+        columnas_tabla = self._columnas_grupos(conn)
+        columnas = [c for c in columnas_origen if c in columnas_tabla and c != "id"]
+        ignoradas = [c for c in columnas_origen if c not in columnas]
+        if ignoradas:
+            logger.warning("Columnas sin correspondencia en grupos_plantas, se ignoran: %s", ignoradas)
+        if "nombre_cientifico" not in columnas:
+            raise ValueError("Los datos deben incluir la columna nombre_cientifico.")
+        return columnas
+
+    def importar_datos_iniciales(self, ruta_csv, tamano_lote=50000):
+        """
+        Importa un CSV por lotes, sin cargarlo entero en memoria.
+
+        Cada lote se inserta con executemany en una sola transacción y con upsert por
+        nombre_cientifico, así que repetir la importación no duplica filas. Los índices
+        secundarios se eliminan al empezar y se recrean al final. El avance se guarda en la
+        tabla `importaciones` dentro de la misma transacción que cada lote: si la importación
+        se interrumpe, la siguiente llamada con el mismo archivo continúa donde quedó.
+        Devuelve un diccionario con filas, segundos y filas_por_segundo.
+        """
         try:
-            df = pd.read_csv(ruta_csv)
-            conn = sqlite3.connect(self.db_file)
-            df.to_sql('grupos_plantas', conn, if_exists='replace', index=False)
-            conn.commit()
-            conn.close()
-            print(f"Datos iniciales importados desde {ruta_csv}.")
+            conn = self._conexion()
+            self.initialize()
+            self._asegurar_clave_nombre(conn)
+            with conn:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS importaciones (
+                        ruta TEXT PRIMARY KEY,
+                        tamano INTEGER,
+                        modificado REAL,
+                        filas INTEGER,
+                        completada INTEGER
+                    )
+                ''')
+            info = os.stat(ruta_csv)
+            ruta = os.path.abspath(ruta_csv)
+            progreso = conn.execute(
+                "SELECT filas FROM importaciones WHERE ruta = ? AND tamano = ? AND modificado = ? AND completada = 0",
+                (ruta, info.st_size, info.st_mtime)
+            ).fetchone()
+            ya_importadas = progreso[0] if progreso else 0
+            if ya_importadas:
+                logger.info("Reanudando la importación de %s desde la fila %d.", ruta_csv, ya_importadas)
+
+            with conn:
+                conn.execute("DROP INDEX IF EXISTS idx_grupos_plantas_genero")
+
+            inicio = time.perf_counter()
+            filas = ya_importadas
+            # skiprows como función para no construir un conjunto con todas las filas ya importadas
+            lotes = pd.read_csv(ruta_csv, chunksize=tamano_lote,
+                                skiprows=(lambda i: 0 < i <= ya_importadas) if ya_importadas else None)
+            sql = columnas = None
+            for lote in lotes:
+                if sql is None:
+                    columnas = self._columnas_importables(conn, list(lote.columns))
+                    sql = self._sql_upsert(columnas)
+                with conn:
+                    conn.executemany(sql, self._filas_lote(lote, columnas))
+                    filas += len(lote)
+                    conn.execute(
+                        "INSERT OR REPLACE INTO importaciones VALUES (?, ?, ?, ?, 0)",
+                        (ruta, info.st_size, info.st_mtime, filas)
+                    )
+                logger.info("Importadas %d filas de %s (%.0f filas/s).", filas, ruta_csv,
+                            (filas - ya_importadas) / (time.perf_counter() - inicio))
+
+            with conn:
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_grupos_plantas_genero ON grupos_plantas(genero)")
+                conn.execute("UPDATE importaciones SET completada = 1 WHERE ruta = ?", (ruta,))
+            segundos = time.perf_counter() - inicio
+            resumen = {
+                "filas": filas - ya_importadas,
+                "segundos": round(segundos, 3),
+                "filas_por_segundo": round((filas - ya_importadas) / segundos) if segundos else None
+            }
+            logger.info("Datos iniciales importados desde %s: %s", ruta_csv, resumen)
+            return resumen
         except Exception as e:
-            print(f"Error al importar datos iniciales: {e}")
+            logger.error("Error al importar datos iniciales: %s", e)
 
     def importar_datos(self, df):
-        """Importa un DataFrame a la tabla de SQLite."""
-        conn = sqlite3.connect(self.db_file)
+        """Importa un DataFrame a la tabla de SQLite, actualizando las filas con el mismo nombre_cientifico."""
         if not df.empty:
-            df.to_sql('grupos_plantas', conn, if_exists='append', index=False)
-            print("Datos importados exitosamente a la base de datos.")
+            conn = self._conexion()
+            self._asegurar_clave_nombre(conn)
+            columnas = self._columnas_importables(conn, list(df.columns))
+            with conn:
+                conn.executemany(self._sql_upsert(columnas), self._filas_lote(df, columnas))
+            logger.info("Datos importados exitosamente a la base de datos.")
         else:
-            print("No se encontraron datos válidos para importar.")
-        conn.commit()
-        conn.close()
+            logger.warning("No se encontraron datos válidos para importar.")
 
     def obtener_grupos(self, filtro=None):
         """Devuelve los nombres científicos de los grupos en la base de datos."""
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
+        conn = self._conexion()
         if filtro:
-            query = "SELECT nombre_cientifico FROM grupos_plantas WHERE genero = ?"
-            cursor.execute(query, (filtro,))
+            cursor = conn.execute(SQL_NOMBRES_POR_GENERO, (filtro,))
         else:
-            query = "SELECT DISTINCT genero FROM grupos_plantas"
-            cursor.execute(query)
-        grupos = [row[0] for row in cursor.fetchall()]
-        conn.close()
-        return grupos
+            cursor = conn.execute(SQL_GENEROS)
+        return [row[0] for row in cursor.fetchall()]
+
+if __name__ == "__main__":
+    # python base_de_datos.py [datos.db]: migra la tabla plantas para consultas geográficas
+    BaseDeDatos(sys.argv[1] if len(sys.argv) > 1 else "datos.db").migrar_plantas_espaciales()
@@ -0,0 +1,183 @@
+"""
+Benchmark de AreaDataAggregator.agregar_resultados (unión de fuentes con casi-duplicados).
+
+Genera filas sintéticas de iNaturalist, PlantNet y Trefle: parte de las plantas aparece en
+varias fuentes con las coordenadas movidas unos metros (cambios en el quinto decimal), hay
+repeticiones exactas dentro de una fuente y Trefle trae filas sin coordenadas
+("Desconocida"). Para cada tamaño mide el mejor tiempo de --repeticiones y lo compara con
+la deduplicación anterior por (nombre, latitud, longitud) exactos. Si el coste por fila
+crece con el tamaño más de --tolerancia, la unión ha dejado de ser lineal y el programa
+termina con código 1. El margen por defecto es amplio porque con más filas los diccionarios
+dejan de caber en la caché y hasta la deduplicación exacta se encarece por fila; una unión
+cuadrática lo multiplicaría por 20 entre 10.000 y 200.000 filas.
+
+Antes de medir comprueba con n pequeño que la rejilla da los mismos grupos que comparar
+todos los pares (O(n²)).
+
+Uso:
+    python benchmarks/bench_agregar_resultados.py [--tamanos 10000,50000,100000,200000]
+    python benchmarks/bench_agregar_resultados.py --tolerancia-m 50 --repeticiones 5
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+from math import cos, radians
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from area_data import AreaDataAggregator  # noqa: E402
+
+CENTRO = (37.39, -5.98)
+# Grados alrededor del centro donde caen las plantas (unos 20 km)
+DISPERSION = 0.18
+GENEROS = ["Quercus", "Rosa", "Pinus", "Salvia", "Thymus", "Lavandula", "Olea", "Cistus", "Rubus", "Prunus"]
+
+
+def _fila(nombre, lat, lon, fuente, azar):
+    return {
+        "nombre_cientifico": nombre,
+        "nombre_comun": azar.choice(["N/A", "Encina", "Romero"]),
+        "latitud": lat,
+        "longitud": lon,
+        "fecha_observacion": f"2024-0{azar.randint(1, 9)}-1{azar.randint(0, 9)}",
+        "imagen_url": azar.choice(["N/A", "https://example.org/foto.jpg"]),
+        "descripcion": azar.choice(["Sin descripción", "Arbusto perenne"]),
+        "fuente": fuente,
+    }
+
+
+def generar_fuentes(tamano, semilla=7):
+    """Tres listas con `tamano` filas en total, ~30 % casi-duplicadas entre fuentes."""
+    azar = random.Random(semilla)
+    especies = [f"{g} especie{i}" for g in GENEROS for i in range(40)]
+    inaturalist, plantnet, trefle = [], [], []
+    while len(inaturalist) + len(plantnet) + len(trefle) < tamano:
+        nombre = azar.choice(especies)
+        lat = round(CENTRO[0] + azar.uniform(-DISPERSION, DISPERSION), 6)
+        lon = round(CENTRO[1] + azar.uniform(-DISPERSION, DISPERSION), 6)
+        inaturalist.append(_fila(nombre, lat, lon, "iNaturalist", azar))
+        tirada = azar.random()
+        if tirada < 0.3:
+            # La misma planta en PlantNet, unos metros desplazada
+            plantnet.append(_fila(nombre, round(lat + azar.uniform(-3e-5, 3e-5), 6),
+                                  round(lon + azar.uniform(-3e-5, 3e-5), 6), "PlantNet", azar))
+        elif tirada < 0.35:
+            # Repetida tal cual (dos géneros que devuelven la misma observación)
+            inaturalist.append(dict(inaturalist[-1]))
+        elif tirada < 0.45:
+            fila = _fila(nombre, "Desconocida", "Desconocida", "Trefle", azar)
+            fila["fecha_observacion"] = "Fecha desconocida"
+            trefle.append(fila)
+    return [inaturalist, plantnet, trefle]
+
+
+def agregar_exacto(resultados_listas):
+    """La deduplicación anterior, como referencia de coste."""
+    resultados_combinados = []
+    vistas = set()
+    for fuente in resultados_listas:
+        for planta in fuente:
+            clave = (planta["nombre_cientifico"], planta["latitud"], planta["longitud"])
+            if clave not in vistas:
+                vistas.add(clave)
+                resultados_combinados.append(planta)
+    return resultados_combinados
+
+
+def agregar_por_pares(agregador, resultados_listas, tolerancia_m):
+    """Misma regla que la rejilla comparando con todos los grupos ya formados; solo para verificar."""
+    grupos = []
+    for planta in (p for lista in resultados_listas for p in lista):
+        coordenadas = agregador._coordenadas(planta)
+        for grupo in grupos:
+            primera, primeras_coordenadas, fuentes = grupo
+            if primera["nombre_cientifico"] != planta["nombre_cientifico"]:
+                continue
+            if coordenadas is None or primeras_coordenadas is None:
+                if coordenadas is None and primeras_coordenadas is None and \
+                        (primera["fuente"], primera["fecha_observacion"]) == \
+                        (planta["fuente"], planta["fecha_observacion"]):
+                    break
+                continue
+            if planta["fuente"] in fuentes and coordenadas != primeras_coordenadas:
+                continue
+            (lat, lon), (lat2, lon2) = coordenadas, primeras_coordenadas
+            dy = (lat - lat2) * AreaDataAggregator.METROS_POR_GRADO
+            dx = (lon - lon2) * AreaDataAggregator.METROS_POR_GRADO * cos(radians((lat + lat2) / 2))
+            if dx * dx + dy * dy <= tolerancia_m ** 2:
+                fuentes.add(planta["fuente"])
+                break
+        else:
+            grupos.append((planta, coordenadas, {planta["fuente"]}))
+    return len(grupos)
+
+
+def verificar(agregador, tolerancia_m):
+    fuentes = generar_fuentes(1500, semilla=11)
+    rejilla = len(agregador.agregar_resultados(fuentes, tolerancia_m))
+    pares = agregar_por_pares(agregador, fuentes, tolerancia_m)
+    exacto = len(agregar_exacto(fuentes))
+    print(f"Verificación con {sum(map(len, fuentes))} filas: rejilla {rejilla} grupos, "
+          f"todos los pares {pares}, exacto {exacto}")
+    if rejilla != pares:
+        print("La rejilla no coincide con la comparación por pares")
+        sys.exit(1)
+
+
+def medir(funcion, repeticiones):
+    """Mejor tiempo de `repeticiones`, sin el recolector de basura (como timeit)."""
+    tiempos = []
+    for _ in range(repeticiones):
+        gc.collect()
+        gc.disable()
+        try:
+            inicio = time.perf_counter()
+            funcion()
+            tiempos.append(time.perf_counter() - inicio)
+        finally:
+            gc.enable()
+    return min(tiempos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tamanos", default="10000,50000,100000,200000", help="filas totales separadas por comas")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--tolerancia-m", type=float, default=25, help="metros para unir casi-duplicados")
+    parser.add_argument("--tolerancia", type=float, default=1.5,
+                        help="crecimiento admitido del coste por fila entre el menor y el mayor tamaño (1.5 = 150 %%)")
+    args = parser.parse_args()
+
+    os.environ.setdefault("HUNTERLEAF_LOG_LEVEL", "WARNING")
+    agregador = AreaDataAggregator(None, None, None, None, tolerancia_duplicados_m=args.tolerancia_m)
+    verificar(agregador, args.tolerancia_m)
+
+    print(f"\n{'filas':>8}{'resultado':>11}{'exacto':>9}{'rejilla s':>11}{'µs/fila':>9}{'exacto s':>10}{'µs/fila':>9}")
+    costes = []
+    costes_exacto = []
+    for tamano in [int(t) for t in args.tamanos.split(",")]:
+        fuentes = generar_fuentes(tamano)
+        filas = sum(map(len, fuentes))
+        unidas = len(agregador.agregar_resultados(fuentes))
+        exactas = len(agregar_exacto(fuentes))
+        rejilla = medir(lambda: agregador.agregar_resultados(fuentes), args.repeticiones)
+        exacto = medir(lambda: agregar_exacto(fuentes), args.repeticiones)
+        costes.append(rejilla / filas)
+        costes_exacto.append(exacto / filas)
+        print(f"{filas:>8}{unidas:>11}{exactas:>9}{rejilla:>11.4f}{rejilla / filas * 1e6:>9.2f}"
+              f"{exacto:>10.4f}{exacto / filas * 1e6:>9.2f}")
+
+    crecimiento = costes[-1] / costes[0] - 1
+    print(f"\nCoste por fila del mayor tamaño frente al menor: {crecimiento:+.0%} "
+          f"(exacto: {costes_exacto[-1] / costes_exacto[0] - 1:+.0%})")
+    if crecimiento > args.tolerancia:
+        print("La unión crece más que linealmente")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Compara el clasificador taxonómico precompilado con la comprobación original término a término.
+
+Verifica que ambos den el mismo veredicto para cada taxón y categoría del corpus y mide el
+tiempo de clasificar una página de 200 observaciones (primera vez y repetida).
+
+Uso:
+    python benchmarks/bench_clasificador_taxonomico.py
+    python benchmarks/bench_clasificador_taxonomico.py --corpus ancestros_log.txt
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from clasificador_taxonomico import ClasificadorTaxonomico  # noqa: E402
+from procesador_archivo import CATEGORIA_MAPPING  # noqa: E402
+
+
+def cumple_original(mapping, ancestros):
+    """Comprobación anterior a ClasificadorTaxonomico, sin los print."""
+    terminos_encontrados = set()
+    for ancestro in ancestros:
+        rango = ancestro.get('rank', '').lower()
+        nombre = ancestro.get('name', '').lower()
+        if rango in mapping['ranks']:
+            for termino in mapping['terms']:
+                if termino in nombre:
+                    terminos_encontrados.add(termino)
+        for vernacular in ancestro.get('vernacular_names', []):
+            nombre_vernacular = vernacular.get('name', '').lower()
+            for termino in mapping['terms']:
+                if termino in nombre_vernacular:
+                    terminos_encontrados.add(termino)
+    return len(terminos_encontrados) > 0
+
+
+def leer_log_ancestros(ruta):
+    """
+    Lee una traza de ancestros y devuelve [(taxon_id, ancestros)].
+
+    Entiende el formato de HUNTERLEAF_TRAZA_ANCESTROS, una línea por taxón
+    ("<fecha> <pid> Taxon: X (ID: n) Ancestros: rank=name; rank=name"), y el del antiguo
+    ancestros_log.txt, con cada ancestro en su línea ("  Ancestro: rango=..., nombre=...").
+    """
+    corpus = []
+    patron_traza = re.compile(r"Taxon: .* \(ID: (\w+)\) Ancestros: (.*)$")
+    patron_taxon = re.compile(r"Taxon: .* \(ID: (\w+)\)")
+    patron_ancestro = re.compile(r"\s+Ancestro: rango=(.*), nombre=(.*)")
+    with open(ruta, encoding='utf-8') as f:
+        for linea in f:
+            linea = linea.rstrip("\n")
+            m = patron_traza.search(linea)
+            if m:
+                ancestros = []
+                for par in m.group(2).split("; "):
+                    rango, separador, nombre = par.partition("=")
+                    if separador:
+                        ancestros.append({'rank': rango, 'name': nombre})
+                corpus.append((int(m.group(1)) if m.group(1).isdigit() else None, ancestros))
+                continue
+            m = patron_taxon.match(linea)
+            if m:
+                taxon_id = int(m.group(1)) if m.group(1).isdigit() else None
+                corpus.append((taxon_id, []))
+                continue
+            m = patron_ancestro.match(linea)
+            if m and corpus:
+                corpus[-1][1].append({'rank': m.group(1), 'name': m.group(2)})
+    return corpus
+
+
+def corpus_sintetico(num_taxones=2000, semilla=42):
+    """Genera ancestros con la forma de los de iNaturalist, incluidos nombres vernáculos y casos límite."""
+    rnd = random.Random(semilla)
+    clases = [
+        ('class', 'Magnoliopsida'), ('class', 'Liliopsida'), ('class', 'Pinopsida'),
+        ('class', 'Polypodiopsida'), ('class', 'Lycopodiopsida'), ('class', 'Bryopsida'),
+        ('class', 'Florideophyceae'), ('class', 'Phaeophyceae'), ('subclass', 'Magnoliidae'),
+        ('phylum', 'Rhodophyta'), ('phylum', 'Chlorophyta'), ('phylum', 'Tracheophyta'),
+        ('order', 'Pinales'), ('order', 'Eudicots incertae sedis'), ('kingdom', 'Chromista'),
+    ]
+    vernaculos = ['Monocots', 'Eudicots', 'Gymnospermae', 'plantas con flor', 'helechos', '']
+    # Cada ancestro tiene siempre el mismo id, rango y nombres, como en iNaturalist
+    plantillas = []
+    for ancestro_id, (rango, nombre) in enumerate(clases, start=1):
+        ancestro = {'id': ancestro_id, 'rank': rango, 'name': nombre}
+        if rnd.random() < 0.4:
+            ancestro['vernacular_names'] = [{'name': rnd.choice(vernaculos)}]
+        plantillas.append(ancestro)
+    corpus = []
+    for taxon_id in range(1, num_taxones + 1):
+        ancestros = [{'id': 47126, 'rank': 'kingdom', 'name': 'Plantae'}]
+        ancestros.extend(rnd.sample(plantillas, rnd.randint(1, 4)))
+        ancestros.append({'id': 100000 + taxon_id, 'rank': 'genus', 'name': f'Genus{taxon_id}'})
+        corpus.append((taxon_id, ancestros))
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', help='traza de ancestros (HUNTERLEAF_TRAZA_ANCESTROS) o ancestros_log.txt')
+    parser.add_argument('--tamano-pagina', type=int, default=200)
+    args = parser.parse_args()
+
+    corpus = leer_log_ancestros(args.corpus) if args.corpus else corpus_sintetico()
+    if not corpus:
+        # Sin taxones no se compararía nada y la comprobación pasaría sin comprobar
+        print(f"No se encontró ningún taxón en {args.corpus}")
+        sys.exit(1)
+    clasificador = ClasificadorTaxonomico(CATEGORIA_MAPPING)
+
+    diferencias = 0
+    for categoria, mapping in CATEGORIA_MAPPING.items():
+        for taxon_id, ancestros in corpus:
+            if clasificador.cumple(categoria, ancestros, taxon_id) != cumple_original(mapping, ancestros):
+                diferencias += 1
+                print(f"Diferencia en {categoria} para el taxón {taxon_id}")
+    print(f"Corpus: {len(corpus)} taxones x {len(CATEGORIA_MAPPING)} categorías, diferencias: {diferencias}")
+
+    pagina = corpus[:args.tamano_pagina]
+    for categoria, mapping in CATEGORIA_MAPPING.items():
+        inicio = time.perf_counter()
+        for _, ancestros in pagina:
+            cumple_original(mapping, ancestros)
+        t_original = time.perf_counter() - inicio
+
+        frio = ClasificadorTaxonomico(CATEGORIA_MAPPING)
+        inicio = time.perf_counter()
+        for taxon_id, ancestros in pagina:
+            frio.cumple(categoria, ancestros, taxon_id)
+        t_frio = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        for taxon_id, ancestros in pagina:
+            frio.cumple(categoria, ancestros, taxon_id)
+        t_caliente = time.perf_counter() - inicio
+
+        print(f"{categoria:<12} original {t_original * 1e3:7.3f} ms | "
+              f"compilado {t_frio * 1e3:7.3f} ms | memorizado {t_caliente * 1e3:7.3f} ms")
+
+    sys.exit(1 if diferencias else 0)
+
+
+if __name__ == '__main__':
+    main()
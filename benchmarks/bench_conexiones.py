@@ -0,0 +1,158 @@
+"""
+Mide el rendimiento de BaseDeDatos con lecturas y escrituras concurrentes desde varios procesos.
+
+Cada proceso imita un worker de gunicorn con varios hilos que, durante unos segundos,
+llaman a obtener_grupos(genero) y, con la proporción indicada, a importar_datos con una
+fila con un nombre nuevo cada vez. Se comparan dos versiones sobre bases distintas con los
+mismos datos:
+  - original: una conexión nueva por llamada y el journal por defecto (copia del código anterior);
+  - actual: BaseDeDatos con conexión persistente por hilo, WAL y pragmas.
+La versión original añade filas y la actual hace upsert por nombre_cientifico (con índice
+único); como los nombres escritos no se repiten, las dos hacen el mismo trabajo.
+Se informa de operaciones por segundo, latencia de lectura y errores "database is locked".
+
+Uso:
+    python benchmarks/bench_conexiones.py [--workers 4] [--hilos 4] [--segundos 5] [--escrituras 0.1]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# El registro lee el nivel al importarse; el INFO de cada escritura falsearía la medida
+os.environ.setdefault("HUNTERLEAF_LOG_LEVEL", "WARNING")
+
+from base_de_datos import BaseDeDatos  # noqa: E402
+
+GENEROS = [f"Genero{i}" for i in range(200)]
+
+
+class BaseDeDatosOriginal:
+    """Métodos de BaseDeDatos antes de reutilizar conexiones, sin el registro."""
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+
+    def importar_datos(self, df):
+        conn = sqlite3.connect(self.db_file)
+        if not df.empty:
+            df.to_sql('grupos_plantas', conn, if_exists='append', index=False)
+        conn.commit()
+        conn.close()
+
+    def obtener_grupos(self, filtro=None):
+        conn = sqlite3.connect(self.db_file)
+        cursor = conn.cursor()
+        if filtro:
+            cursor.execute("SELECT nombre_cientifico FROM grupos_plantas WHERE genero = ?", (filtro,))
+        else:
+            cursor.execute("SELECT DISTINCT genero FROM grupos_plantas")
+        grupos = [row[0] for row in cursor.fetchall()]
+        conn.close()
+        return grupos
+
+
+def preparar(ruta, filas):
+    db = BaseDeDatos(ruta)
+    db.initialize()
+    rnd = random.Random(5)
+    db.importar_datos(pd.DataFrame({
+        "nombre_cientifico": [f"Especie {i}" for i in range(filas)],
+        "nombre_comun": ["" for _ in range(filas)],
+        "familia": [f"Familia{i % 30}" for i in range(filas)],
+        "genero": [rnd.choice(GENEROS) for _ in range(filas)],
+        "descripcion": ["" for _ in range(filas)],
+    }))
+    db.cerrar()
+
+
+def worker(version, ruta, hilos, segundos, proporcion_escrituras, cola):
+    db = BaseDeDatosOriginal(ruta) if version == "original" else BaseDeDatos(ruta)
+    resultados = []
+
+    def fila_nueva(semilla, numero):
+        return pd.DataFrame([{"nombre_cientifico": f"Nueva {semilla}-{numero}", "nombre_comun": "",
+                              "familia": "F", "genero": "Genero0", "descripcion": ""}])
+
+    def hilo(semilla):
+        rnd = random.Random(semilla)
+        lecturas, escrituras, bloqueos, latencias = 0, 0, 0, []
+        fin = time.monotonic() + segundos
+        while time.monotonic() < fin:
+            try:
+                if rnd.random() < proporcion_escrituras:
+                    db.importar_datos(fila_nueva(semilla, escrituras))
+                    escrituras += 1
+                else:
+                    inicio = time.perf_counter()
+                    db.obtener_grupos(rnd.choice(GENEROS))
+                    latencias.append(time.perf_counter() - inicio)
+                    lecturas += 1
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e):
+                    raise
+                bloqueos += 1
+        resultados.append((lecturas, escrituras, bloqueos, latencias))
+
+    hilos_activos = [threading.Thread(target=hilo, args=(os.getpid() * 100 + i,)) for i in range(hilos)]
+    for h in hilos_activos:
+        h.start()
+    for h in hilos_activos:
+        h.join()
+    cola.put(resultados)
+
+
+def ejecutar(version, ruta, args):
+    cola = multiprocessing.Queue()
+    procesos = [
+        multiprocessing.Process(target=worker, args=(version, ruta, args.hilos, args.segundos, args.escrituras, cola))
+        for _ in range(args.workers)
+    ]
+    for p in procesos:
+        p.start()
+    resultados = [r for _ in procesos for r in cola.get()]
+    for p in procesos:
+        p.join()
+    lecturas = sum(r[0] for r in resultados)
+    escrituras = sum(r[1] for r in resultados)
+    bloqueos = sum(r[2] for r in resultados)
+    latencias = sorted(l for r in resultados for l in r[3])
+    p50 = latencias[len(latencias) // 2] * 1e3 if latencias else 0
+    p95 = latencias[int(len(latencias) * 0.95)] * 1e3 if latencias else 0
+    print(f"{version:<9} {(lecturas + escrituras) / args.segundos:9.0f} op/s  "
+          f"lecturas {lecturas:7d}  escrituras {escrituras:5d}  bloqueos {bloqueos:4d}  "
+          f"lectura p50 {p50:6.2f} ms  p95 {p95:6.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--hilos", type=int, default=4)
+    parser.add_argument("--segundos", type=float, default=5)
+    parser.add_argument("--escrituras", type=float, default=0.1, help="proporción de operaciones de escritura")
+    parser.add_argument("--filas", type=int, default=50000)
+    args = parser.parse_args()
+
+    print(f"{args.workers} workers x {args.hilos} hilos, {args.segundos} s, {args.escrituras:.0%} escrituras")
+    with tempfile.TemporaryDirectory() as tmp:
+        for version in ("original", "actual"):
+            ruta = os.path.join(tmp, f"{version}.db")
+            preparar(ruta, args.filas)
+            if version == "original":
+                # Se deja la base con el journal por defecto, como la crearía el código anterior
+                conn = sqlite3.connect(ruta)
+                conn.execute("PRAGMA journal_mode = DELETE")
+                conn.close()
+            ejecutar(version, ruta, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Mide las consultas geográficas sobre la tabla plantas de datos.db antes y después de la migración espacial.
+
+Crea una copia temporal con filas sintéticas (por defecto tantas como datos.db, con la
+ubicación como texto "lat, lon" repartida por la Península) o copia la base indicada con
+--db, así que el archivo original nunca se modifica. Después:
+  - mide la consulta por bbox original: recorrer toda la tabla interpretando `ubicacion`;
+  - ejecuta BaseDeDatos.migrar_plantas_espaciales y mide su duración;
+  - mide buscar_en_bbox, buscar_en_radio y buscar_mas_cercanas y comprueba que el bbox
+    devuelve las mismas filas que el recorrido completo.
+
+Uso:
+    python benchmarks/bench_consultas_espaciales.py [--filas 211048] [--consultas 200]
+    python benchmarks/bench_consultas_espaciales.py --db datos.db
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from base_de_datos import BaseDeDatos, interpretar_ubicacion  # noqa: E402
+
+# Península Ibérica aproximada
+SWLAT, SWLNG, NELAT, NELNG = 36.0, -9.5, 43.8, 3.3
+GENEROS = ["Quercus", "Pinus", "Rosa", "Cistus", "Olea", "Juniperus", "Salvia", "Thymus"]
+
+
+def crear_base_sintetica(ruta, filas, semilla=3):
+    rnd = random.Random(semilla)
+    conn = sqlite3.connect(ruta)
+    conn.execute('''
+        CREATE TABLE plantas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nombre TEXT NOT NULL,
+            genero TEXT NOT NULL,
+            ubicacion TEXT,
+            fecha TEXT
+        )
+    ''')
+    conn.executemany(
+        "INSERT INTO plantas (nombre, genero, ubicacion, fecha) VALUES (?, ?, ?, ?)",
+        (
+            (f"{g} sp{i % 40}", g,
+             f"{rnd.uniform(SWLAT, NELAT):.6f}, {rnd.uniform(SWLNG, NELNG):.6f}",
+             f"20{rnd.randint(10, 24)}-0{rnd.randint(1, 9)}-1{rnd.randint(0, 9)}")
+            for i, g in ((i, rnd.choice(GENEROS)) for i in range(filas))
+        )
+    )
+    conn.commit()
+    conn.close()
+
+
+def bbox_por_recorrido(ruta, swlat, swlng, nelat, nelng):
+    """Consulta por bbox sin índice: lee toda la tabla e interpreta cada ubicación."""
+    conn = sqlite3.connect(ruta)
+    ids = set()
+    for fila_id, ubicacion in conn.execute("SELECT id, ubicacion FROM plantas"):
+        lat, lon = interpretar_ubicacion(ubicacion)
+        if lat is not None and swlat <= lat <= nelat and swlng <= lon <= nelng:
+            ids.add(fila_id)
+    conn.close()
+    return ids
+
+
+def bbox_aleatorio(rnd, lado):
+    lat = rnd.uniform(SWLAT, NELAT - lado)
+    lon = rnd.uniform(SWLNG, NELNG - lado)
+    return lat, lon, lat + lado, lon + lado
+
+
+def medir(funcion, argumentos):
+    tiempos = []
+    for args in argumentos:
+        inicio = time.perf_counter()
+        funcion(*args)
+        tiempos.append(time.perf_counter() - inicio)
+    tiempos.sort()
+    return statistics.median(tiempos) * 1e3, tiempos[int(len(tiempos) * 0.95) - 1] * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", help="base a copiar en lugar de generar datos sintéticos")
+    parser.add_argument("--filas", type=int, default=211048)
+    parser.add_argument("--consultas", type=int, default=200)
+    parser.add_argument("--lado", type=float, default=0.25, help="lado del bbox de consulta en grados")
+    args = parser.parse_args()
+
+    rnd = random.Random(11)
+    with tempfile.TemporaryDirectory() as tmp:
+        ruta = os.path.join(tmp, "datos.db")
+        if args.db:
+            shutil.copyfile(args.db, ruta)
+        else:
+            crear_base_sintetica(ruta, args.filas)
+        filas = sqlite3.connect(ruta).execute("SELECT COUNT(*) FROM plantas").fetchone()[0]
+        print(f"Filas en plantas: {filas}")
+
+        bboxes = [bbox_aleatorio(rnd, args.lado) for _ in range(args.consultas)]
+        t_recorrido, _ = medir(lambda *b: bbox_por_recorrido(ruta, *b), bboxes[:5])
+        print(f"bbox por recorrido completo (sin índice): {t_recorrido:9.2f} ms")
+
+        db = BaseDeDatos(ruta)
+        inicio = time.perf_counter()
+        con_coordenadas = db.migrar_plantas_espaciales()
+        print(f"Migración: {time.perf_counter() - inicio:.2f} s, {con_coordenadas} filas con coordenadas")
+
+        diferencias = sum(
+            {p["id"] for p in db.buscar_en_bbox(*b)} != bbox_por_recorrido(ruta, *b) for b in bboxes[:5]
+        )
+        print(f"Diferencias con el recorrido completo: {diferencias}")
+
+        mediana, p95 = medir(db.buscar_en_bbox, bboxes)
+        print(f"buscar_en_bbox ({args.lado}°):     mediana {mediana:7.2f} ms  p95 {p95:7.2f} ms")
+        puntos = [(b[0] + args.lado / 2, b[1] + args.lado / 2) for b in bboxes]
+        mediana, p95 = medir(db.buscar_en_radio, [(lat, lon, 10) for lat, lon in puntos])
+        print(f"buscar_en_radio (10 km):     mediana {mediana:7.2f} ms  p95 {p95:7.2f} ms")
+        mediana, p95 = medir(db.buscar_mas_cercanas, [(lat, lon, 20) for lat, lon in puntos])
+        print(f"buscar_mas_cercanas (k=20):  mediana {mediana:7.2f} ms  p95 {p95:7.2f} ms")
+        mediana, p95 = medir(lambda *b: db.buscar_en_bbox(*b, genero="Quercus"), bboxes)
+        print(f"buscar_en_bbox + genero:     mediana {mediana:7.2f} ms  p95 {p95:7.2f} ms")
+
+    sys.exit(1 if diferencias else 0)
+
+
+if __name__ == "__main__":
+    main()
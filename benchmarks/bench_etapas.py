@@ -0,0 +1,273 @@
+"""
+Micro-benchmarks de las etapas de CPU que crecen con el número de resultados.
+
+Genera observaciones sintéticas con la forma de las de iNaturalist (ancestros realistas
+de helechos, gimnospermas, angiospermas, musgos y algas, fechas, fotos y coordenadas
+alrededor del punto buscado) y mide por separado, sin red:
+  - distancia_escalar: ProcesadorDatos.calcular_distancia punto a punto;
+  - distancia_vectorial: distancias.filtrar_por_radio sobre todos los puntos;
+  - criterios_taxonomicos: _cumple_criterios_taxonomicos de cada observación (clasificador vacío);
+  - procesar_paginas: ProcesadorDatos._procesar_pagina en páginas de 200 (filtro completo de /buscar);
+  - plantas_para_plantilla: DataFrame -> registros -> plantas de resultados.html, con el
+    reparseo del texto "lat, lon" de /buscar;
+  - agregar_resultados: AreaDataAggregator.agregar_resultados de tres fuentes con duplicados;
+  - ordenar_fecha: CacheResultadosArea.ordenadas (interpretar fechas y ordenar) de /buscar_area.
+
+De cada etapa se da el mejor tiempo de --repeticiones y el pico de memoria (tracemalloc,
+en una pasada aparte para no falsear el tiempo). Con --guardar se escribe una línea base
+en JSON y con --comparar se compara con ella: las etapas más lentas que la base en más de
+--tolerancia salen marcadas y el programa termina con código 1.
+
+Uso:
+    python benchmarks/bench_etapas.py [--tamanos 10000,100000] [--repeticiones 3]
+    python benchmarks/bench_etapas.py --tamanos 10000,100000,1000000 --guardar benchmarks/base_etapas.json
+    python benchmarks/bench_etapas.py --comparar benchmarks/base_etapas.json
+"""
+import argparse
+import atexit
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import pandas as pd  # noqa: E402
+
+from area_data import AreaDataAggregator  # noqa: E402
+from clasificador_taxonomico import ClasificadorTaxonomico  # noqa: E402
+from distancias import filtrar_por_radio  # noqa: E402
+from procesador_archivo import CATEGORIA_MAPPING, ProcesadorDatos  # noqa: E402
+from resultados_area import CacheResultadosArea  # noqa: E402
+
+CENTRO = (37.39, -5.98)
+RADIO_KM = 25
+TAMANO_PAGINA = 200
+# (filo, clase, órdenes con sus familias y géneros) por grupo, con su peso en las observaciones
+GRUPOS = [
+    (0.55, "Tracheophyta", "Magnoliopsida", {"Fagales": {"Fagaceae": ["Quercus", "Castanea"]},
+                                             "Rosales": {"Rosaceae": ["Rosa", "Prunus", "Rubus"]},
+                                             "Lamiales": {"Lamiaceae": ["Lavandula", "Salvia", "Thymus"]},
+                                             "Asterales": {"Asteraceae": ["Taraxacum", "Bellis", "Lactuca"]}}),
+    (0.15, "Tracheophyta", "Liliopsida", {"Poales": {"Poaceae": ["Stipa", "Avena"]},
+                                          "Asparagales": {"Orchidaceae": ["Ophrys", "Orchis"]}}),
+    (0.10, "Tracheophyta", "Pinopsida", {"Pinales": {"Pinaceae": ["Pinus", "Abies"],
+                                                     "Cupressaceae": ["Juniperus", "Cupressus"]}}),
+    (0.08, "Tracheophyta", "Polypodiopsida", {"Polypodiales": {"Aspleniaceae": ["Asplenium"],
+                                                               "Pteridaceae": ["Adiantum"]}}),
+    (0.07, "Bryophyta", "Bryopsida", {"Hypnales": {"Hypnaceae": ["Hypnum"]}}),
+    (0.05, "Rhodophyta", "Florideophyceae", {"Corallinales": {"Corallinaceae": ["Corallina"]}}),
+]
+ESPECIES_POR_GENERO = 40
+
+
+def _vernaculos(nombre, azar):
+    return [{"name": nombre.lower()}] if azar.random() < 0.3 else []
+
+
+def generar_taxones(semilla=7):
+    """Taxones con sus ancestros; cada ancestro tiene siempre el mismo id, como en iNaturalist."""
+    azar = random.Random(semilla)
+    ids = iter(range(1000, 10 ** 7))
+    comunes = {}
+
+    def ancestro(rango, nombre):
+        if (rango, nombre) not in comunes:
+            comunes[(rango, nombre)] = {"id": next(ids), "rank": rango, "name": nombre,
+                                        "vernacular_names": _vernaculos(nombre, azar)}
+        return comunes[(rango, nombre)]
+
+    taxones, pesos = [], []
+    for peso, filo, clase, ordenes in GRUPOS:
+        generos = [(o, f, g) for o, familias in ordenes.items() for f, gs in familias.items() for g in gs]
+        for orden, familia, genero in generos:
+            base = [ancestro("kingdom", "Plantae"), ancestro("phylum", filo), ancestro("class", clase),
+                    ancestro("order", orden), ancestro("family", familia), ancestro("genus", genero)]
+            for especie in range(ESPECIES_POR_GENERO):
+                taxones.append({"id": next(ids), "name": f"{genero} especie{especie}", "rank": "species",
+                                "preferred_common_name": f"{genero} común {especie}", "ancestors": base})
+                pesos.append(peso / len(generos))
+    return taxones, pesos
+
+
+def generar_observaciones(n, semilla=42):
+    """`n` observaciones alrededor de CENTRO; los ancestros se comparten entre las del mismo taxón."""
+    azar = random.Random(semilla)
+    taxones, pesos = generar_taxones()
+    elegidos = azar.choices(taxones, weights=pesos, k=n)
+    observaciones = []
+    for id_obs, taxon in enumerate(elegidos, start=1):
+        fecha = f"20{azar.randint(10, 24)}-{azar.randint(1, 12):02d}-{azar.randint(1, 28):02d}"
+        observaciones.append({
+            "id": id_obs,
+            "latitude": CENTRO[0] + azar.gauss(0, 0.2),
+            "longitude": CENTRO[1] + azar.gauss(0, 0.2),
+            "observed_on": fecha if azar.random() < 0.95 else None,
+            "quality_grade": azar.choice(("research", "needs_id", "casual")),
+            "identifications_count": azar.randint(0, 12),
+            "photos": [{"url": f"https://static.example/photos/{id_obs}/square.jpg"}],
+            "taxon": taxon,
+        })
+    return observaciones
+
+
+def plantas_de_area(observaciones):
+    """Las mismas observaciones en el formato de las fuentes de /buscar_area."""
+    return [{
+        "nombre_cientifico": obs["taxon"]["name"],
+        "genero": obs["taxon"]["name"].split(" ")[0],
+        "latitud": round(obs["latitude"], 5),
+        "longitud": round(obs["longitude"], 5),
+        "distancia": "N/A",
+        "fecha_observacion": obs["observed_on"] or "Fecha desconocida",
+        "identificaciones": obs["identifications_count"],
+        "calidad": obs["quality_grade"],
+        "descripcion": "Sin descripción",
+        "imagen_generica": obs["photos"][0]["url"],
+        "fuente": "iNaturalist",
+    } for obs in observaciones]
+
+
+def preparar_etapas(observaciones, plantas_para_plantilla):
+    """Devuelve [(nombre, funcion)]; la preparación de las entradas queda fuera de la medida."""
+    lats = [obs["latitude"] for obs in observaciones]
+    lons = [obs["longitude"] for obs in observaciones]
+    plantas = plantas_de_area(observaciones)
+    # Tres fuentes que se solapan en un 20 %, como iNaturalist y GBIF en la misma zona
+    tercio = len(plantas) // 3
+    solape = tercio // 5
+    fuentes = [plantas[:tercio], plantas[tercio - solape:2 * tercio], plantas[2 * tercio - solape:]]
+
+    procesador = ProcesadorDatos(categoria="angiospermas")
+    paginas = [observaciones[i:i + TAMANO_PAGINA] for i in range(0, len(observaciones), TAMANO_PAGINA)]
+    registros = [registro for pagina in paginas
+                 for _, registro in ProcesadorDatos()._procesar_pagina(pagina, *CENTRO, RADIO_KM)]
+    df_registros = pd.DataFrame(registros)
+    agregador = AreaDataAggregator(generos_interes=[])
+
+    def distancia_escalar():
+        for lat, lon in zip(lats, lons):
+            ProcesadorDatos.calcular_distancia(CENTRO[0], CENTRO[1], lat, lon)
+
+    def criterios_taxonomicos():
+        procesador.clasificador = ClasificadorTaxonomico(CATEGORIA_MAPPING)
+        for obs in observaciones:
+            taxon = obs["taxon"]
+            procesador._cumple_criterios_taxonomicos(taxon["ancestors"], taxon["name"], taxon["id"])
+
+    def procesar_paginas():
+        procesador.clasificador = ClasificadorTaxonomico(CATEGORIA_MAPPING)
+        for pagina in paginas:
+            procesador._procesar_pagina(pagina, CENTRO[0], CENTRO[1], RADIO_KM)
+
+    def ordenar_fecha():
+        CacheResultadosArea().ordenadas((0, 0, 1, 1), "inaturalist", "mixta", "desc",
+                                        lambda limite: (list(plantas), False, None))
+
+    return [
+        ("distancia_escalar", distancia_escalar),
+        ("distancia_vectorial", lambda: filtrar_por_radio(CENTRO[0], CENTRO[1], lats, lons, RADIO_KM, ordenar=True)),
+        ("criterios_taxonomicos", criterios_taxonomicos),
+        ("procesar_paginas", procesar_paginas),
+        ("plantas_para_plantilla", lambda: plantas_para_plantilla(df_registros.to_dict("records"))),
+        ("agregar_resultados", lambda: agregador.agregar_resultados(fuentes)),
+        ("ordenar_fecha", ordenar_fecha),
+    ]
+
+
+def medir(funcion, repeticiones):
+    """Mejor tiempo de `repeticiones` y pico de memoria en MB de una pasada con tracemalloc."""
+    tiempos = []
+    for _ in range(repeticiones):
+        gc.collect()
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    gc.collect()
+    tracemalloc.start()
+    funcion()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(tiempos), pico / 2 ** 20
+
+
+def importar_plantas_para_plantilla():
+    """app abre sus bases y grupos_plantas.json relativos al directorio actual: se importa desde uno temporal."""
+    directorio = tempfile.mkdtemp(prefix="bench_etapas_")
+    atexit.register(shutil.rmtree, directorio, True)
+    os.symlink(os.path.join(RAIZ, "grupos_plantas.json"), os.path.join(directorio, "grupos_plantas.json"))
+    anterior = os.getcwd()
+    os.chdir(directorio)
+    try:
+        from app import plantas_para_plantilla
+    finally:
+        os.chdir(anterior)
+    return plantas_para_plantilla
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tamanos", default="10000,100000", help="números de observaciones separados por comas")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--etapas", help="nombres separados por comas (por defecto todas)")
+    parser.add_argument("--guardar", help="archivo JSON donde guardar la línea base")
+    parser.add_argument("--comparar", help="línea base JSON con la que comparar")
+    parser.add_argument("--tolerancia", type=float, default=0.2, help="empeoramiento admitido (0.2 = 20 %%)")
+    args = parser.parse_args()
+
+    os.environ.setdefault("HUNTERLEAF_LOG_LEVEL", "WARNING")
+    plantas_para_plantilla = importar_plantas_para_plantilla()
+    elegidas = set(args.etapas.split(",")) if args.etapas else None
+    base = None
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            base = json.load(f)["resultados"]
+
+    resultados = {}
+    regresiones = []
+    for tamano in [int(t) for t in args.tamanos.split(",")]:
+        inicio = time.perf_counter()
+        observaciones = generar_observaciones(tamano)
+        print(f"\n{tamano} observaciones (generadas en {time.perf_counter() - inicio:.1f} s)")
+        print(f"{'etapa':<26}{'segundos':>10}{'µs/obs':>9}{'pico MB':>9}  comparación")
+        resultados[str(tamano)] = {}
+        for nombre, funcion in preparar_etapas(observaciones, plantas_para_plantilla):
+            if elegidas is not None and nombre not in elegidas:
+                continue
+            segundos, pico = medir(funcion, args.repeticiones)
+            resultados[str(tamano)][nombre] = {"segundos": round(segundos, 6), "pico_mb": round(pico, 2)}
+            comparacion = ""
+            anterior = (base or {}).get(str(tamano), {}).get(nombre)
+            if anterior:
+                relacion = segundos / anterior["segundos"] if anterior["segundos"] else 1.0
+                comparacion = f"x{relacion:.2f} tiempo, {pico - anterior['pico_mb']:+.1f} MB"
+                if relacion > 1 + args.tolerancia:
+                    comparacion += "  REGRESIÓN"
+                    regresiones.append((tamano, nombre, relacion))
+            print(f"{nombre:<26}{segundos:>10.4f}{segundos / tamano * 1e6:>9.2f}{pico:>9.1f}  {comparacion}")
+        del observaciones
+
+    if args.guardar:
+        with open(args.guardar, "w", encoding="utf-8") as f:
+            json.dump({
+                "fecha": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "python": platform.python_version(),
+                "maquina": platform.machine(),
+                "repeticiones": args.repeticiones,
+                "resultados": resultados,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"\nLínea base guardada en {args.guardar}")
+    if regresiones:
+        print(f"\n{len(regresiones)} etapas más lentas que la línea base en más de un {args.tolerancia:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Compara la importación de un CSV grande con el código original y con el importador por lotes.
+
+Genera un CSV sintético con las columnas de grupos_plantas y lo importa:
+  - original: pd.read_csv completo + to_sql(if_exists='replace');
+  - por lotes: BaseDeDatos.importar_datos_iniciales.
+Cada importación corre en un proceso aparte para medir su pico de memoria (ru_maxrss).
+Después se comprueba que repetir la importación no duplica filas y que una importación
+interrumpida a mitad se reanuda desde el último lote confirmado.
+
+Uso:
+    python benchmarks/bench_importacion.py [--filas 1000000] [--tamano-lote 50000]
+"""
+import argparse
+import csv
+import multiprocessing
+import os
+import random
+import resource
+import sqlite3
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import base_de_datos  # noqa: E402
+from base_de_datos import BaseDeDatos  # noqa: E402
+
+
+def generar_csv(ruta, filas, semilla=9):
+    rnd = random.Random(semilla)
+    with open(ruta, "w", newline="", encoding="utf-8") as f:
+        escritor = csv.writer(f)
+        escritor.writerow(["nombre_cientifico", "nombre_comun", "familia", "genero", "descripcion"])
+        for i in range(filas):
+            genero = f"Genero{rnd.randint(0, 5000)}"
+            escritor.writerow([f"{genero} especie{i}", f"planta {i}", f"Familia{rnd.randint(0, 400)}",
+                               genero, "Descripción de ejemplo " * rnd.randint(1, 6)])
+
+
+def importar(version, ruta_csv, ruta_db, tamano_lote, cola):
+    inicio = time.perf_counter()
+    if version == "original":
+        df = pd.read_csv(ruta_csv)
+        conn = sqlite3.connect(ruta_db)
+        df.to_sql('grupos_plantas', conn, if_exists='replace', index=False)
+        conn.commit()
+        conn.close()
+    else:
+        # Sin mmap, para que ru_maxrss no cuente las páginas del archivo de la base
+        base_de_datos.PRAGMAS_CONEXION["mmap_size"] = 0
+        BaseDeDatos(ruta_db).importar_datos_iniciales(ruta_csv, tamano_lote=tamano_lote)
+    segundos = time.perf_counter() - inicio
+    cola.put((segundos, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+def medir(version, ruta_csv, ruta_db, tamano_lote, filas):
+    cola = multiprocessing.Queue()
+    proceso = multiprocessing.Process(target=importar, args=(version, ruta_csv, ruta_db, tamano_lote, cola))
+    proceso.start()
+    segundos, pico_mb = cola.get()
+    proceso.join()
+    print(f"{version:<9} {segundos:7.2f} s  {filas / segundos:9.0f} filas/s  pico de memoria {pico_mb:7.0f} MB")
+
+
+def contar(ruta_db):
+    conn = sqlite3.connect(ruta_db)
+    total = conn.execute("SELECT COUNT(*), COUNT(DISTINCT nombre_cientifico) FROM grupos_plantas").fetchone()
+    conn.close()
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filas", type=int, default=1000000)
+    parser.add_argument("--tamano-lote", type=int, default=50000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ruta_csv = os.path.join(tmp, "checklist.csv")
+        generar_csv(ruta_csv, args.filas)
+        print(f"CSV de {args.filas} filas ({os.path.getsize(ruta_csv) / 2 ** 20:.0f} MB)")
+
+        medir("original", ruta_csv, os.path.join(tmp, "original.db"), args.tamano_lote, args.filas)
+        ruta_db = os.path.join(tmp, "lotes.db")
+        medir("por lotes", ruta_csv, ruta_db, args.tamano_lote, args.filas)
+
+        db = BaseDeDatos(ruta_db)
+        db.importar_datos_iniciales(ruta_csv, tamano_lote=args.tamano_lote)
+        print(f"Tras repetir la importación (filas, nombres distintos): {contar(ruta_db)}")
+
+        # Interrupción simulada: el tercer lote falla antes de confirmarse
+        ruta_db = os.path.join(tmp, "reanudada.db")
+        db = BaseDeDatos(ruta_db)
+        original = BaseDeDatos._filas_lote
+        llamadas = []
+
+        def fallar_en_tercer_lote(self, df, columnas):
+            llamadas.append(len(df))
+            if len(llamadas) == 3:
+                raise KeyboardInterrupt
+            return original(self, df, columnas)
+
+        base_de_datos.BaseDeDatos._filas_lote = fallar_en_tercer_lote
+        try:
+            db.importar_datos_iniciales(ruta_csv, tamano_lote=args.tamano_lote)
+        except KeyboardInterrupt:
+            pass
+        base_de_datos.BaseDeDatos._filas_lote = original
+        print(f"Filas tras la interrupción: {contar(ruta_db)[0]}")
+        resumen = db.importar_datos_iniciales(ruta_csv, tamano_lote=args.tamano_lote)
+        print(f"Reanudada: {resumen['filas']} filas nuevas, total {contar(ruta_db)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Comprueba el limitador de peticiones compartido entre procesos.
+
+Lanza varios procesos (como los workers de gunicorn) que piden fichas al mismo
+LimitadorTasa a la vez, la mitad con prioridad interactiva y la otra mitad en segundo plano,
+y mide:
+  - la tasa conseguida entre todos frente a la configurada;
+  - la espera media de cada prioridad (la interactiva debe esperar menos);
+  - cuántas peticiones se rechazan de inmediato por no poder atenderse antes de su plazo.
+
+Uso:
+    python benchmarks/bench_limitador_tasa.py [--procesos 4] [--peticiones 15] [--tasa 120] [--plazo 5]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from limitador_tasa import (LimitadorTasa, LimiteTasaExcedido,  # noqa: E402
+                            PRIORIDAD_INTERACTIVA, PRIORIDAD_SEGUNDO_PLANO)
+
+
+def worker(db_file, tasa, plazo, prioridad, peticiones, cola):
+    limitador = LimitadorTasa("bench", tasa_por_minuto=tasa, rafaga=2, db_file=db_file)
+    for _ in range(peticiones):
+        inicio = time.monotonic()
+        try:
+            limitador.adquirir(prioridad, deadline=inicio + plazo)
+            cola.put((prioridad, "concedida", time.monotonic() - inicio, time.time()))
+        except LimiteTasaExcedido:
+            cola.put((prioridad, "rechazada", time.monotonic() - inicio, time.time()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--procesos", type=int, default=4)
+    parser.add_argument("--peticiones", type=int, default=15)
+    parser.add_argument("--tasa", type=float, default=120, help="peticiones por minuto")
+    parser.add_argument("--plazo", type=float, default=5, help="segundos que cada petición puede esperar")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "limitador.db")
+        cola = multiprocessing.Queue()
+        procesos = [
+            multiprocessing.Process(target=worker, args=(
+                db_file, args.tasa, args.plazo,
+                PRIORIDAD_INTERACTIVA if i % 2 == 0 else PRIORIDAD_SEGUNDO_PLANO, args.peticiones, cola))
+            for i in range(args.procesos)
+        ]
+        for proceso in procesos:
+            proceso.start()
+        resultados = [cola.get() for _ in range(args.procesos * args.peticiones)]
+        for proceso in procesos:
+            proceso.join()
+
+    concedidas = sorted(r[3] for r in resultados if r[1] == "concedida")
+    if len(concedidas) > 1:
+        tasa = (len(concedidas) - 1) / (concedidas[-1] - concedidas[0]) * 60
+        print(f"Tasa conseguida: {tasa:.1f} peticiones/min (configurada {args.tasa:.0f})")
+    for prioridad, nombre in ((PRIORIDAD_INTERACTIVA, "interactiva"), (PRIORIDAD_SEGUNDO_PLANO, "segundo plano")):
+        propias = [r for r in resultados if r[0] == prioridad]
+        esperas = [r[2] for r in propias if r[1] == "concedida"]
+        rechazadas = [r[2] for r in propias if r[1] == "rechazada"]
+        media = sum(esperas) / len(esperas) if esperas else 0
+        print(f"{nombre:<14} concedidas {len(esperas):3d}  espera media {media:5.2f} s  "
+              f"rechazadas {len(rechazadas):3d}  (tiempo hasta el rechazo máx. "
+              f"{max(rechazadas, default=0) * 1000:.0f} ms)")
+
+
+if __name__ == "__main__":
+    main()
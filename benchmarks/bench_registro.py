@@ -0,0 +1,106 @@
+"""
+Mide el coste por petición del registro en ProcesadorDatos.procesar_inaturalist.
+
+Ejecuta el procesamiento completo de una página de observaciones sintéticas, sin red
+(las observaciones salen de una caché simulada y los ancestros de una CacheTaxones
+precargada), con tres configuraciones:
+  - DEBUG: todos los mensajes de depuración activos, equivalente a los print anteriores.
+  - INFO: nivel por defecto; los mensajes de depuración no se formatean.
+  - INFO + traza: además se encola la traza de ancestros hacia un archivo.
+
+Uso:
+    python benchmarks/bench_registro.py [--observaciones 200] [--repeticiones 50]
+"""
+import argparse
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import registro  # noqa: E402
+from cache_taxones import CacheTaxones  # noqa: E402
+from procesador_archivo import ProcesadorDatos  # noqa: E402
+import procesador_archivo  # noqa: E402
+
+LAT, LON = 40.4168, -3.7038
+
+
+class CacheSimulada:
+    """Sustituye a CacheObservaciones devolviendo siempre la misma página."""
+
+    def __init__(self, observaciones):
+        self.observaciones = observaciones
+
+    def consultar(self, capa, swlat, swlng, nelat, nelng, descargar, ttl=None):
+        return self.observaciones
+
+
+def generar_pagina(num, semilla=7):
+    rnd = random.Random(semilla)
+    ancestros = [
+        {"id": 47126, "rank": "kingdom", "name": "Plantae"},
+        {"id": 47125, "rank": "class", "name": "Magnoliopsida"},
+        {"id": 47132, "rank": "family", "name": "Rosaceae"},
+    ]
+    observaciones = []
+    taxones = CacheTaxones()
+    for i in range(num):
+        taxon_id = 1000 + i % 50
+        observaciones.append({
+            "id": i,
+            "latitude": LAT + rnd.uniform(-0.1, 0.1),
+            "longitude": LON + rnd.uniform(-0.1, 0.1),
+            "observed_on": "2024-05-01",
+            "quality_grade": "research",
+            "photos": [{"url": f"https://example.org/{i}.jpg"}],
+            "taxon": {"id": taxon_id, "name": f"Rosa especie{i % 50}", "preferred_common_name": "rosa"},
+        })
+        taxones._recordar(taxon_id, ancestros)
+    return observaciones, taxones
+
+
+def medir(observaciones, taxones, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        procesador = ProcesadorDatos(categoria="Angiospermas", cache=CacheSimulada(observaciones),
+                                     cache_taxones=taxones)
+        inicio = time.perf_counter()
+        procesador.procesar_inaturalist(LAT, LON, radio=20)
+        tiempos.append(time.perf_counter() - inicio)
+    return statistics.median(tiempos) * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--observaciones", type=int, default=200)
+    parser.add_argument("--repeticiones", type=int, default=50)
+    args = parser.parse_args()
+
+    observaciones, taxones = generar_pagina(args.observaciones)
+    raiz = logging.getLogger("hunterleaf")
+    # La salida se descarta para medir solo el coste de generar los mensajes
+    for handler in raiz.handlers:
+        handler.setStream(open(os.devnull, "w"))
+
+    resultados = {}
+    raiz.setLevel(logging.DEBUG)
+    resultados["DEBUG"] = medir(observaciones, taxones, args.repeticiones)
+    raiz.setLevel(logging.INFO)
+    resultados["INFO"] = medir(observaciones, taxones, args.repeticiones)
+    with tempfile.TemporaryDirectory() as tmp:
+        procesador_archivo.traza_ancestros = registro.configurar_traza_ancestros(os.path.join(tmp, "ancestros.log"))
+        resultados["INFO + traza"] = medir(observaciones, taxones, args.repeticiones)
+
+    print(f"Mediana por petición ({args.observaciones} observaciones, {args.repeticiones} repeticiones):")
+    for nombre, ms in resultados.items():
+        print(f"  {nombre:<14} {ms:8.2f} ms")
+    print(f"Ahorro de INFO frente a DEBUG: {resultados['DEBUG'] - resultados['INFO']:.2f} ms por petición")
+
+
+if __name__ == "__main__":
+    main()
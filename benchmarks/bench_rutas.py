@@ -0,0 +1,249 @@
+"""
+Latencia de extremo a extremo de /buscar y /buscar_area sin depender de los servicios externos.
+
+Arranca la app con cliente_http en modo reproducción (reproduccion_http): las respuestas
+de iNaturalist, Wikipedia, Nominatim, Trefle y PlantNet salen de las fixtures grabadas
+en --fixtures y lo que no esté grabado se genera de forma sintética y determinista. Cada
+respuesta tarda lo indicado en --latencia-ms y una fracción --tasa-errores responde 503.
+
+Cada escenario se ejecuta con las cachés desactivadas ("frio") y con ellas ya llenas
+("caliente") a través del cliente de pruebas de Flask, y se muestra:
+  - latencia p50/p95/p99 de la ruta;
+  - peticiones externas por búsqueda y por host (incluidos los reintentos);
+  - respuestas con error (código >= 400 o redirección de vuelta al formulario).
+
+Para grabar fixtures reales una vez (lo ya grabado no se vuelve a pedir):
+    python benchmarks/bench_rutas.py --grabar --fixtures fixtures_http --iteraciones 1
+
+Uso:
+    python benchmarks/bench_rutas.py [--fixtures DIR] [--iteraciones 20] [--latencia-ms 40,120]
+                                     [--tasa-errores 0] [--escenarios buscar_coordenadas,...]
+"""
+import argparse
+import contextlib
+import os
+import random
+import sys
+import tempfile
+import time
+import zlib
+from urllib.parse import parse_qsl, urlsplit
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+BBOX_SEVILLA = {"swlat": "37.30", "swlng": "-6.05", "nelat": "37.45", "nelng": "-5.90"}
+
+# (nombre, método, ruta, datos del formulario o de la query)
+ESCENARIOS = [
+    ("buscar_coordenadas", "POST", "/buscar", {"latitud": "37.39", "longitud": "-5.98", "radio": "10"}),
+    ("buscar_direccion", "POST", "/buscar", {"direccion": "Sevilla, España", "radio": "10"}),
+    ("buscar_area_inaturalist", "GET", "/buscar_area", dict(BBOX_SEVILLA, fuente="inaturalist")),
+    ("buscar_area_trefle", "GET", "/buscar_area", dict(BBOX_SEVILLA, fuente="trefle")),
+    ("buscar_area_plantnet", "GET", "/buscar_area", dict(BBOX_SEVILLA, fuente="plantnet")),
+    ("buscar_area_todas", "GET", "/buscar_area", dict(BBOX_SEVILLA, fuente="todas")),
+]
+# Observaciones sintéticas que tiene cada consulta antes de agotarse la paginación
+OBSERVACIONES_POR_CONSULTA = 300
+
+
+def _azar(*partes):
+    return random.Random(zlib.crc32(repr(partes).encode("utf-8")))
+
+
+def _observaciones(parametros):
+    """Página de /v1/observations con ids decrecientes, como la pide paginacion_inaturalist."""
+    if "swlat" in parametros:
+        caja = [float(parametros[k]) for k in ("swlat", "swlng", "nelat", "nelng")]
+    else:
+        lat, lng = float(parametros.get("lat", 0)), float(parametros.get("lng", 0))
+        caja = [lat - 0.1, lng - 0.1, lat + 0.1, lng + 0.1]
+    genero = parametros.get("taxon_name") or "Quercus"
+    caja = tuple(round(c, 4) for c in caja)
+    # Ids distintos por consulta, como en iNaturalist, para que las teselas de la caché no se pisen
+    base = (zlib.crc32(repr((genero, caja)).encode("utf-8")) % 10 ** 5 + 1) * 10 ** 4
+    techo = int(parametros.get("id_below", base))
+    cantidad = max(min(int(parametros.get("per_page", 30)), techo - (base - OBSERVACIONES_POR_CONSULTA)), 0)
+    azar = _azar(genero, caja, techo)
+    resultados = []
+    for id_obs in range(techo - 1, techo - 1 - cantidad, -1):
+        especie = azar.randint(0, 24)
+        resultados.append({
+            "id": id_obs,
+            "latitude": azar.uniform(caja[0], caja[2]),
+            "longitude": azar.uniform(caja[1], caja[3]),
+            "location": None,
+            "observed_on": f"2024-{azar.randint(1, 12):02d}-{azar.randint(1, 28):02d}",
+            "quality_grade": azar.choice(["research", "needs_id", "casual"]),
+            "identifications_count": azar.randint(0, 8),
+            "description": None,
+            "photos": [{"url": f"https://static.example/{id_obs}/square.jpg"}],
+            "taxon": {"id": 50000 + especie, "name": f"{genero} especie{especie}", "rank": "species",
+                      "iconic_taxon_name": "Plantae", "preferred_common_name": f"{genero} común {especie}"},
+        })
+    return {"total_results": OBSERVACIONES_POR_CONSULTA, "per_page": len(resultados), "results": resultados}
+
+
+def _taxones(ids):
+    ancestros = [
+        {"id": 47126, "rank": "kingdom", "name": "Plantae"},
+        {"id": 211194, "rank": "phylum", "name": "Tracheophyta"},
+        {"id": 47125, "rank": "class", "name": "Magnoliopsida"},
+        {"id": 47853, "rank": "family", "name": "Fagaceae"},
+    ]
+    return {"results": [{"id": int(i), "ancestors": ancestros} for i in ids if i.isdigit()]}
+
+
+def _wikipedia(parametros):
+    if parametros.get("list") == "search":
+        return {"query": {"search": [{"title": parametros.get("srsearch", "").split(" ")[0]}]}}
+    titulos = [t for t in parametros.get("titles", "").split("|") if t]
+    return {"query": {"pages": [
+        {"title": t, "extract": f"{t} es una planta de ejemplo. " * 8} if _azar(t).random() < 0.7
+        else {"title": t, "missing": True}
+        for t in titulos
+    ]}}
+
+
+def respuesta_sintetica(url, params):
+    """JSON plausible para cualquier petición externa de la app que no tenga fixture."""
+    partes = urlsplit(url)
+    parametros = dict(parse_qsl(partes.query))
+    parametros.update({k: str(v) for k, v in (params or {}).items()})
+    host, ruta = partes.hostname, partes.path
+    if host == "api.inaturalist.org":
+        if ruta.endswith("/observations"):
+            return _observaciones(parametros)
+        if ruta.startswith("/v1/taxa/"):
+            return _taxones(ruta.rsplit("/", 1)[1].split(","))
+        if ruta.endswith("/taxa"):
+            return {"results": [{"default_photo": {"medium_url": f"https://static.example/{parametros.get('q')}.jpg"}}]}
+    if host == "es.wikipedia.org":
+        return _wikipedia(parametros)
+    if host == "nominatim.openstreetmap.org":
+        return [{"place_id": 1, "lat": "37.3886", "lon": "-5.9823", "display_name": parametros.get("q", ""),
+                 "boundingbox": ["37.3", "37.5", "-6.0", "-5.9"]}]
+    if host == "trefle.io":
+        azar = _azar("trefle", parametros.get("q"))
+        return {"data": [
+            {"scientific_name": f"{parametros.get('q')} especie{i}", "common_name": f"Común {i}",
+             "family": "Fagaceae", "image_url": None}
+            for i in range(azar.randint(0, 20))
+        ]}
+    if host.endswith("plantnet.org"):
+        cantidad = _azar("plantnet", parametros.get("taxon_name")).randint(0, 30)
+        return {"results": _observaciones(parametros)["results"][:cantidad]}
+    return None
+
+
+@contextlib.contextmanager
+def sin_caches(app):
+    """Desactiva las cachés de la app (ttl 0) y restaura los valores al salir."""
+    objetos = [app.cache_observaciones, app.cache_taxones, app.cache_resultados_area,
+               app.descripciones_wikipedia.cache, app.geocodificador.cache]
+    guardados = [(o, a, getattr(o, a)) for o in objetos for a in ("ttl", "ttl_negativo") if hasattr(o, a)]
+    for objeto, atributo, _ in guardados:
+        setattr(objeto, atributo, 0)
+    try:
+        yield
+    finally:
+        for objeto, atributo, valor in guardados:
+            setattr(objeto, atributo, valor)
+
+
+def vaciar_memoria(app):
+    app.cache_taxones._memoria.clear()
+    app.aggregator.imagen_generica_cache.clear()
+
+
+def percentil(ordenados, p):
+    return ordenados[min(int(len(ordenados) * p), len(ordenados) - 1)]
+
+
+def medir(app, cliente, reproductor, metodo, ruta, datos, iteraciones, frio):
+    if not frio:
+        # Primera búsqueda fuera de la medida para llenar las cachés
+        cliente.open(ruta, method=metodo, data=datos if metodo == "POST" else None,
+                     query_string=datos if metodo == "GET" else None)
+    antes = reproductor.estadisticas()["llamadas"]
+    reintentos_antes = sum(h["reintentos"] for h in app.cliente_http.cliente.estadisticas().values())
+    latencias, errores = [], 0
+    for _ in range(iteraciones):
+        if frio:
+            vaciar_memoria(app)
+        inicio = time.perf_counter()
+        respuesta = cliente.open(ruta, method=metodo, data=datos if metodo == "POST" else None,
+                                 query_string=datos if metodo == "GET" else None)
+        latencias.append(time.perf_counter() - inicio)
+        if respuesta.status_code >= 300:
+            errores += 1
+    despues = reproductor.estadisticas()["llamadas"]
+    reintentos = sum(h["reintentos"] for h in app.cliente_http.cliente.estadisticas().values()) - reintentos_antes
+    llamadas = {h: (n - antes.get(h, 0)) / iteraciones for h, n in despues.items() if n > antes.get(h, 0)}
+    return sorted(latencias), llamadas, errores, reintentos / iteraciones
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", help="directorio de fixtures (sin él todo es sintético)")
+    parser.add_argument("--grabar", action="store_true", help="grabar en --fixtures las respuestas reales que falten")
+    parser.add_argument("--iteraciones", type=int, default=20)
+    parser.add_argument("--latencia-ms", default="40,120", help="latencia inyectada mínima,máxima")
+    parser.add_argument("--tasa-errores", type=float, default=0.0, help="fracción de respuestas 503 inyectadas")
+    parser.add_argument("--escenarios", help="nombres separados por comas (por defecto todos)")
+    args = parser.parse_args()
+    if args.grabar and not args.fixtures:
+        parser.error("--grabar necesita --fixtures")
+    latencia_min, latencia_max = (args.latencia_ms.split(",") + [args.latencia_ms])[:2]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # La app abre sus bases y grupos_plantas.json relativos al directorio actual
+        os.symlink(os.path.join(RAIZ, "grupos_plantas.json"), os.path.join(tmp, "grupos_plantas.json"))
+        os.chdir(tmp)
+        os.environ.update({
+            "HTTP_REPRODUCCION": "grabar" if args.grabar else "reproducir",
+            "HTTP_FIXTURES": os.path.abspath(os.path.join(RAIZ, args.fixtures)) if args.fixtures else tmp,
+            "HTTP_LATENCIA_MIN_MS": latencia_min,
+            "HTTP_LATENCIA_MAX_MS": latencia_max,
+            "HTTP_TASA_ERRORES": str(args.tasa_errores),
+            "BUSQUEDAS_EN_SEGUNDO_PLANO": "0",
+            "HUNTERLEAF_LOG_LEVEL": os.environ.get("HUNTERLEAF_LOG_LEVEL", "WARNING"),
+        })
+        if not args.grabar:
+            # Con respuestas locales el limitador de iNaturalist solo añadiría esperas
+            os.environ.setdefault("INATURALIST_PETICIONES_MINUTO", "100000")
+            os.environ.setdefault("INATURALIST_RAFAGA", "1000")
+        import app  # noqa: E402  Lee la configuración del entorno al importarse
+
+        reproductor = app.cliente_http.cliente.reproductor
+        if not args.grabar:
+            reproductor.al_faltar = respuesta_sintetica
+        elegidos = set(args.escenarios.split(",")) if args.escenarios else None
+        cliente = app.app.test_client()
+
+        print(f"{'escenario':<36}{'n':>4}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'err':>5}{'reint':>7}"
+              "  peticiones externas por búsqueda")
+        for nombre, metodo, ruta, datos in ESCENARIOS:
+            if elegidos is not None and nombre not in elegidos:
+                continue
+            for frio in (True, False):
+                if frio:
+                    with sin_caches(app):
+                        resultado = medir(app, cliente, reproductor, metodo, ruta, datos, args.iteraciones, True)
+                else:
+                    resultado = medir(app, cliente, reproductor, metodo, ruta, datos, args.iteraciones, False)
+                latencias, llamadas, errores, reintentos = resultado
+                hosts = ", ".join(f"{h} {n:.1f}" for h, n in sorted(llamadas.items())) or "ninguna"
+                print(f"{nombre + (' (frio)' if frio else ' (caliente)'):<36}{len(latencias):>4}"
+                      f"{percentil(latencias, 0.50) * 1e3:>9.1f}{percentil(latencias, 0.95) * 1e3:>9.1f}"
+                      f"{percentil(latencias, 0.99) * 1e3:>9.1f}{errores:>5}{reintentos:>7.1f}  {hosts}")
+
+        estadisticas = reproductor.estadisticas()
+        print(f"\nRespuestas desde fixtures: {estadisticas['servidas']}, sintéticas o 404: "
+              f"{estadisticas['faltantes']}, grabadas: {estadisticas['grabadas']}, "
+              f"errores inyectados: {estadisticas['errores_inyectados']}")
+        os.chdir(RAIZ)
+
+
+if __name__ == "__main__":
+    main()
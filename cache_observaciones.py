@@ -0,0 +1,276 @@
+import json
+import math
+import sqlite3
+import threading
+import time
+from registro import obtener_logger
+
+logger = obtener_logger(__name__)
+
+# Grados de latitud por kilómetro (aproximación esférica)
+KM_POR_GRADO = 111.32
+
+
+def bbox_desde_radio(lat, lon, radio):
+    """Devuelve el bounding box (swlat, swlng, nelat, nelng) que contiene un círculo de radio en km."""
+    dlat = radio / KM_POR_GRADO
+    dlon = radio / (KM_POR_GRADO * max(math.cos(math.radians(lat)), 0.01))
+    return max(lat - dlat, -90.0), max(lon - dlon, -180.0), min(lat + dlat, 90.0), min(lon + dlon, 180.0)
+
+
+def extraer_coordenadas(obs):
+    """Obtiene (lat, lon) de una observación de iNaturalist o None si no tiene coordenadas válidas."""
+    lat, lon = obs.get("latitude"), obs.get("longitude")
+    if lat is None or lon is None:
+        coordinates = (obs.get("geojson") or {}).get("coordinates") or []
+        if len(coordinates) == 2:
+            lon, lat = coordinates
+    if (lat is None or lon is None) and obs.get("location"):
+        try:
+            lat, lon = map(float, obs["location"].split(","))
+        except ValueError:
+            return None
+    try:
+        lat, lon = float(lat), float(lon)
+    except (TypeError, ValueError):
+        return None
+    if lat == 0 and lon == 0:
+        return None
+    return lat, lon
+
+
+class CacheObservaciones:
+    """
+    Almacén local de observaciones dividido en teselas geográficas.
+
+    Cada tesela es una celda de `tamano_tesela` grados y se descarga entera para una
+    "capa" (el conjunto de filtros de la consulta, p.ej. un género). Las teselas vigentes
+    se sirven desde SQLite mediante un índice R*Tree y solo las ausentes o caducadas se
+    piden a la API, como mucho tantas observaciones como pide la búsqueda (y nunca más de
+    `max_por_tesela`). Una tesela que llena ese límite puede estar cortada: se guarda
+    marcada como incompleta y las consultas que la tocan se dejan a la API directa, porque
+    servirla daría solo sus observaciones más recientes.
+
+    Para no gastar el límite de peticiones de la API en llenar la caché, si las teselas que
+    faltan necesitarían más de `max_peticiones` peticiones de `por_peticion` observaciones
+    se consulta directamente la API.
+    """
+
+    def __init__(self, db_file='cache_observaciones.db', tamano_tesela=0.25, ttl=3600, max_teselas=16,
+                 max_por_tesela=2000, max_peticiones=4, por_peticion=200):
+        self.db_file = db_file
+        self.tamano_tesela = tamano_tesela
+        self.ttl = ttl
+        self.max_teselas = max_teselas
+        self.max_por_tesela = max_por_tesela
+        self.max_peticiones = max_peticiones
+        self.por_peticion = por_peticion
+        self.aciertos = 0
+        self.fallos = 0
+        self.omitidas = 0
+        self.incompletas = 0
+        self.sin_descarga = 0
+        self.sobre_presupuesto = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.initialize()
+
+    def initialize(self):
+        """Crea las tablas de teselas, observaciones y el índice espacial si no existen."""
+        with self._lock:
+            self._conn.executescript('''
+                CREATE TABLE IF NOT EXISTS teselas (
+                    capa TEXT NOT NULL,
+                    tx INTEGER NOT NULL,
+                    ty INTEGER NOT NULL,
+                    descargada REAL NOT NULL,
+                    num_observaciones INTEGER NOT NULL,
+                    completa INTEGER NOT NULL DEFAULT 1,
+                    PRIMARY KEY (capa, tx, ty)
+                );
+                CREATE TABLE IF NOT EXISTS observaciones (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    capa TEXT NOT NULL,
+                    tx INTEGER NOT NULL,
+                    ty INTEGER NOT NULL,
+                    obs_id INTEGER NOT NULL,
+                    datos TEXT NOT NULL,
+                    UNIQUE (capa, obs_id)
+                );
+                CREATE INDEX IF NOT EXISTS idx_observaciones_tesela ON observaciones (capa, tx, ty);
+                CREATE VIRTUAL TABLE IF NOT EXISTS observaciones_idx
+                    USING rtree(id, min_lat, max_lat, min_lon, max_lon);
+            ''')
+            columnas = {fila[1] for fila in self._conn.execute("PRAGMA table_info(teselas)")}
+            if "completa" not in columnas:
+                # Las teselas de antes se descargaban con el límite de la búsqueda: pueden estar cortadas
+                self._conn.execute("ALTER TABLE teselas ADD COLUMN completa INTEGER NOT NULL DEFAULT 0")
+            self._conn.commit()
+
+    def tesela_de(self, lat, lon):
+        return int(math.floor(lon / self.tamano_tesela)), int(math.floor(lat / self.tamano_tesela))
+
+    def limites_tesela(self, tx, ty):
+        """Devuelve el bounding box (swlat, swlng, nelat, nelng) de una tesela."""
+        t = self.tamano_tesela
+        return ty * t, tx * t, (ty + 1) * t, (tx + 1) * t
+
+    def teselas_para_bbox(self, swlat, swlng, nelat, nelng):
+        tx0, ty0 = self.tesela_de(swlat, swlng)
+        tx1, ty1 = self.tesela_de(nelat, nelng)
+        return [(tx, ty) for ty in range(ty0, ty1 + 1) for tx in range(tx0, tx1 + 1)]
+
+    def _contar(self, contador, cantidad=1):
+        with self._lock:
+            setattr(self, contador, getattr(self, contador) + cantidad)
+
+    def consultar(self, capa, swlat, swlng, nelat, nelng, descargar, ttl=None, max_registros=None):
+        """
+        Devuelve las observaciones de `capa` dentro del bounding box, de la más reciente a la más antigua.
+
+        `descargar(swlat, swlng, nelat, nelng, limite)` se llama para cada tesela ausente o
+        caducada y debe devolver hasta `limite` observaciones de la API; `limite` es
+        `max_registros` (lo que necesita la búsqueda) acotado a `max_por_tesela`.
+        Se devuelve None para que el llamador consulte la API directamente si el área abarca
+        más de `max_teselas` teselas, si llenar las que faltan supera `max_peticiones`, si
+        alguna está incompleta o si falla la descarga de una que no tiene copia anterior.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        teselas = self.teselas_para_bbox(swlat, swlng, nelat, nelng)
+        if len(teselas) > self.max_teselas:
+            self._contar("omitidas")
+            return None
+
+        with self._lock:
+            placeholders = ",".join("(?, ?)" for _ in teselas)
+            valores = [v for tesela in teselas for v in tesela]
+            filas = self._conn.execute(
+                f"SELECT tx, ty, descargada, completa FROM teselas "
+                f"WHERE capa = ? AND (tx, ty) IN (VALUES {placeholders})",
+                [capa] + valores
+            ).fetchall()
+        ahora = time.time()
+        vigentes = {(tx, ty) for tx, ty, descargada, _ in filas if ahora - descargada < ttl}
+        completas = {(tx, ty): bool(completa) for tx, ty, _, completa in filas}
+        if not all(completas[tesela] for tesela in vigentes):
+            # Una tesela vigente pero cortada no se vuelve a pedir hasta que caduque
+            self._contar("incompletas")
+            return None
+
+        faltan = [tesela for tesela in teselas if tesela not in vigentes]
+        limite = min(max_registros or self.max_por_tesela, self.max_por_tesela)
+        peticiones = len(faltan) * math.ceil(limite / self.por_peticion)
+        if peticiones > self.max_peticiones:
+            logger.info("Llenar %d teselas de %s costaría %d peticiones: se consulta la API directamente",
+                        len(faltan), capa, peticiones)
+            self._contar("sobre_presupuesto")
+            return None
+        self._contar("aciertos", len(teselas) - len(faltan))
+        self._contar("fallos", len(faltan))
+
+        for tx, ty in faltan:
+            try:
+                observaciones = descargar(*self.limites_tesela(tx, ty), limite)
+            except Exception as e:
+                logger.warning("Error al descargar la tesela %s (%d, %d): %s", capa, tx, ty, e)
+                if (tx, ty) not in completas:
+                    # Sin copia anterior la respuesta quedaría incompleta sin que se note
+                    self._contar("sin_descarga")
+                    return None
+                # Si hay una copia caducada se sirve esa
+                continue
+            # Si llena el límite puede haber más observaciones que no se han pedido
+            completas[(tx, ty)] = len(observaciones) < limite
+            self._guardar_tesela(capa, tx, ty, observaciones, completas[(tx, ty)])
+            if not completas[(tx, ty)]:
+                # La consulta irá a la API de todos modos: no se gastan peticiones en el resto
+                break
+
+        if not all(completas.get(tesela, False) for tesela in teselas):
+            logger.info("Capa %s con teselas de %d observaciones o más: se consulta la API directamente",
+                        capa, limite)
+            self._contar("incompletas")
+            return None
+
+        with self._lock:
+            filas = self._conn.execute('''
+                SELECT o.datos FROM observaciones o
+                JOIN observaciones_idx i ON o.id = i.id
+                WHERE i.min_lat >= ? AND i.max_lat <= ? AND i.min_lon >= ? AND i.max_lon <= ?
+                  AND o.capa = ?
+                ORDER BY o.obs_id DESC
+            ''', (swlat, nelat, swlng, nelng, capa)).fetchall()
+        return [json.loads(datos) for (datos,) in filas]
+
+    def _guardar_tesela(self, capa, tx, ty, observaciones, completa=True):
+        """Reemplaza el contenido de una tesela con las observaciones recién descargadas."""
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute(
+                "DELETE FROM observaciones_idx WHERE id IN "
+                "(SELECT id FROM observaciones WHERE capa = ? AND tx = ? AND ty = ?)",
+                (capa, tx, ty)
+            )
+            cursor.execute("DELETE FROM observaciones WHERE capa = ? AND tx = ? AND ty = ?", (capa, tx, ty))
+            guardadas = 0
+            for obs in observaciones:
+                coordenadas = extraer_coordenadas(obs)
+                if obs.get("id") is None or coordenadas is None:
+                    continue
+                lat, lon = coordenadas
+                # Las observaciones del borde pueden llegar en dos teselas; se guardan solo en la suya
+                if self.tesela_de(lat, lon) != (tx, ty):
+                    continue
+                cursor.execute(
+                    "INSERT OR IGNORE INTO observaciones (capa, tx, ty, obs_id, datos) VALUES (?, ?, ?, ?, ?)",
+                    (capa, tx, ty, obs["id"], json.dumps(obs))
+                )
+                if cursor.rowcount:
+                    cursor.execute(
+                        "INSERT INTO observaciones_idx (id, min_lat, max_lat, min_lon, max_lon) VALUES (?, ?, ?, ?, ?)",
+                        (cursor.lastrowid, lat, lat, lon, lon)
+                    )
+                    guardadas += 1
+            cursor.execute(
+                "INSERT OR REPLACE INTO teselas (capa, tx, ty, descargada, num_observaciones, completa) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (capa, tx, ty, time.time(), guardadas, int(completa))
+            )
+            self._conn.commit()
+
+    def estadisticas(self):
+        """Devuelve la tasa de aciertos y la antigüedad de cada tesela almacenada."""
+        with self._lock:
+            filas = self._conn.execute(
+                "SELECT capa, tx, ty, descargada, num_observaciones, completa FROM teselas ORDER BY descargada"
+            ).fetchall()
+        ahora = time.time()
+        teselas = [{
+            "capa": capa,
+            "tx": tx,
+            "ty": ty,
+            "limites": self.limites_tesela(tx, ty),
+            "edad_segundos": round(ahora - descargada, 1),
+            "caducada": ahora - descargada >= self.ttl,
+            "observaciones": num,
+            "completa": bool(completa)
+        } for capa, tx, ty, descargada, num, completa in filas]
+        with self._lock:
+            contadores = (self.aciertos, self.fallos, self.omitidas, self.incompletas, self.sin_descarga,
+                          self.sobre_presupuesto)
+        aciertos, fallos, omitidas, incompletas, sin_descarga, sobre_presupuesto = contadores
+        consultas = aciertos + fallos
+        return {
+            "aciertos": aciertos,
+            "fallos": fallos,
+            "omitidas": omitidas,
+            "incompletas": incompletas,
+            "sin_descarga": sin_descarga,
+            "sobre_presupuesto": sobre_presupuesto,
+            "max_por_tesela": self.max_por_tesela,
+            "max_peticiones": self.max_peticiones,
+            "tasa_aciertos": round(aciertos / consultas, 3) if consultas else None,
+            "ttl": self.ttl,
+            "tamano_tesela": self.tamano_tesela,
+            "teselas": teselas
+        }
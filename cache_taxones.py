@@ -0,0 +1,124 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import requests
+import cliente_http
+from registro import obtener_logger
+
+logger = obtener_logger(__name__)
+
+TAXA_URL = "https://api.inaturalist.org/v1/taxa/"
+# /v1/taxa/{ids} admite hasta 30 identificadores separados por comas
+MAX_IDS_POR_PETICION = 30
+# Campos de cada ancestro que usan los filtros taxonómicos
+CAMPOS_ANCESTRO = ("id", "rank", "name", "preferred_common_name", "vernacular_names")
+
+
+def consultar_taxones(taxon_ids, timeout=10):
+    """Descarga varios taxones con /v1/taxa/{id1,id2,...} y devuelve {taxon_id: ancestros}."""
+    ancestros = {}
+    taxon_ids = list(taxon_ids)
+    for i in range(0, len(taxon_ids), MAX_IDS_POR_PETICION):
+        lote = taxon_ids[i:i + MAX_IDS_POR_PETICION]
+        response = cliente_http.get(TAXA_URL + ",".join(str(t) for t in lote), timeout=timeout)
+        response.raise_for_status()
+        for taxon in response.json().get("results", []):
+            ancestros[taxon["id"]] = [
+                {campo: a[campo] for campo in CAMPOS_ANCESTRO if campo in a}
+                for a in taxon.get("ancestors", [])
+            ]
+    return ancestros
+
+
+class CacheTaxones:
+    """
+    Caché de ancestros por taxon_id con expulsión LRU y una capa opcional en disco.
+
+    La jerarquía de un taxón casi nunca cambia, así que tras unas pocas búsquedas casi
+    todas las consultas se resuelven en memoria. Los identificadores que faltan se piden
+    todos juntos con `consultar_taxones`.
+    """
+
+    def __init__(self, max_entradas=5000, db_file=None, ttl=30 * 24 * 3600):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.aciertos = 0
+        self.fallos = 0
+        self._memoria = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        if db_file:
+            self._conn = sqlite3.connect(db_file, check_same_thread=False)
+            with self._lock:
+                self._conn.execute('''
+                    CREATE TABLE IF NOT EXISTS taxones (
+                        taxon_id INTEGER PRIMARY KEY,
+                        ancestros TEXT NOT NULL,
+                        guardado REAL NOT NULL
+                    )
+                ''')
+                self._conn.commit()
+
+    def _recordar(self, taxon_id, ancestros):
+        self._memoria[taxon_id] = ancestros
+        self._memoria.move_to_end(taxon_id)
+        while len(self._memoria) > self.max_entradas:
+            self._memoria.popitem(last=False)
+
+    def obtener_lote(self, taxon_ids):
+        """Devuelve {taxon_id: ancestros} consultando la API una sola vez para todos los que falten."""
+        taxon_ids = [t for t in dict.fromkeys(taxon_ids) if t is not None]
+        encontrados = {}
+        with self._lock:
+            for taxon_id in taxon_ids:
+                if taxon_id in self._memoria:
+                    self._memoria.move_to_end(taxon_id)
+                    encontrados[taxon_id] = self._memoria[taxon_id]
+
+            faltan = [t for t in taxon_ids if t not in encontrados]
+            if faltan and self._conn is not None:
+                placeholders = ",".join("?" for _ in faltan)
+                filas = self._conn.execute(
+                    f"SELECT taxon_id, ancestros FROM taxones WHERE taxon_id IN ({placeholders}) AND guardado > ?",
+                    faltan + [time.time() - self.ttl]
+                ).fetchall()
+                for taxon_id, ancestros in filas:
+                    encontrados[taxon_id] = json.loads(ancestros)
+                    self._recordar(taxon_id, encontrados[taxon_id])
+            self.aciertos += len(encontrados)
+
+        faltan = [t for t in taxon_ids if t not in encontrados]
+        if not faltan:
+            return encontrados
+
+        self.fallos += len(faltan)
+        try:
+            descargados = consultar_taxones(faltan)
+        except requests.exceptions.RequestException as e:
+            logger.warning("Error al obtener ancestros de %d taxones: %s", len(faltan), e)
+            return encontrados
+
+        with self._lock:
+            for taxon_id, ancestros in descargados.items():
+                self._recordar(taxon_id, ancestros)
+            if self._conn is not None and descargados:
+                ahora = time.time()
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO taxones (taxon_id, ancestros, guardado) VALUES (?, ?, ?)",
+                    [(t, json.dumps(a), ahora) for t, a in descargados.items()]
+                )
+                self._conn.commit()
+        encontrados.update(descargados)
+        return encontrados
+
+    def estadisticas(self):
+        consultas = self.aciertos + self.fallos
+        return {
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_aciertos": round(self.aciertos / consultas, 3) if consultas else None,
+            "en_memoria": len(self._memoria),
+            "max_entradas": self.max_entradas
+        }
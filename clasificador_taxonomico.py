@@ -0,0 +1,87 @@
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+
+class ClasificadorTaxonomico:
+    """
+    Versión precompilada de los criterios de categoría de ProcesadorDatos.
+
+    Para cada categoría se compila una sola vez el conjunto de rangos relevantes y una
+    expresión regular con todos sus términos. El veredicto de cada ancestro solo depende
+    de su rango y sus nombres, así que se memoriza por id de ancestro; el de cada taxón
+    se memoriza por taxon_id. Clasificar una página repetida es solo buscar en diccionarios.
+    Cada memoria guarda como mucho `max_memoria` veredictos y olvida los usados hace más tiempo.
+
+    Un taxón cumple una categoría si algún ancestro de un rango relevante contiene un
+    término en su nombre o si algún nombre vernáculo de cualquier ancestro lo contiene,
+    igual que la comprobación original término a término.
+    """
+
+    def __init__(self, categoria_mapping, max_memoria=50000):
+        self.max_memoria = max_memoria
+        self._categorias = {
+            categoria: (
+                frozenset(r.lower() for r in mapping['ranks']),
+                re.compile("|".join(re.escape(t.lower()) for t in mapping['terms']))
+            )
+            for categoria, mapping in categoria_mapping.items()
+        }
+        self._por_ancestro = OrderedDict()
+        self._por_taxon = OrderedDict()
+        self._lock = threading.Lock()
+
+    def conoce(self, categoria):
+        return categoria in self._categorias
+
+    def _recordar(self, memoria, clave):
+        """Veredicto memorizado para `clave` (o None), marcándolo como usado recientemente."""
+        # Sin lock: get y move_to_end de OrderedDict son atómicos con el GIL, y los aciertos
+        # son el camino caliente. Solo puede fallar si otro hilo acaba de olvidar la clave
+        veredicto = memoria.get(clave)
+        if veredicto is not None:
+            try:
+                memoria.move_to_end(clave)
+            except KeyError:
+                pass
+        return veredicto
+
+    def _memorizar(self, memoria, clave, veredicto):
+        with self._lock:
+            memoria[clave] = veredicto
+            memoria.move_to_end(clave)
+            while len(memoria) > self.max_memoria:
+                memoria.popitem(last=False)
+
+    def _ancestro_cumple(self, categoria, ancestro):
+        ancestro_id = ancestro.get('id')
+        if ancestro_id is not None:
+            veredicto = self._recordar(self._por_ancestro, (categoria, ancestro_id))
+            if veredicto is not None:
+                return veredicto
+
+        rangos, patron = self._categorias[categoria]
+        veredicto = (
+            (ancestro.get('rank') or '').lower() in rangos
+            and patron.search((ancestro.get('name') or '').lower()) is not None
+        ) or any(
+            patron.search((vernacular.get('name') or '').lower()) is not None
+            for vernacular in ancestro.get('vernacular_names') or []
+        )
+        if ancestro_id is not None:
+            self._memorizar(self._por_ancestro, (categoria, ancestro_id), veredicto)
+        return veredicto
+
+    def cumple(self, categoria: str, ancestros: List[Dict], taxon_id: Optional[int] = None) -> bool:
+        """Indica si un taxón con esos ancestros pertenece a la categoría (que debe existir en el mapping)."""
+        if taxon_id is not None:
+            veredicto = self._recordar(self._por_taxon, (categoria, taxon_id))
+            if veredicto is not None:
+                return veredicto
+
+        veredicto = any(self._ancestro_cumple(categoria, ancestro) for ancestro in ancestros)
+        # Sin ancestros el veredicto puede cambiar cuando se obtengan, así que no se memoriza
+        if taxon_id is not None and ancestros:
+            self._memorizar(self._por_taxon, (categoria, taxon_id), veredicto)
+        return veredicto
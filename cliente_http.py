@@ -0,0 +1,239 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from registro import obtener_logger
+from limitador_tasa import LimitadorTasa, prioridad_actual
+from metricas import BUCKETS_BYTES, anotar, registro_metricas
+from reproduccion_http import Reproductor
+
+try:
+    import brotli  # noqa: F401  Opcional: con él urllib3 descomprime también respuestas br
+    ACEPTA_CODIFICACION = "gzip, deflate, br"
+except ImportError:
+    ACEPTA_CODIFICACION = "gzip, deflate"
+
+logger = obtener_logger(__name__)
+
+# Conexiones keep-alive que se mantienen abiertas por host (el resto usa POOL_POR_DEFECTO)
+POOL_POR_HOST = {
+    "api.inaturalist.org": 16,
+    "es.wikipedia.org": 8,
+    "trefle.io": 8,
+    "api.plantnet.org": 4,
+    "nominatim.openstreetmap.org": 2,
+}
+POOL_POR_DEFECTO = 8
+# (conexión, lectura) en segundos para las llamadas que no indican el suyo
+TIMEOUT_POR_DEFECTO = (3.05, float(os.environ.get("HTTP_TIMEOUT_LECTURA", 15)))
+# Respuestas que se reintentan: límite de peticiones y errores transitorios del servidor
+ESTADOS_REINTENTABLES = frozenset({429, 500, 502, 503, 504})
+# Latencias recientes que se guardan por host para los percentiles
+MUESTRAS_LATENCIA = 500
+
+DURACION_EXTERNA = registro_metricas.histograma(
+    "hunterleaf_peticion_externa_segundos",
+    "Duración de cada intento de petición a un servicio externo por host y código de respuesta",
+    ("host", "estado"))
+TAMANO_RESPUESTA_EXTERNA = registro_metricas.histograma(
+    "hunterleaf_respuesta_externa_bytes", "Tamaño del cuerpo de las respuestas de los servicios externos",
+    ("host",), BUCKETS_BYTES)
+ESPERA_LIMITADOR = registro_metricas.histograma(
+    "hunterleaf_espera_limitador_segundos", "Espera de turno en el limitador de peticiones por host", ("host",))
+
+
+class EstadisticasHost:
+    def __init__(self):
+        self.peticiones = 0
+        self.errores = 0
+        self.reintentos = 0
+        self.latencias = deque(maxlen=MUESTRAS_LATENCIA)
+
+    def resumen(self, pools):
+        latencias = sorted(self.latencias)
+        conexiones = sum(p.num_connections for p in pools)
+        peticiones_pool = sum(p.num_requests for p in pools)
+        return {
+            "peticiones": self.peticiones,
+            "errores": self.errores,
+            "reintentos": self.reintentos,
+            "latencia_p50_ms": round(latencias[len(latencias) // 2] * 1e3, 1) if latencias else None,
+            "latencia_p95_ms": round(latencias[int(len(latencias) * 0.95)] * 1e3, 1) if latencias else None,
+            "conexiones_abiertas": conexiones,
+            # Peticiones servidas por una conexión ya abierta (sin DNS, TCP ni TLS)
+            "conexiones_reutilizadas": max(peticiones_pool - conexiones, 0),
+        }
+
+
+class ClienteHTTP:
+    """
+    Cliente HTTP compartido por todas las llamadas a servicios externos.
+
+    Usa una única requests.Session con un pool de conexiones keep-alive por host, de modo
+    que las llamadas sucesivas al mismo servicio reutilizan la conexión TLS. Aplica un
+    timeout por defecto, reintenta los errores de red y las respuestas 429/5xx con espera
+    exponencial con jitter (respetando Retry-After) y lleva estadísticas por host.
+
+    Si tras los reintentos la respuesta sigue siendo un error se devuelve tal cual: el
+    llamador decide con raise_for_status() o status_code, igual que con requests.get.
+    """
+
+    def __init__(self, timeout=TIMEOUT_POR_DEFECTO, reintentos=2, espera_base=0.5, espera_maxima=8):
+        self.timeout = timeout
+        self.reintentos = reintentos
+        self.espera_base = espera_base
+        self.espera_maxima = espera_maxima
+        self.session = requests.Session()
+        self.session.headers.update({
+            "User-Agent": "HunterLeaf/1.1 (+https://github.com/amt2283/HunterLeaf)",
+            "Accept-Encoding": ACEPTA_CODIFICACION,
+        })
+        self._adaptadores = {}
+        self._estadisticas = {}
+        self._limitadores = {}
+        # Reproductor (reproduccion_http) que sustituye a la red en pruebas y benchmarks
+        self.reproductor = None
+        self._lock = threading.Lock()
+
+    def limitar(self, host, limitador):
+        """Hace que cada petición (y cada reintento) a `host` pase antes por `limitador` (LimitadorTasa)."""
+        self._limitadores[host] = limitador
+
+    def _preparar_host(self, url):
+        partes = urlsplit(url)
+        host = partes.netloc
+        with self._lock:
+            if host not in self._adaptadores:
+                tamano = POOL_POR_HOST.get(partes.hostname, POOL_POR_DEFECTO)
+                adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=tamano)
+                self.session.mount(f"{partes.scheme}://{host}/", adaptador)
+                self._adaptadores[host] = adaptador
+                self._estadisticas[host] = EstadisticasHost()
+            return self._estadisticas[host]
+
+    def _espera(self, intento, espera_base, respuesta=None):
+        """Espera antes del reintento: Retry-After si el servidor lo indica o backoff exponencial con jitter."""
+        if respuesta is not None:
+            retry_after = respuesta.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                return min(float(retry_after), self.espera_maxima)
+        return random.uniform(0, min(self.espera_maxima, espera_base * 2 ** intento))
+
+    def get(self, url, params=None, headers=None, timeout=None, reintentos=None, espera_base=None,
+            prioridad=None, deadline=None, **kwargs):
+        """
+        Como requests.get, con reintentos. Si el host tiene limitador, `prioridad` ordena la
+        espera de turno (por defecto la de limitador_tasa.con_prioridad) y `deadline` (en time.monotonic) es el plazo de la petición: si no se
+        puede atender a tiempo se lanza LimiteTasaExcedido y no se reintenta más allá de él.
+        """
+        estadisticas = self._preparar_host(url)
+        host = urlsplit(url).hostname
+        limitador = self._limitadores.get(host)
+        reintentos = self.reintentos if reintentos is None else reintentos
+        espera_base = self.espera_base if espera_base is None else espera_base
+        timeout = self.timeout if timeout is None else timeout
+        prioridad = prioridad_actual() if prioridad is None else prioridad
+        for intento in range(reintentos + 1):
+            if limitador is not None:
+                inicio = time.perf_counter()
+                limitador.adquirir(prioridad, deadline)
+                turno = time.perf_counter() - inicio
+                ESPERA_LIMITADOR.observar(turno, host)
+                anotar(f"limitador_{host}", turno)
+            inicio = time.perf_counter()
+            try:
+                if self.reproductor is not None:
+                    respuesta = self.reproductor.get(self.session, url, params=params, headers=headers,
+                                                     timeout=timeout, **kwargs)
+                else:
+                    respuesta = self.session.get(url, params=params, headers=headers, timeout=timeout, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                duracion = time.perf_counter() - inicio
+                DURACION_EXTERNA.observar(duracion, host, "error")
+                anotar(host, duracion)
+                with self._lock:
+                    estadisticas.peticiones += 1
+                    estadisticas.errores += 1
+                if intento == reintentos:
+                    raise
+                espera = self._espera(intento, espera_base)
+                if deadline is not None and time.monotonic() + espera > deadline:
+                    raise
+                logger.debug("Error de red con %s (%s), reintento en %.2f s", url, e, espera)
+            else:
+                duracion = time.perf_counter() - inicio
+                DURACION_EXTERNA.observar(duracion, host, str(respuesta.status_code))
+                if not kwargs.get("stream"):
+                    TAMANO_RESPUESTA_EXTERNA.observar(len(respuesta.content), host)
+                anotar(host, duracion)
+                with self._lock:
+                    estadisticas.peticiones += 1
+                    estadisticas.latencias.append(duracion)
+                    if respuesta.status_code >= 400:
+                        estadisticas.errores += 1
+                if respuesta.status_code not in ESTADOS_REINTENTABLES or intento == reintentos:
+                    return respuesta
+                espera = self._espera(intento, espera_base, respuesta)
+                if limitador is not None and respuesta.status_code == 429:
+                    # El resto de workers tampoco debe pedir nada hasta que pase la espera
+                    limitador.bloquear(espera)
+                if deadline is not None and time.monotonic() + espera > deadline:
+                    return respuesta
+                logger.debug("Respuesta %d de %s, reintento en %.2f s", respuesta.status_code, url, espera)
+            with self._lock:
+                estadisticas.reintentos += 1
+            time.sleep(espera)
+
+    def estadisticas(self):
+        """Peticiones, errores, reintentos, latencia y reutilización de conexiones por host."""
+        with self._lock:
+            hosts = list(self._estadisticas.items())
+            adaptadores = dict(self._adaptadores)
+        resumen = {}
+        for host, estadisticas in hosts:
+            contenedor = adaptadores[host].poolmanager.pools
+            pools = [contenedor[clave] for clave in contenedor.keys()]
+            resumen[host] = estadisticas.resumen(pools)
+            limitador = self._limitadores.get(urlsplit(f"//{host}").hostname)
+            if limitador is not None:
+                resumen[host]["limitador"] = limitador.estadisticas()
+        return resumen
+
+
+# Instancia compartida por todo el proceso
+cliente = ClienteHTTP()
+# iNaturalist pide no pasar de unas 60 peticiones por minuto; el cubo se comparte entre workers
+cliente.limitar("api.inaturalist.org", LimitadorTasa(
+    "inaturalist",
+    tasa_por_minuto=float(os.environ.get("INATURALIST_PETICIONES_MINUTO", 60)),
+    rafaga=int(os.environ.get("INATURALIST_RAFAGA", 5)),
+    db_file=os.environ.get("LIMITADOR_TASA_DB", "limitador_tasa.db"),
+    espera_maxima=float(os.environ.get("LIMITADOR_ESPERA_MAXIMA", 30))
+))
+# La política de uso de Nominatim permite como mucho una petición por segundo
+cliente.limitar("nominatim.openstreetmap.org", LimitadorTasa(
+    "nominatim", tasa_por_minuto=60, rafaga=1,
+    db_file=os.environ.get("LIMITADOR_TASA_DB", "limitador_tasa.db")
+))
+
+# HTTP_REPRODUCCION=grabar|reproducir sirve las respuestas desde fixtures en vez de la red
+if os.environ.get("HTTP_REPRODUCCION"):
+    cliente.reproductor = Reproductor(
+        os.environ.get("HTTP_FIXTURES", "fixtures_http"),
+        modo=os.environ["HTTP_REPRODUCCION"],
+        latencia=(float(os.environ.get("HTTP_LATENCIA_MIN_MS", 0)) / 1000,
+                  float(os.environ.get("HTTP_LATENCIA_MAX_MS", 0)) / 1000),
+        tasa_errores=float(os.environ.get("HTTP_TASA_ERRORES", 0)),
+        tasa_timeouts=float(os.environ.get("HTTP_TASA_TIMEOUTS", 0))
+    )
+    logger.info("Peticiones externas en modo %s con fixtures en %s", cliente.reproductor.modo,
+                cliente.reproductor.directorio)
+
+
+def get(url, **kwargs):
+    """Atajo a cliente.get con la misma firma que requests.get."""
+    return cliente.get(url, **kwargs)
@@ -0,0 +1,72 @@
+import threading
+from registro import obtener_logger
+
+logger = obtener_logger(__name__)
+
+
+class _Llamada:
+    def __init__(self):
+        self.terminada = threading.Event()
+        self.resultado = None
+        self.error = None
+        self.esperando = 0
+
+
+class Coalescedor:
+    """
+    Agrupa las llamadas idénticas que coinciden en el tiempo ("single-flight").
+
+    La primera llamada con una clave ejecuta la función; las que llegan con la misma clave
+    mientras está en curso esperan a que termine y reciben su mismo resultado (o su misma
+    excepción) sin repetir las peticiones. Al terminar la clave se olvida: no es una caché.
+    El resultado se comparte entre todos los llamadores, así que no debe modificarse.
+    """
+
+    def __init__(self, nombre):
+        self.nombre = nombre
+        self.ejecutadas = 0
+        self.coalescidas = 0
+        self._en_curso = {}
+        self._lock = threading.Lock()
+
+    def ejecutar(self, clave, funcion):
+        with self._lock:
+            llamada = self._en_curso.get(clave)
+            lider = llamada is None
+            if lider:
+                llamada = self._en_curso[clave] = _Llamada()
+                self.ejecutadas += 1
+            else:
+                llamada.esperando += 1
+                self.coalescidas += 1
+
+        if not lider:
+            logger.debug("Llamada a %s agrupada con otra en curso: %s", self.nombre, clave)
+            llamada.terminada.wait()
+            if llamada.error is not None:
+                raise llamada.error
+            return llamada.resultado
+
+        try:
+            llamada.resultado = funcion()
+            return llamada.resultado
+        except BaseException as e:
+            llamada.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._en_curso[clave]
+            llamada.terminada.set()
+            if llamada.esperando:
+                logger.info("%s: %d llamadas idénticas resueltas con una sola ejecución", self.nombre,
+                            llamada.esperando + 1)
+
+    def estadisticas(self):
+        with self._lock:
+            total = self.ejecutadas + self.coalescidas
+            return {
+                "ejecutadas": self.ejecutadas,
+                "coalescidas": self.coalescidas,
+                "en_curso": len(self._en_curso),
+                "tasa_coalescidas": round(self.coalescidas / total, 3) if total else None
+            }
@@ -0,0 +1,210 @@
+import contextvars
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import cliente_http
+from registro import obtener_logger
+
+logger = obtener_logger(__name__)
+
+
+class CacheDescripciones:
+    """
+    Caché persistente de descripciones de Wikipedia indexada por nombre científico.
+
+    Los nombres sin artículo se guardan con descripción vacía (caché negativa) y caducan
+    antes (`ttl_negativo`) por si el artículo se crea más adelante.
+    """
+
+    def __init__(self, db_file='cache_descripciones.db', ttl=7 * 24 * 3600, ttl_negativo=24 * 3600):
+        self.db_file = db_file
+        self.ttl = ttl
+        self.ttl_negativo = ttl_negativo
+        self.aciertos = 0
+        self.fallos = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_file, check_same_thread=False)
+        with self._lock:
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS descripciones (
+                    nombre_cientifico TEXT PRIMARY KEY,
+                    descripcion TEXT NOT NULL,
+                    guardada REAL NOT NULL
+                )
+            ''')
+            self._conn.commit()
+
+    def obtener(self, nombres):
+        """Devuelve {nombre: descripcion} para los nombres con entrada vigente ('' si no tiene artículo)."""
+        nombres = list(nombres)
+        if not nombres:
+            return {}
+        placeholders = ",".join("?" for _ in nombres)
+        with self._lock:
+            filas = self._conn.execute(
+                f"SELECT nombre_cientifico, descripcion, guardada FROM descripciones "
+                f"WHERE nombre_cientifico IN ({placeholders})",
+                nombres
+            ).fetchall()
+        ahora = time.time()
+        vigentes = {
+            nombre: descripcion
+            for nombre, descripcion, guardada in filas
+            if ahora - guardada < (self.ttl if descripcion else self.ttl_negativo)
+        }
+        with self._lock:
+            self.aciertos += len(vigentes)
+            self.fallos += len(nombres) - len(vigentes)
+        return vigentes
+
+    def guardar(self, descripciones):
+        """Guarda un diccionario {nombre: descripcion}; una descripción vacía marca que no hay artículo."""
+        ahora = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO descripciones (nombre_cientifico, descripcion, guardada) VALUES (?, ?, ?)",
+                [(nombre, descripcion or "", ahora) for nombre, descripcion in descripciones.items()]
+            )
+            self._conn.commit()
+
+    def estadisticas(self):
+        consultas = self.aciertos + self.fallos
+        return {
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_aciertos": round(self.aciertos / consultas, 3) if consultas else None
+        }
+
+
+class DescripcionesWikipedia:
+    """
+    Obtiene la introducción de Wikipedia de muchos taxones con pocas peticiones.
+
+    Los nombres que no están en caché se consultan en lotes de hasta `tamano_lote` títulos
+    con la API de MediaWiki (action=query&prop=extracts), que resuelve redirecciones en la
+    misma petición. Para los que no tienen artículo propio se prueba la búsqueda de texto,
+    como hacía la versión anterior, y el resultado (positivo o negativo) queda en caché.
+
+    La búsqueda admite un solo término por petición, así que se lanzan hasta
+    `hilos_busqueda` a la vez y como mucho `max_busquedas` por lote; los nombres que
+    quedan fuera no se guardan y se buscan en una llamada posterior.
+    """
+
+    def __init__(self, cache=None, idioma="es", tamano_lote=20, timeout=10, max_busquedas=20, hilos_busqueda=4):
+        self.cache = cache
+        self.api_url = f"https://{idioma}.wikipedia.org/w/api.php"
+        # prop=extracts con exintro admite como máximo 20 títulos por petición
+        self.tamano_lote = min(tamano_lote, 20)
+        self.timeout = timeout
+        self.max_busquedas = max_busquedas
+        self._pool = ThreadPoolExecutor(max_workers=hilos_busqueda, thread_name_prefix="wikipedia")
+
+    def obtener(self, nombre_cientifico):
+        return self.obtener_lote([nombre_cientifico]).get(nombre_cientifico, "")
+
+    def obtener_de_cache(self, nombres):
+        """Devuelve solo las descripciones ya guardadas, sin hacer peticiones."""
+        return self.cache.obtener(set(nombres)) if self.cache is not None else {}
+
+    def obtener_lote(self, nombres):
+        """
+        Devuelve {nombre: descripcion} ('' si no hay artículo). Los nombres que no se pudieron
+        resolver, por un error de red o por el tope de búsquedas, no aparecen ni se guardan.
+        """
+        nombres = [n for n in dict.fromkeys(nombres) if n]
+        descripciones = self.obtener_de_cache(nombres)
+        pendientes = [n for n in nombres if n not in descripciones]
+        if not pendientes:
+            return descripciones
+
+        # Se rellenan según llegan las respuestas, así que tras un error conservan lo ya resuelto
+        extractos, titulos, de_busqueda = {}, {}, {}
+        try:
+            self._consultar_extractos(pendientes, extractos)
+            sin_articulo = [n for n in pendientes if not extractos[n]]
+            if len(sin_articulo) > self.max_busquedas:
+                logger.info("Se buscan %d de %d nombres sin artículo propio", self.max_busquedas, len(sin_articulo))
+            if sin_articulo:
+                self._buscar_titulos(sin_articulo[:self.max_busquedas], titulos)
+                self._consultar_extractos([t for t in dict.fromkeys(titulos.values()) if t], de_busqueda)
+        except requests.exceptions.RequestException as e:
+            logger.warning("Error al obtener descripciones de Wikipedia: %s", e)
+
+        # Un extracto vacío solo es negativo si la búsqueda también terminó sin artículo: sin
+        # conexión no se guardan como negativos nombres válidos
+        nuevas = {n: d for n, d in extractos.items() if d}
+        for nombre, titulo in titulos.items():
+            if titulo is None:
+                nuevas[nombre] = ""
+            elif titulo in de_busqueda:
+                nuevas[nombre] = de_busqueda[titulo]
+        if nuevas and self.cache is not None:
+            self.cache.guardar(nuevas)
+        descripciones.update(nuevas)
+        return descripciones
+
+    def _consultar_extractos(self, titulos, extractos):
+        """Añade a `extractos` {titulo_pedido: extracto} consultando los títulos en lotes."""
+        for i in range(0, len(titulos), self.tamano_lote):
+            lote = titulos[i:i + self.tamano_lote]
+            params = {
+                "action": "query",
+                "prop": "extracts",
+                "exintro": 1,
+                "explaintext": 1,
+                "exlimit": "max",
+                "redirects": 1,
+                "titles": "|".join(lote),
+                "format": "json",
+                "formatversion": 2
+            }
+            response = cliente_http.get(self.api_url, params=params, timeout=self.timeout)
+            response.raise_for_status()
+            query = response.json().get("query", {})
+
+            # Seguir normalizaciones ("Rosa_canina" -> "Rosa canina") y redirecciones
+            destino = {t: t for t in lote}
+            for paso in query.get("normalized", []) + query.get("redirects", []):
+                for titulo, actual in destino.items():
+                    if actual == paso.get("from"):
+                        destino[titulo] = paso.get("to")
+            paginas = {
+                p.get("title"): p.get("extract", "")
+                for p in query.get("pages", [])
+                if not p.get("missing") and not p.get("invalid")
+            }
+            for titulo in lote:
+                extractos[titulo] = paginas.get(destino[titulo], "")
+
+    def _buscar_titulo(self, nombre):
+        """Título del artículo más relevante para `nombre`, o None si la búsqueda no da resultados."""
+        params = {
+            "action": "query",
+            "list": "search",
+            "srsearch": nombre,
+            "srlimit": 1,
+            "format": "json"
+        }
+        response = cliente_http.get(self.api_url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        resultados = response.json().get("query", {}).get("search", [])
+        if resultados:
+            return resultados[0]["title"]
+        logger.debug("No se encontraron resultados de búsqueda para '%s'", nombre)
+        return None
+
+    def _buscar_titulos(self, nombres, titulos):
+        """
+        Añade a `titulos` {nombre: titulo o None} buscando los nombres a la vez en el pool.
+        Los nombres cuya búsqueda falla se omiten, sin perder los que sí se resolvieron.
+        """
+        # Con el contexto del llamador: prioridad en el limitador y tiempos de Server-Timing
+        futuros = {nombre: self._pool.submit(contextvars.copy_context().run, self._buscar_titulo, nombre)
+                   for nombre in nombres}
+        for nombre, futuro in futuros.items():
+            try:
+                titulos[nombre] = futuro.result()
+            except requests.exceptions.RequestException as e:
+                logger.warning("Error al buscar '%s' en Wikipedia: %s", nombre, e)
@@ -0,0 +1,32 @@
+import numpy as np
+
+RADIO_TIERRA_KM = 6371
+
+
+def calcular_distancias(lat, lon, lats, lons):
+    """
+    Calcula con la fórmula de Haversine la distancia en km desde (lat, lon) a cada punto
+    de los arrays `lats` y `lons` en una sola pasada de NumPy.
+    """
+    lat1 = np.radians(float(lat))
+    lats2 = np.radians(np.asarray(lats, dtype=float))
+    dlat = lats2 - lat1
+    dlon = np.radians(np.asarray(lons, dtype=float) - float(lon))
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lats2) * np.sin(dlon / 2) ** 2
+    return RADIO_TIERRA_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def filtrar_por_radio(lat, lon, lats, lons, radio, ordenar=False):
+    """
+    Devuelve (distancias, dentro, indices):
+      - distancias: array con la distancia en km de cada punto.
+      - dentro: máscara booleana de los puntos a `radio` km o menos.
+      - indices: posiciones de los puntos dentro del radio, en el orden original o,
+        con `ordenar=True`, del más cercano al más lejano.
+    """
+    distancias = calcular_distancias(lat, lon, lats, lons)
+    dentro = distancias <= radio
+    indices = np.flatnonzero(dentro)
+    if ordenar:
+        indices = indices[np.argsort(distancias[indices], kind="stable")]
+    return distancias, dentro, indices
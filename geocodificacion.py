@@ -0,0 +1,168 @@
+import csv
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import requests
+from geopy.adapters import AdapterHTTPError, BaseSyncAdapter
+from geopy.exc import GeopyError
+from geopy.geocoders import Nominatim
+import cliente_http
+from registro import obtener_logger
+
+logger = obtener_logger(__name__)
+
+
+def normalizar_direccion(direccion):
+    """Clave de caché de una dirección: minúsculas, sin tildes ni signos y con los espacios colapsados."""
+    sin_tildes = ''.join(c for c in unicodedata.normalize('NFD', direccion or "") if unicodedata.category(c) != 'Mn')
+    return " ".join(re.sub(r"[^\w]+", " ", sin_tildes.lower()).split())
+
+
+def cargar_nomenclator(ruta):
+    """
+    Carga un nomenclátor local de {nombre normalizado: (lat, lon)}.
+
+    Admite un CSV con columnas nombre, latitud y longitud, o un JSON {nombre: [lat, lon]}.
+    Se pueden repetir coordenadas con varios nombres para añadir alias ("cdmx", "ciudad de mexico").
+    """
+    if ruta.lower().endswith(".json"):
+        with open(ruta, encoding="utf-8") as f:
+            entradas = [(nombre, lat, lon) for nombre, (lat, lon) in json.load(f).items()]
+    else:
+        with open(ruta, newline="", encoding="utf-8") as f:
+            entradas = [(fila["nombre"], fila["latitud"], fila["longitud"]) for fila in csv.DictReader(f)]
+    nomenclator = {}
+    for nombre, lat, lon in entradas:
+        try:
+            nomenclator[normalizar_direccion(nombre)] = (float(lat), float(lon))
+        except (TypeError, ValueError):
+            logger.warning("Entrada del nomenclátor sin coordenadas válidas: %s", nombre)
+    logger.info("Nomenclátor cargado desde %s: %d lugares", ruta, len(nomenclator))
+    return nomenclator
+
+
+class AdaptadorClienteHTTP(BaseSyncAdapter):
+    """Adaptador de geopy que hace las peticiones con cliente_http (pool, reintentos y limitador)."""
+
+    def __init__(self, *, proxies, ssl_context):
+        super().__init__(proxies=proxies, ssl_context=ssl_context)
+
+    def get_text(self, url, *, timeout, headers):
+        respuesta = cliente_http.get(url, headers=headers, timeout=timeout,
+                                     deadline=time.monotonic() + timeout)
+        if respuesta.status_code >= 400:
+            raise AdapterHTTPError(f"Respuesta {respuesta.status_code} de {url}",
+                                   status_code=respuesta.status_code, text=respuesta.text)
+        return respuesta.text
+
+    def get_json(self, url, *, timeout, headers):
+        return json.loads(self.get_text(url, timeout=timeout, headers=headers))
+
+
+class CacheGeocodificacion:
+    """
+    Caché persistente de coordenadas indexada por dirección normalizada.
+
+    Las direcciones que Nominatim no encuentra se guardan sin coordenadas (caché negativa)
+    y caducan antes (`ttl_negativo`), igual que las descripciones sin artículo.
+    """
+
+    def __init__(self, db_file='cache_geocodificacion.db', ttl=30 * 24 * 3600, ttl_negativo=24 * 3600):
+        self.db_file = db_file
+        self.ttl = ttl
+        self.ttl_negativo = ttl_negativo
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_file, check_same_thread=False)
+        with self._lock:
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS geocodificaciones (
+                    direccion TEXT PRIMARY KEY,
+                    latitud REAL,
+                    longitud REAL,
+                    guardada REAL NOT NULL
+                )
+            ''')
+            self._conn.commit()
+
+    def obtener(self, clave):
+        """Devuelve (lat, lon), (None, None) si se sabe que no existe, o None si no hay entrada vigente."""
+        with self._lock:
+            fila = self._conn.execute(
+                "SELECT latitud, longitud, guardada FROM geocodificaciones WHERE direccion = ?", (clave,)
+            ).fetchone()
+        if fila is None:
+            return None
+        latitud, longitud, guardada = fila
+        if time.time() - guardada >= (self.ttl if latitud is not None else self.ttl_negativo):
+            return None
+        return latitud, longitud
+
+    def guardar(self, clave, latitud, longitud):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocodificaciones (direccion, latitud, longitud, guardada) VALUES (?, ?, ?, ?)",
+                (clave, latitud, longitud, time.time())
+            )
+            self._conn.commit()
+
+
+class Geocodificador:
+    """
+    Convierte direcciones en coordenadas con un único cliente de Nominatim reutilizado.
+
+    Se busca primero en el nomenclátor local (sin red), después en la caché y solo al final
+    en Nominatim. Las peticiones a Nominatim pasan por cliente_http, cuyo limitador respeta
+    la política de uso (una petición por segundo) entre todos los workers.
+    """
+
+    def __init__(self, cache=None, nomenclator=None, user_agent="plantfinder_app", timeout=15):
+        self.cache = cache
+        self.nomenclator = nomenclator or {}
+        self.geolocalizador = Nominatim(user_agent=user_agent, timeout=timeout, adapter_factory=AdaptadorClienteHTTP)
+        self.aciertos_nomenclator = 0
+        self.aciertos_cache = 0
+        self.consultas = 0
+        self._lock = threading.Lock()
+
+    def _contar(self, contador):
+        with self._lock:
+            setattr(self, contador, getattr(self, contador) + 1)
+
+    def obtener_coordenadas(self, direccion):
+        """Devuelve (lat, lon) de la dirección o (None, None) si no se encuentra o el servicio falla."""
+        clave = normalizar_direccion(direccion)
+        if not clave:
+            return None, None
+        if clave in self.nomenclator:
+            self._contar("aciertos_nomenclator")
+            return self.nomenclator[clave]
+        if self.cache is not None:
+            guardada = self.cache.obtener(clave)
+            if guardada is not None:
+                self._contar("aciertos_cache")
+                return guardada
+
+        self._contar("consultas")
+        try:
+            ubicacion = self.geolocalizador.geocode(direccion)
+        except (GeopyError, requests.exceptions.RequestException) as e:
+            # Un fallo del servicio no se guarda como negativo
+            logger.warning("Error al geocodificar '%s': %s", direccion, e)
+            return None, None
+        latitud, longitud = (ubicacion.latitude, ubicacion.longitude) if ubicacion else (None, None)
+        if self.cache is not None:
+            self.cache.guardar(clave, latitud, longitud)
+        return latitud, longitud
+
+    def estadisticas(self):
+        total = self.aciertos_nomenclator + self.aciertos_cache + self.consultas
+        return {
+            "aciertos_nomenclator": self.aciertos_nomenclator,
+            "aciertos_cache": self.aciertos_cache,
+            "consultas_nominatim": self.consultas,
+            "tasa_aciertos": round((total - self.consultas) / total, 3) if total else None,
+            "lugares_nomenclator": len(self.nomenclator)
+        }
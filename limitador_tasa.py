@@ -0,0 +1,205 @@
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+import requests
+from contextlib import contextmanager
+from registro import obtener_logger
+
+logger = obtener_logger(__name__)
+
+# Prioridades de la cola: se atiende antes el número más bajo. Las búsquedas que ocupan un
+# worker web hasta responder van antes que los trabajos en segundo plano (trabajos.py), cuyo
+# cliente recibe los resultados por SSE según llegan
+PRIORIDAD_INTERACTIVA = 0
+PRIORIDAD_SEGUNDO_PLANO = 1
+# Intervalo máximo entre comprobaciones mientras se espera turno
+ESPERA_SONDEO = 0.5
+
+# Prioridad de las peticiones que no indican la suya, por hilo o tarea (ver con_prioridad)
+_prioridad_actual = contextvars.ContextVar("prioridad_limitador", default=PRIORIDAD_INTERACTIVA)
+
+
+def prioridad_actual():
+    return _prioridad_actual.get()
+
+
+@contextmanager
+def con_prioridad(prioridad):
+    """Las peticiones hechas dentro del bloque sin prioridad explícita usan `prioridad`."""
+    token = _prioridad_actual.set(prioridad)
+    try:
+        yield
+    finally:
+        _prioridad_actual.reset(token)
+
+
+class LimiteTasaExcedido(requests.exceptions.RequestException):
+    """
+    La espera estimada en la cola del limitador supera el plazo de la petición.
+
+    Hereda de RequestException para que los llamadores que ya tratan los errores de red
+    la traten igual; `espera` son los segundos que habría que esperar turno.
+    """
+
+    def __init__(self, nombre, espera):
+        super().__init__(f"Límite de peticiones de {nombre}: habría que esperar {espera:.1f} s")
+        self.nombre = nombre
+        self.espera = espera
+
+
+class LimitadorTasa:
+    """
+    Cubo de fichas compartido entre procesos y guardado en SQLite.
+
+    El cubo se rellena a `tasa_por_minuto` fichas por minuto hasta `rafaga` fichas y cada
+    petición consume una. Como el estado vive en `db_file` y se actualiza dentro de una
+    transacción BEGIN IMMEDIATE, todos los workers de gunicorn de la máquina comparten el
+    mismo límite sin servicios externos.
+
+    Las peticiones que no encuentran ficha se apuntan en una cola y se atienden por
+    prioridad y, dentro de la misma prioridad, por orden de llegada. Si la espera estimada
+    supera el plazo de la petición se lanza LimiteTasaExcedido en lugar de bloquear el hilo.
+    """
+
+    def __init__(self, nombre, tasa_por_minuto=60, rafaga=5, db_file="limitador_tasa.db", espera_maxima=30):
+        self.nombre = nombre
+        self.tasa = tasa_por_minuto / 60
+        self.rafaga = rafaga
+        self.db_file = db_file
+        self.espera_maxima = espera_maxima
+        self.concedidas = 0
+        self.rechazadas = 0
+        self.segundos_esperados = 0.0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _conexion(self):
+        # La conexión se abre al primer uso y de nuevo tras un fork (workers de gunicorn)
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.db_file, timeout=10, isolation_level=None, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript('''
+                CREATE TABLE IF NOT EXISTS cubos (
+                    nombre TEXT PRIMARY KEY,
+                    fichas REAL NOT NULL,
+                    actualizado REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS cola (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    nombre TEXT NOT NULL,
+                    prioridad INTEGER NOT NULL,
+                    caduca REAL NOT NULL
+                );
+            ''')
+            self._pid = os.getpid()
+        return self._conn
+
+    def _turno(self, conn, ahora, prioridad, id_cola=None):
+        """
+        Rellena el cubo y, si la petición es la primera de la cola y hay ficha, la consume.
+        Devuelve (concedida, espera_estimada). Debe llamarse dentro de una transacción.
+        """
+        fila = conn.execute("SELECT fichas, actualizado FROM cubos WHERE nombre = ?", (self.nombre,)).fetchone()
+        fichas, actualizado = fila if fila else (self.rafaga, ahora)
+        # `actualizado` en el futuro indica un bloqueo por 429: no se rellena hasta entonces
+        if ahora > actualizado:
+            fichas = min(self.rafaga, fichas + (ahora - actualizado) * self.tasa)
+            actualizado = ahora
+        # Se descartan las entradas de peticiones que ya no esperan (plazo vencido o proceso caído)
+        conn.execute("DELETE FROM cola WHERE nombre = ? AND caduca < ? AND id IS NOT ?", (self.nombre, ahora, id_cola))
+        delante = conn.execute(
+            "SELECT COUNT(*) FROM cola WHERE nombre = ? AND (prioridad < ? OR (prioridad = ? AND id < ?))",
+            (self.nombre, prioridad, prioridad, id_cola if id_cola is not None else float("inf"))
+        ).fetchone()[0]
+        concedida = delante == 0 and fichas >= 1 and ahora >= actualizado
+        if concedida:
+            fichas -= 1
+        conn.execute("INSERT OR REPLACE INTO cubos (nombre, fichas, actualizado) VALUES (?, ?, ?)",
+                     (self.nombre, fichas, actualizado))
+        espera = max(actualizado - ahora, 0) + max(delante + 1 - fichas, 0) / self.tasa
+        return concedida, espera
+
+    def _transaccion(self, funcion, *args):
+        with self._lock:
+            conn = self._conexion()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                resultado = funcion(conn, time.time(), *args)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            return resultado
+
+    def _rechazar(self, espera):
+        with self._lock:
+            self.rechazadas += 1
+        logger.warning("Petición a %s rechazada: espera estimada %.1f s", self.nombre, espera)
+        raise LimiteTasaExcedido(self.nombre, espera)
+
+    def adquirir(self, prioridad=PRIORIDAD_INTERACTIVA, deadline=None):
+        """
+        Espera turno y consume una ficha. Devuelve los segundos esperados.
+
+        `deadline` (en time.monotonic) es el momento en que el llamador deja de necesitar la
+        respuesta; sin él se espera como mucho `espera_maxima` segundos.
+        """
+        inicio = time.monotonic()
+        plazo = self.espera_maxima if deadline is None else deadline - inicio
+        concedida, espera = self._transaccion(self._turno, prioridad)
+        if concedida:
+            with self._lock:
+                self.concedidas += 1
+            return 0.0
+        if espera > plazo:
+            self._rechazar(espera)
+
+        def apuntarse(conn, ahora):
+            return conn.execute("INSERT INTO cola (nombre, prioridad, caduca) VALUES (?, ?, ?)",
+                                (self.nombre, prioridad, ahora + plazo)).lastrowid
+
+        def salir(conn, ahora):
+            conn.execute("DELETE FROM cola WHERE id = ?", (id_cola,))
+
+        id_cola = self._transaccion(apuntarse)
+        try:
+            while True:
+                restante = plazo - (time.monotonic() - inicio)
+                time.sleep(max(min(espera, ESPERA_SONDEO, restante), 0.01))
+                concedida, espera = self._transaccion(self._turno, prioridad, id_cola)
+                if concedida:
+                    break
+                # Una petición más prioritaria puede haber pasado delante
+                if espera > plazo - (time.monotonic() - inicio):
+                    self._rechazar(espera)
+        finally:
+            self._transaccion(salir)
+        esperado = time.monotonic() - inicio
+        with self._lock:
+            self.concedidas += 1
+            self.segundos_esperados += esperado
+        return esperado
+
+    def bloquear(self, segundos):
+        """Vacía el cubo y no lo rellena durante `segundos` (p. ej. tras un 429 con Retry-After)."""
+        def vaciar(conn, ahora):
+            conn.execute('''
+                INSERT INTO cubos (nombre, fichas, actualizado) VALUES (?, 0, ?)
+                ON CONFLICT (nombre) DO UPDATE SET fichas = 0, actualizado = MAX(actualizado, excluded.actualizado)
+            ''', (self.nombre, ahora + segundos))
+        self._transaccion(vaciar)
+
+    def estadisticas(self):
+        with self._lock:
+            en_cola = self._conexion().execute("SELECT COUNT(*) FROM cola WHERE nombre = ?", (self.nombre,)).fetchone()[0]
+            return {
+                "peticiones_por_minuto": round(self.tasa * 60, 1),
+                "rafaga": self.rafaga,
+                "concedidas": self.concedidas,
+                "rechazadas": self.rechazadas,
+                "espera_media_s": round(self.segundos_esperados / self.concedidas, 3) if self.concedidas else None,
+                "en_cola": en_cola
+            }
@@ -0,0 +1,172 @@
+import bisect
+import contextvars
+import re
+import threading
+import time
+from contextlib import contextmanager
+from registro import obtener_logger
+
+logger = obtener_logger(__name__)
+
+# Límites superiores de los buckets de cada tipo de histograma
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BUCKETS_BYTES = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+BUCKETS_CANTIDAD = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+# Tiempos de la petición web en curso para la cabecera Server-Timing (None fuera de una petición)
+_tiempos_peticion = contextvars.ContextVar("tiempos_peticion", default=None)
+# Los hilos de los pools de area_data heredan el contexto y anotan en el mismo diccionario
+_lock_tiempos = threading.Lock()
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _etiquetas(nombres, valores, extra=None):
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+def _numero(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class Histograma:
+    """
+    Histograma acumulado con etiquetas, como los de Prometheus.
+
+    `observar(valor, *etiquetas)` suma la observación al bucket que le corresponde; los
+    valores de las etiquetas van en el mismo orden que `etiquetas` al crearlo.
+    """
+
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_SEGUNDOS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor, *etiquetas):
+        indice = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(etiquetas)
+            if serie is None:
+                # [cuenta por bucket (el último es +Inf), suma]
+                serie = self._series[etiquetas] = [[0] * (len(self.buckets) + 1), 0.0]
+            serie[0][indice] += 1
+            serie[1] += valor
+
+    def exponer(self):
+        with self._lock:
+            series = sorted((k, (list(v[0]), v[1])) for k, v in self._series.items())
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        for etiquetas, (cuentas, suma) in series:
+            acumulado = 0
+            for limite, cuenta in zip(self.buckets + ("+Inf",), cuentas):
+                acumulado += cuenta
+                le = 'le="+Inf"' if limite == "+Inf" else f'le="{_numero(limite)}"'
+                lineas.append(f"{self.nombre}_bucket{_etiquetas(self.etiquetas, etiquetas, le)} {acumulado}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas(self.etiquetas, etiquetas)} {_numero(suma)}")
+            lineas.append(f"{self.nombre}_count{_etiquetas(self.etiquetas, etiquetas)} {acumulado}")
+        return lineas
+
+
+class RegistroMetricas:
+    """
+    Métricas del proceso en el formato de texto de Prometheus (GET /metrics).
+
+    Los histogramas se crean una vez con `histograma(...)` y los módulos los alimentan. Los
+    contadores que ya llevan las cachés y los clientes no se duplican: un recolector
+    (`recolector(funcion)`) los lee al exponer. La función devuelve una lista de
+    (nombre, tipo, ayuda, [(etiquetas, valor)]) con `etiquetas` como dict.
+    """
+
+    def __init__(self):
+        self._histogramas = {}
+        self._recolectores = []
+        self._lock = threading.Lock()
+
+    def histograma(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_SEGUNDOS):
+        with self._lock:
+            if nombre not in self._histogramas:
+                self._histogramas[nombre] = Histograma(nombre, ayuda, etiquetas, buckets)
+            return self._histogramas[nombre]
+
+    def recolector(self, funcion):
+        with self._lock:
+            self._recolectores.append(funcion)
+
+    def exponer(self):
+        with self._lock:
+            histogramas = list(self._histogramas.values())
+            recolectores = list(self._recolectores)
+        lineas = []
+        for histograma in histogramas:
+            lineas.extend(histograma.exponer())
+        for recolector in recolectores:
+            try:
+                familias = recolector()
+            except Exception as e:
+                logger.warning("Error en un recolector de métricas: %s", e)
+                continue
+            for nombre, tipo, ayuda, muestras in familias:
+                lineas.extend([f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} {tipo}"])
+                for etiquetas, valor in muestras:
+                    if valor is not None:
+                        lineas.append(f"{nombre}{_etiquetas(etiquetas.keys(), etiquetas.values())} {_numero(valor)}")
+        return "\n".join(lineas) + "\n"
+
+
+# Registro compartido por todo el proceso
+registro_metricas = RegistroMetricas()
+DURACION_ETAPAS = registro_metricas.histograma(
+    "hunterleaf_etapa_segundos", "Duración de cada etapa de las búsquedas", ("etapa",))
+
+
+def anotar(nombre, segundos):
+    """Suma `segundos` a `nombre` en la cabecera Server-Timing de la petición en curso, si la hay."""
+    tiempos = _tiempos_peticion.get()
+    if tiempos is not None:
+        with _lock_tiempos:
+            total, veces = tiempos.get(nombre, (0.0, 0))
+            tiempos[nombre] = (total + segundos, veces + 1)
+
+
+@contextmanager
+def medir(etapa):
+    """Mide el bloque en hunterleaf_etapa_segundos y lo anota para Server-Timing."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracion = time.perf_counter() - inicio
+        DURACION_ETAPAS.observar(duracion, etapa)
+        anotar(etapa, duracion)
+
+
+def iniciar_peticion():
+    """Empieza a anotar tiempos para la petición actual; devuelve el token para terminar_peticion."""
+    return _tiempos_peticion.set({})
+
+
+def terminar_peticion(token):
+    """Deja de anotar y devuelve {nombre: (segundos, veces)} de la petición."""
+    tiempos = _tiempos_peticion.get() or {}
+    _tiempos_peticion.reset(token)
+    with _lock_tiempos:
+        return dict(tiempos)
+
+
+def server_timing(tiempos):
+    """Valor de la cabecera Server-Timing: `nombre;dur=ms`, con las veces en desc si son varias."""
+    entradas = []
+    for nombre, (segundos, veces) in tiempos.items():
+        entrada = f"{re.sub(r'[^A-Za-z0-9_-]', '_', nombre)};dur={segundos * 1e3:.1f}"
+        if veces > 1:
+            entrada += f';desc="{veces}x"'
+        entradas.append(entrada)
+    return ", ".join(entradas)
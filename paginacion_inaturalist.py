@@ -0,0 +1,63 @@
+import time
+import cliente_http
+from registro import obtener_logger
+
+logger = obtener_logger(__name__)
+
+OBSERVACIONES_URL = "https://api.inaturalist.org/v1/observations"
+# Máximo de resultados por página que admite la API de iNaturalist
+MAX_POR_PAGINA = 200
+
+
+def iterar_observaciones(params, url=OBSERVACIONES_URL, max_registros=None, max_segundos=None,
+                         por_pagina=MAX_POR_PAGINA, ascendente=False, headers=None, timeout=10,
+                         prioridad=None, deadline=None):
+    """
+    Recorre las observaciones de iNaturalist página a página y las entrega como listas.
+
+    En lugar de `page`, que la API limita y que se vuelve lenta en páginas altas, se usa
+    un cursor sobre el id: cada página pide `id_below` (o `id_above` si `ascendente`) del
+    último id recibido. Así el llamador puede procesar cada página según llega y solo hay
+    una página en memoria a la vez.
+
+    Se detiene al agotar los resultados, al entregar `max_registros` observaciones o cuando
+    han pasado `max_segundos` desde el inicio (la página en curso se termina de pedir).
+    `prioridad` y `deadline` se pasan al limitador de peticiones de cliente_http.
+    """
+    params = dict(params)
+    params.pop("page", None)
+    params.update({
+        "order_by": "id",
+        "order": "asc" if ascendente else "desc",
+        "per_page": min(por_pagina, MAX_POR_PAGINA)
+    })
+    # El cursor necesita el id aunque la búsqueda limite los campos devueltos
+    if "fields" in params and "id" not in params["fields"].split(","):
+        params["fields"] = "id," + params["fields"]
+    cursor_param = "id_above" if ascendente else "id_below"
+
+    inicio = time.monotonic()
+    entregados = 0
+    while max_registros is None or entregados < max_registros:
+        if max_registros is not None:
+            params["per_page"] = min(params["per_page"], max_registros - entregados)
+        response = cliente_http.get(url, params=params, headers=headers, timeout=timeout,
+                                    prioridad=prioridad, deadline=deadline)
+        response.raise_for_status()
+        pagina = response.json().get("results", [])
+        if not pagina:
+            return
+        entregados += len(pagina)
+        yield pagina
+
+        if len(pagina) < params["per_page"]:
+            return
+        if max_registros is not None and entregados >= max_registros:
+            return
+        if max_segundos is not None and time.monotonic() - inicio >= max_segundos:
+            logger.debug("Paginación detenida por tiempo tras %d observaciones", entregados)
+            return
+        ids = [obs["id"] for obs in pagina if obs.get("id") is not None]
+        if not ids:
+            return
+        params[cursor_param] = max(ids) if ascendente else min(ids)
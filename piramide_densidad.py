@@ -0,0 +1,145 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from agrupacion import a_pixeles, TAMANO_TESELA_PX
+from registro import obtener_logger
+
+logger = obtener_logger(__name__)
+
+# Cada tesela se divide en CELDAS_POR_LADO x CELDAS_POR_LADO celdas (16 px con teselas de 256)
+CELDAS_POR_LADO = 16
+# Zoom más alto de la pirámide; por encima el detalle por celda no aporta y el tamaño crece mucho
+ZOOM_MAXIMO_PIRAMIDE = int(os.environ.get("TESELAS_ZOOM_MAX", 12))
+
+
+def crear_tablas(conn):
+    """Crea las tablas de la pirámide: conteos por tesela, celda y género, y las teselas ya serializadas."""
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS densidad_teselas (
+            z INTEGER NOT NULL,
+            x INTEGER NOT NULL,
+            y INTEGER NOT NULL,
+            cx INTEGER NOT NULL,
+            cy INTEGER NOT NULL,
+            genero TEXT NOT NULL,
+            cantidad INTEGER NOT NULL,
+            PRIMARY KEY (z, x, y, cx, cy, genero)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS densidad_teselas_json (
+            z INTEGER NOT NULL,
+            x INTEGER NOT NULL,
+            y INTEGER NOT NULL,
+            genero TEXT NOT NULL,
+            cuerpo BLOB NOT NULL,
+            PRIMARY KEY (z, x, y, genero)
+        ) WITHOUT ROWID;
+    ''')
+
+
+def existe(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'densidad_teselas'"
+    ).fetchone() is not None
+
+
+def acumular(conn, lats, lons, generos, signo=1, zoom_maximo=None):
+    """
+    Suma (o resta con signo=-1) los puntos a todos los niveles de la pirámide.
+
+    Se calcula con NumPy la tesela y la celda de cada punto en cada zoom, se agrupan los
+    puntos que caen en la misma celda y género y se actualizan los conteos con un upsert.
+    Las teselas serializadas afectadas se descartan para regenerarse en la siguiente lectura.
+    No confirma la transacción: el llamador decide cuándo, junto con la inserción de los datos.
+    """
+    zoom_maximo = ZOOM_MAXIMO_PIRAMIDE if zoom_maximo is None else zoom_maximo
+    if len(lats) == 0:
+        return
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    generos = pd.Series(generos, dtype=object).fillna("").to_numpy()
+    tamano_celda = TAMANO_TESELA_PX // CELDAS_POR_LADO
+    for z in range(zoom_maximo + 1):
+        px, py = a_pixeles(lats, lons, z)
+        limite = TAMANO_TESELA_PX * 2 ** z - 1
+        px = np.clip(px, 0, limite).astype(np.int64)
+        py = np.clip(py, 0, limite).astype(np.int64)
+        df = pd.DataFrame({
+            "x": px // TAMANO_TESELA_PX, "y": py // TAMANO_TESELA_PX,
+            "cx": px % TAMANO_TESELA_PX // tamano_celda, "cy": py % TAMANO_TESELA_PX // tamano_celda,
+            "genero": generos
+        })
+        conteos = df.groupby(["x", "y", "cx", "cy", "genero"], sort=False).size()
+        conn.executemany('''
+            INSERT INTO densidad_teselas (z, x, y, cx, cy, genero, cantidad) VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (z, x, y, cx, cy, genero) DO UPDATE SET cantidad = cantidad + excluded.cantidad
+        ''', [(z, int(x), int(y), int(cx), int(cy), g, signo * int(n))
+              for (x, y, cx, cy, g), n in conteos.items()])
+        teselas = df[["x", "y"]].drop_duplicates()
+        conn.executemany("DELETE FROM densidad_teselas_json WHERE z = ? AND x = ? AND y = ?",
+                         [(z, int(x), int(y)) for x, y in teselas.itertuples(index=False)])
+    if signo < 0:
+        conn.execute("DELETE FROM densidad_teselas WHERE cantidad <= 0")
+
+
+def reconstruir(conn, tamano_lote=50000, zoom_maximo=None):
+    """Vacía la pirámide y la vuelve a calcular con todas las filas de plantas que tienen coordenadas."""
+    crear_tablas(conn)
+    conn.execute("DELETE FROM densidad_teselas")
+    conn.execute("DELETE FROM densidad_teselas_json")
+    ultimo_id = -1
+    total = 0
+    while True:
+        filas = conn.execute('''
+            SELECT id, latitud, longitud, genero FROM plantas
+            WHERE id > ? AND latitud IS NOT NULL AND longitud IS NOT NULL ORDER BY id LIMIT ?
+        ''', (ultimo_id, tamano_lote)).fetchall()
+        if not filas:
+            break
+        ultimo_id = filas[-1][0]
+        _, lats, lons, generos = zip(*filas)
+        acumular(conn, lats, lons, generos, zoom_maximo=zoom_maximo)
+        total += len(filas)
+    logger.info("Pirámide de densidad reconstruida con %d puntos.", total)
+    return total
+
+
+def leer_tesela(conn, z, x, y, genero=""):
+    """
+    Devuelve la tesela (z, x, y) serializada en JSON:
+      {"z", "x", "y", "total", "generos": {genero: n}, "celdas": [[cx, cy, n], ...]}
+    Con `genero` solo se cuentan las observaciones de ese género. La primera lectura la
+    calcula desde los conteos y la guarda; las siguientes son una lectura por clave primaria.
+    Las teselas vacías no se guardan: el género y la tesela los elige el cliente, y guardar
+    cada combinación sin datos haría crecer la tabla sin límite (y cada lectura escribiría).
+    Se recalculan en cada petición, que sin filas es una consulta por clave que no devuelve nada.
+    """
+    fila = conn.execute(
+        "SELECT cuerpo FROM densidad_teselas_json WHERE z = ? AND x = ? AND y = ? AND genero = ?",
+        (z, x, y, genero)
+    ).fetchone()
+    if fila:
+        return fila[0]
+
+    consulta = "SELECT cx, cy, genero, cantidad FROM densidad_teselas WHERE z = ? AND x = ? AND y = ?"
+    parametros = [z, x, y]
+    if genero:
+        consulta += " AND genero = ?"
+        parametros.append(genero)
+    celdas = {}
+    generos = {}
+    for cx, cy, g, cantidad in conn.execute(consulta, parametros):
+        celdas[(cx, cy)] = celdas.get((cx, cy), 0) + cantidad
+        generos[g] = generos.get(g, 0) + cantidad
+    cuerpo = json.dumps({
+        "z": z, "x": x, "y": y,
+        "total": sum(generos.values()),
+        "generos": dict(sorted(generos.items(), key=lambda item: -item[1])),
+        "celdas": [[cx, cy, n] for (cx, cy), n in sorted(celdas.items())]
+    }, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if not generos:
+        return cuerpo
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO densidad_teselas_json VALUES (?, ?, ?, ?, ?)",
+                     (z, x, y, genero, cuerpo))
+    return cuerpo
@@ -1,9 +1,24 @@
+import logging
 import pandas as pd
 import requests
-from math import radians, cos, sin, sqrt, atan2
+import cliente_http
+import time
 import unicodedata
 import json
-from typing import Dict, List, Set
+from typing import Dict, List
+from cache_observaciones import bbox_desde_radio, extraer_coordenadas
+from cache_taxones import CacheTaxones
+from distancias import calcular_distancias, filtrar_por_radio
+from clasificador_taxonomico import ClasificadorTaxonomico
+from registro import obtener_logger, configurar_traza_ancestros
+from paginacion_inaturalist import iterar_observaciones
+from limitador_tasa import LimiteTasaExcedido
+from coalescencia import Coalescedor
+from metricas import medir
+
+logger = obtener_logger(__name__)
+# Traza opcional de ancestros por observación (HUNTERLEAF_TRAZA_ANCESTROS=ruta)
+traza_ancestros = configurar_traza_ancestros()
 
 # Función para eliminar tildes y normalizar el texto.
 def quitar_tildes(cadena):
@@ -12,7 +27,7 @@ def quitar_tildes(cadena):
 # Función para obtener información detallada de un taxón (incluyendo ancestros)
 def get_taxon_info(taxon_id):
     url = f"https://api.inaturalist.org/v1/taxa/{taxon_id}"
-    response = requests.get(url)
+    response = cliente_http.get(url, timeout=10)
     if response.status_code == 200:
         json_data = response.json()
         resultados = json_data.get("results", [])
@@ -20,15 +35,74 @@ def get_taxon_info(taxon_id):
             return resultados[0]
     return {}
 
+# Taxonomía actualizada basada en APG IV y la jerarquía de iNaturalist
+CATEGORIA_MAPPING = {
+    'pteridofito': {
+        'ranks': ['class', 'phylum', 'subphylum'],
+        'terms': [
+            'polypodiopsida',    # Helechos verdaderos
+            'pteridophyta',      # Término general para helechos
+            'lycopodiopsida',    # Licopodios
+            'psilotopsida',      # Psilotales
+            'equisetopsida'      # Colas de caballo
+        ]
+    },
+    'angiosperma': {
+        'ranks': ['class', 'subclass', 'order'],
+        'terms': [
+            'magnoliopsida',     # Dicotiledóneas
+            'liliopsida',        # Monocotiledóneas
+            'angiospermae',      # Término general
+            'eudicots',          # Eudicotiledóneas
+            'monocots'           # Monocotiledóneas (término alternativo)
+        ]
+    },
+    'gimnosperma': {
+        'ranks': ['class', 'division', 'phylum'],
+        'terms': [
+            'pinopsida',         # Coníferas
+            'ginkgoopsida',      # Ginkgos
+            'cycadopsida',       # Cícadas
+            'gnetopsida',        # Gnetófitas
+            'gymnospermae'       # Término general
+        ]
+    },
+    'alga': {
+        'ranks': ['phylum', 'division', 'class'],
+        'terms': [
+            'phaeophyceae',        # Algas pardas
+            'rhodophyta',          # Algas rojas
+            'chlorophyta',         # Algas verdes
+            'charophyta',          # Algas carófitas
+            'bacillariophyta',     # Diatomeas
+            'dinoflagellata',      # Dinoflagelados
+            'chromista'            # Reino que incluye varias algas
+        ]
+    }
+}
+
+# Clasificador compilado una sola vez y compartido por todas las búsquedas
+CLASIFICADOR_TAXONOMICO = ClasificadorTaxonomico(CATEGORIA_MAPPING)
+# Búsquedas en curso compartidas por todos los ProcesadorDatos (se crea uno por petición)
+COALESCEDOR_BUSQUEDAS = Coalescedor("procesar_inaturalist")
+# Decimales con que se comparan las coordenadas de dos búsquedas (~11 m)
+DECIMALES_COALESCENCIA = 4
+
 class ProcesadorDatos:
-    def __init__(self, categoria=None, genero=None, familia=None):
+    def __init__(self, categoria=None, genero=None, familia=None, cache=None, cache_taxones=None):
         """
         Inicializa el procesador con filtros taxonómicos actualizados.
+        Si se indica `cache` (CacheObservaciones), las observaciones se sirven desde él.
+        `cache_taxones` (CacheTaxones) conviene compartirlo entre búsquedas para reutilizar ancestros.
         """
+        self.cache = cache
+        self.cache_taxones = cache_taxones if cache_taxones is not None else CacheTaxones()
+        # Segundos de espera estimada si la última búsqueda la cortó el limitador de peticiones
+        self.espera_limite_tasa = None
         if categoria:
             # Normalizamos quitando tildes y convirtiendo a minúsculas
             normalized_cat = quitar_tildes(categoria.strip().lower())
-            print("Categoría normalizada antes de quitar 's':", normalized_cat)
+            logger.debug("Categoría normalizada antes de quitar 's': %s", normalized_cat)
             # Si termina en "s", se quita para obtener la forma singular (p.ej. angiospermas -> angiosperma)
             if normalized_cat.endswith("s"):
                 normalized_cat = normalized_cat[:-1]
@@ -40,75 +114,28 @@ class ProcesadorDatos:
         self.familia = quitar_tildes(familia.strip().lower()) if familia else None
         
         # Taxonomía actualizada basada en APG IV y la jerarquía de iNaturalist
-        self.categoria_mapping = {
-            'pteridofito': {
-                'ranks': ['class', 'phylum', 'subphylum'],
-                'terms': [
-                    'polypodiopsida',    # Helechos verdaderos
-                    'pteridophyta',      # Término general para helechos
-                    'lycopodiopsida',    # Licopodios
-                    'psilotopsida',      # Psilotales
-                    'equisetopsida'      # Colas de caballo
-                ]
-            },
-            'angiosperma': {
-                'ranks': ['class', 'subclass', 'order'],
-                'terms': [
-                    'magnoliopsida',     # Dicotiledóneas
-                    'liliopsida',        # Monocotiledóneas
-                    'angiospermae',      # Término general
-                    'eudicots',          # Eudicotiledóneas
-                    'monocots'           # Monocotiledóneas (término alternativo)
-                ]
-            },
-            'gimnosperma': {
-                'ranks': ['class', 'division', 'phylum'],
-                'terms': [
-                    'pinopsida',         # Coníferas
-                    'ginkgoopsida',      # Ginkgos
-                    'cycadopsida',       # Cícadas
-                    'gnetopsida',        # Gnetófitas
-                    'gymnospermae'       # Término general
-                ]
-            },
-            'alga': {
-                'ranks': ['phylum', 'division', 'class'],
-                'terms': [
-                    'phaeophyceae',        # Algas pardas
-                    'rhodophyta',          # Algas rojas
-                    'chlorophyta',         # Algas verdes
-                    'charophyta',          # Algas carófitas
-                    'bacillariophyta',     # Diatomeas
-                    'dinoflagellata',      # Dinoflagelados
-                    'chromista'            # Reino que incluye varias algas
-                ]
-            }
-        }
+        self.categoria_mapping = CATEGORIA_MAPPING
+        self.clasificador = CLASIFICADOR_TAXONOMICO
         
-        print(f"Filtros inicializados - Categoría: {self.categoria}, Género: {self.genero}, Familia: {self.familia}")
+        logger.debug("Filtros inicializados - Categoría: %s, Género: %s, Familia: %s",
+                     self.categoria, self.genero, self.familia)
 
     @staticmethod
     def calcular_distancia(lat1, lon1, lat2, lon2):
         """
         Calcula la distancia en kilómetros entre dos puntos usando la fórmula de Haversine.
+        Se mantiene por compatibilidad; para muchos puntos usar distancias.calcular_distancias.
         """
-        lat1, lon1, lat2, lon2 = float(lat1), float(lon1), float(lat2), float(lon2)
-        print(f"Calculando distancia entre: ({lat1}, {lon1}) y ({lat2}, {lon2})")
-        R = 6371  # Radio de la Tierra en km
-        dlat = radians(lat2 - lat1)
-        dlon = radians(lon2 - lon1)
-        a = sin(dlat/2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon/2)**2
-        distancia = R * 2 * atan2(sqrt(a), sqrt(1-a))
-        print(f"Distancia calculada: {distancia:.1f} km")
-        return distancia
-
-    def _cumple_criterios_taxonomicos(self, ancestros: List[Dict], taxon_nombre: str) -> bool:
+        return float(calcular_distancias(lat1, lon1, [lat2], [lon2])[0])
+
+    def _cumple_criterios_taxonomicos(self, ancestros: List[Dict], taxon_nombre: str, taxon_id=None) -> bool:
         """
         Verifica si un taxón cumple con los criterios taxonómicos especificados.
         
         Args:
             ancestros: Lista de diccionarios con información de ancestros
             taxon_nombre: Nombre del taxón actual
+            taxon_id: Id del taxón; si se indica, el veredicto se memoriza para él
             
         Returns:
             bool: True si cumple con los criterios, False en caso contrario
@@ -116,62 +143,197 @@ class ProcesadorDatos:
         if not self.categoria:
             return True
             
-        mapping = self.categoria_mapping.get(self.categoria)
-        if not mapping:
-            print(f"Advertencia: Categoría {self.categoria} no encontrada en el mapping")
+        if not self.clasificador.conoce(self.categoria):
+            logger.warning("Categoría %s no encontrada en el mapping", self.categoria)
             return False
             
-        # Conjunto para almacenar términos encontrados
-        terminos_encontrados: Set[str] = set()
-        
-        # Verificar en ancestros
-        for ancestro in ancestros:
-            rango = ancestro.get('rank', '').lower()
-            nombre = ancestro.get('name', '').lower()
-            
-            # Si el rango del ancestro está en los rangos relevantes para la categoría
-            if rango in mapping['ranks']:
-                # Verificar si algún término de la categoría está en el nombre del ancestro
-                for termino in mapping['terms']:
-                    if termino in nombre:
-                        terminos_encontrados.add(termino)
-                        print(f"Término encontrado '{termino}' en ancestro '{nombre}' de rango '{rango}'")
-            
-            # También buscar en nombres vernáculos si están disponibles
-            nombres_vernaculos = ancestro.get('vernacular_names', [])
-            for vernacular in nombres_vernaculos:
-                nombre_vernacular = vernacular.get('name', '').lower()
-                for termino in mapping['terms']:
-                    if termino in nombre_vernacular:
-                        terminos_encontrados.add(termino)
-                        print(f"Término encontrado '{termino}' en nombre vernáculo '{nombre_vernacular}'")
-        
-        # Si encontramos al menos un término, consideramos que cumple con la categoría
-        cumple = len(terminos_encontrados) > 0
-        if cumple:
-            print(f"Taxón '{taxon_nombre}' cumple con categoría '{self.categoria}'. Términos encontrados: {terminos_encontrados}")
-        else:
-            print(f"Taxón '{taxon_nombre}' NO cumple con categoría '{self.categoria}'. No se encontraron términos coincidentes.")
-        
+        cumple = self.clasificador.cumple(self.categoria, ancestros, taxon_id)
+        if not cumple:
+            logger.debug("Taxón '%s' NO cumple con categoría '%s'", taxon_nombre, self.categoria)
         return cumple
 
-    def procesar_inaturalist(self, lat, lon, radio=10):
+    @staticmethod
+    def _descargar_tesela(url, params, swlat, swlng, nelat, nelng, max_registros, deadline=None):
+        """Descarga las observaciones de una tesela de la caché usando los filtros de la búsqueda."""
+        params_tesela = {k: v for k, v in params.items() if k not in ("lat", "lng", "radius")}
+        params_tesela.update({"swlat": swlat, "swlng": swlng, "nelat": nelat, "nelng": nelng})
+        return [
+            obs
+            for pagina in iterar_observaciones(params_tesela, url=url, max_registros=max_registros,
+                                               deadline=deadline)
+            for obs in pagina
+        ]
+
+    def _procesar_pagina(self, resultados, lat, lon, radio, ordenar_por_distancia=False):
+        """
+        Aplica los filtros de distancia y taxonómicos a una página de observaciones.
+        Devuelve una lista de tuplas (distancia_km, registro).
+        """
+        # Diagnóstico de la primera observación
+        if resultados and logger.isEnabledFor(logging.DEBUG):
+            primera_obs = resultados[0]
+            logger.debug("Diagnóstico de primera observación: latitude=%s longitude=%s location=%s geojson=%s",
+                         primera_obs.get('latitude'), primera_obs.get('longitude'),
+                         primera_obs.get('location'), (primera_obs.get('geojson') or {}).get('coordinates'))
+
+        # Primera pasada: coordenadas válidas de cada observación
+        candidatas = []
+        for obs in resultados:
+            taxon = obs.get('taxon', {})
+            nombre_cientifico = taxon.get('name', '')
+            if not nombre_cientifico:
+                logger.debug("Saltando observación sin nombre científico")
+                continue
+
+            # Obtener coordenadas de la observación
+            try:
+                planta_lat = float(obs.get('latitude', 0))
+                planta_lon = float(obs.get('longitude', 0))
+
+                # Verificar coordenadas válidas
+                if planta_lat == 0 and planta_lon == 0:
+                    if 'geojson' in obs:
+                        coordinates = obs['geojson'].get('coordinates', [])
+                        if coordinates and len(coordinates) == 2:
+                            planta_lon, planta_lat = coordinates
+                    if planta_lat == 0 and planta_lon == 0 and 'location' in obs:
+                        try:
+                            planta_lat, planta_lon = map(float, obs['location'].split(','))
+                        except:
+                            logger.debug("No se pudieron obtener coordenadas válidas para %s", nombre_cientifico)
+                            continue
+
+                if planta_lat == 0 and planta_lon == 0:
+                    logger.debug("Coordenadas no válidas para %s, saltando observación", nombre_cientifico)
+                    continue
+                candidatas.append((obs, float(planta_lat), float(planta_lon)))
+            except Exception as e:
+                logger.debug("Error al procesar coordenadas para %s: %s", nombre_cientifico, e)
+                continue
+
+        # Distancias de todas las candidatas en una sola pasada y filtro por radio
+        distancias, _, indices = filtrar_por_radio(
+            lat, lon,
+            [c[1] for c in candidatas], [c[2] for c in candidatas],
+            radio, ordenar=ordenar_por_distancia
+        )
+        logger.debug("Descartadas por distancia (> %s km): %d", radio, len(candidatas) - len(indices))
+
+        # Ancestros de todos los taxones dentro del radio que no los traen, en una sola consulta
+        taxones_sin_ancestros = [
+            candidatas[i][0]['taxon'].get('id') for i in indices
+            if not candidatas[i][0]['taxon'].get('ancestors')
+        ]
+        with medir("ancestros"):
+            ancestros_por_taxon = self.cache_taxones.obtener_lote(taxones_sin_ancestros)
+
+        plantas = []
+        for i in indices:
+            obs, planta_lat, planta_lon = candidatas[i]
+            distancia = float(distancias[i])
+            taxon = obs['taxon']
+            nombre_cientifico = taxon['name']
+            taxon_id = taxon.get('id', None)
+
+            # Obtener lista de ancestros; si no existe, usar los obtenidos de la caché de taxones
+            ancestros = taxon.get('ancestors', [])
+            if not ancestros and taxon_id:
+                ancestros = ancestros_por_taxon.get(taxon_id, [])
+
+            # Traza de ancestros (solo si está activada)
+            if traza_ancestros.isEnabledFor(logging.INFO):
+                traza_ancestros.info("Taxon: %s (ID: %s) Ancestros: %s", nombre_cientifico, taxon_id,
+                                     "; ".join(f"{a.get('rank')}={a.get('name')}" for a in ancestros)
+                                     or "No se encontraron ancestros.")
+
+            # Filtrar por categoría usando el método actualizado
+            if self.categoria and not self._cumple_criterios_taxonomicos(ancestros, nombre_cientifico, taxon_id):
+                continue
+
+            # Filtrar por familia (si se especifica)
+            if self.familia:
+                familia_encontrada = False
+                for a in ancestros:
+                    if a.get('rank', '').lower() == 'family' and self.familia in a.get('name', '').lower():
+                        familia_encontrada = True
+                        break
+                if not familia_encontrada:
+                    logger.debug("Descartando %s por no coincidir con familia %s", nombre_cientifico, self.familia)
+                    continue
+
+            # Filtrar por género de forma local (si se especifica junto con familia)
+            if self.genero and self.familia:
+                genero_encontrado = False
+                if self.genero in nombre_cientifico.lower():
+                    genero_encontrado = True
+                else:
+                    for a in ancestros:
+                        if a.get('rank', '').lower() == 'genus' and self.genero in a.get('name', '').lower():
+                            genero_encontrado = True
+                            break
+                if not genero_encontrado:
+                    logger.debug("Descartando %s por no coincidir con género %s", nombre_cientifico, self.genero)
+                    continue
+
+            # Registro final
+            registro = {
+                'nombre': nombre_cientifico,
+                'nombre_comun': taxon.get('preferred_common_name', 'N/A'),
+                'distancia': f"{distancia:.1f} km",
+                'fecha': obs.get('observed_on', 'N/A'),
+                'imagen': obs.get('photos', [{}])[0].get('url', ''),
+                'coordenadas': f"{planta_lat}, {planta_lon}",
+                'calidad': obs.get('quality_grade', 'N/A')
+            }
+            plantas.append((distancia, registro))
+            logger.debug("Añadida planta: %s a %.1f km", nombre_cientifico, distancia)
+        return plantas
+
+    def procesar_inaturalist(self, lat, lon, radio=10, ordenar_por_distancia=False,
+                             max_registros=200, max_segundos=None, al_procesar_pagina=None):
+        """
+        Busca observaciones de iNaturalist a `radio` km de (lat, lon) que cumplan los filtros.
+        Con `ordenar_por_distancia` los resultados se devuelven del más cercano al más lejano.
+        Se recorren como máximo `max_registros` observaciones de la API (None para todas)
+        durante `max_segundos` como mucho; ese es también el plazo para esperar turno en el
+        limitador de peticiones. Si el limitador corta la búsqueda se devuelven las páginas
+        ya procesadas y la espera estimada queda en `espera_limite_tasa`.
+        Las búsquedas idénticas simultáneas (coordenadas redondeadas a DECIMALES_COALESCENCIA,
+        radio, filtros y límites) se resuelven con una sola consulta a la API.
+        Con `al_procesar_pagina` se le pasan los registros válidos de cada página en cuanto se
+        filtran; esas búsquedas no se agrupan con otras.
+        """
+        self.espera_limite_tasa = None
         try:
             lat = float(lat)
             lon = float(lon)
-            print(f"\nIniciando búsqueda en: {lat}, {lon} con radio {radio} km")
+            logger.info("Iniciando búsqueda en: %s, %s con radio %s km", lat, lon, radio)
         except ValueError as e:
-            print(f"Error al convertir coordenadas: {e}")
+            logger.warning("Error al convertir coordenadas: %s", e)
             return pd.DataFrame()
 
+        if al_procesar_pagina is not None:
+            df, self.espera_limite_tasa = self._buscar_inaturalist(lat, lon, radio, ordenar_por_distancia,
+                                                                   max_registros, max_segundos, al_procesar_pagina)
+            return df
+
+        clave = (round(lat, DECIMALES_COALESCENCIA), round(lon, DECIMALES_COALESCENCIA), radio,
+                 self.categoria, self.genero, self.familia, ordenar_por_distancia, max_registros, max_segundos)
+        df, self.espera_limite_tasa = COALESCEDOR_BUSQUEDAS.ejecutar(
+            clave, lambda: self._buscar_inaturalist(lat, lon, radio, ordenar_por_distancia, max_registros, max_segundos)
+        )
+        return df.copy()
+
+    def _buscar_inaturalist(self, lat, lon, radio, ordenar_por_distancia, max_registros, max_segundos,
+                            al_procesar_pagina=None):
+        """Hace la búsqueda de procesar_inaturalist y devuelve (DataFrame, espera_limite_tasa)."""
+        deadline = time.monotonic() + max_segundos if max_segundos is not None else None
+
         # Construir parámetros para la API
         params = {
             "lat": lat,
             "lng": lon,
             "radius": radio,
-            "per_page": 200,
-            "order": "desc",
-            "order_by": "created_at",
             "quality_grade": "research",
             "iconic_taxa[]": "Plantae",
             "geoprivacy": "open",  # Observaciones con ubicación pública
@@ -182,138 +344,64 @@ class ProcesadorDatos:
         if self.genero and not self.familia:
             params["taxon_name"] = self.genero
 
-        print(f"Parámetros de búsqueda: {params}")
+        logger.debug("Parámetros de búsqueda: %s", params)
         
         try:
             url = "https://api.inaturalist.org/v1/observations"
-            response = requests.get(url, params=params, timeout=10)
-            print(f"Status code: {response.status_code}")
-            print(f"URL de búsqueda: {response.url}")
+            paginas = None
+            if self.cache is not None:
+                def descargar_tesela(*bbox_y_limite):
+                    try:
+                        return self._descargar_tesela(url, params, *bbox_y_limite, deadline=deadline)
+                    except LimiteTasaExcedido as e:
+                        # La caché decide si sirve una copia anterior, pero la búsqueda debe saber que se cortó
+                        self.espera_limite_tasa = e.espera
+                        raise
 
-            if response.status_code != 200:
-                print(f"Error en API: {response.text}")
-                return pd.DataFrame()
+                capa = "puntual:" + params.get("taxon_name", "")
+                resultados = self.cache.consultar(capa, *bbox_desde_radio(lat, lon, radio), descargar_tesela,
+                                                  max_registros=max_registros)
+                if resultados is not None:
+                    logger.info("Observaciones servidas desde la caché local: %d", len(resultados))
+                    # Igual que la consulta directa: las `max_registros` más recientes del círculo, así
+                    # que se recorta el cuadrado de teselas al círculo antes de cortar por número
+                    if max_registros is not None:
+                        coordenadas = [extraer_coordenadas(obs) or (0.0, 0.0) for obs in resultados]
+                        _, _, indices = filtrar_por_radio(lat, lon, [c[0] for c in coordenadas],
+                                                          [c[1] for c in coordenadas], radio)
+                        resultados = [resultados[i] for i in indices[:max_registros]]
+                    paginas = [resultados]
 
-            data = response.json()
-            resultados = data.get('results', [])
-            print(f"\nObservaciones encontradas en API: {len(resultados)}")
-            
-            # Diagnóstico de la primera observación
-            if resultados:
-                primera_obs = resultados[0]
-                print("\nDiagnóstico de primera observación:")
-                print(f"Latitude: {primera_obs.get('latitude')}")
-                print(f"Longitude: {primera_obs.get('longitude')}")
-                print(f"Location: {primera_obs.get('location')}")
-                if 'geojson' in primera_obs:
-                    print(f"GeoJSON coordinates: {primera_obs['geojson'].get('coordinates')}")
-            
-            plantas = []
-            # Abrir el archivo de log (se sobrescribe en cada ejecución)
-            with open('ancestros_log.txt', 'w', encoding='utf-8') as log_file:
-                for obs in resultados:
-                    taxon = obs.get('taxon', {})
-                    nombre_cientifico = taxon.get('name', '')
-                    taxon_id = taxon.get('id', None)
-                    if not nombre_cientifico:
-                        print("Saltando observación sin nombre científico")
-                        continue
-
-                    # Obtener coordenadas de la observación
-                    try:
-                        planta_lat = float(obs.get('latitude', 0))
-                        planta_lon = float(obs.get('longitude', 0))
-                        
-                        # Verificar coordenadas válidas
-                        if planta_lat == 0 and planta_lon == 0:
-                            if 'geojson' in obs:
-                                coordinates = obs['geojson'].get('coordinates', [])
-                                if coordinates and len(coordinates) == 2:
-                                    planta_lon, planta_lat = coordinates
-                            if planta_lat == 0 and planta_lon == 0 and 'location' in obs:
-                                try:
-                                    planta_lat, planta_lon = map(float, obs['location'].split(','))
-                                except:
-                                    print(f"No se pudieron obtener coordenadas válidas para {nombre_cientifico}")
-                                    continue
-                        
-                        if planta_lat == 0 and planta_lon == 0:
-                            print(f"Coordenadas no válidas para {nombre_cientifico}, saltando observación")
-                            continue
-                        
-                        distancia = self.calcular_distancia(lat, lon, planta_lat, planta_lon)
-                        if distancia > radio:
-                            print(f"Descartando {nombre_cientifico} por distancia: {distancia:.1f} km > {radio} km")
-                            continue
-                    except Exception as e:
-                        print(f"Error al procesar coordenadas para {nombre_cientifico}: {str(e)}")
-                        continue
-
-                    # Obtener lista de ancestros; si no existe, intentar obtenerla a través de get_taxon_info
-                    ancestros = taxon.get('ancestors', [])
-                    if not ancestros and taxon_id:
-                        print(f"No se encontraron ancestros en la observación para {nombre_cientifico} (ID: {taxon_id}). Solicitando información adicional...")
-                        taxon_info = get_taxon_info(taxon_id)
-                        ancestros = taxon_info.get('ancestors', [])
-                    
-                    # Log de ancestros
-                    log_file.write(f"Taxon: {nombre_cientifico} (ID: {taxon_id})\n")
-                    if ancestros:
-                        for a in ancestros:
-                            log_file.write(f"  Ancestro: rango={a.get('rank')}, nombre={a.get('name')}\n")
-                            print(f"Ancestro: rango={a.get('rank')}, nombre={a.get('name')}")
-                    else:
-                        log_file.write("  No se encontraron ancestros.\n")
-                        print("  No se encontraron ancestros.")
-
-                    # Filtrar por categoría usando el método actualizado
-                    if self.categoria and not self._cumple_criterios_taxonomicos(ancestros, nombre_cientifico):
-                        continue
-
-                    # Filtrar por familia (si se especifica)
-                    if self.familia:
-                        familia_encontrada = False
-                        for a in ancestros:
-                            if a.get('rank', '').lower() == 'family' and self.familia in a.get('name', '').lower():
-                                familia_encontrada = True
-                                break
-                        if not familia_encontrada:
-                            print(f"Descartando {nombre_cientifico} por no coincidir con familia {self.familia}")
-                            continue
+            if paginas is None:
+                # Las páginas se piden con cursor y se filtran según llegan
+                paginas = iterar_observaciones(params, url=url, max_registros=max_registros,
+                                               max_segundos=max_segundos, deadline=deadline)
 
-                    # Filtrar por género de forma local (si se especifica junto con familia)
-                    if self.genero and self.familia:
-                        genero_encontrado = False
-                        if self.genero in nombre_cientifico.lower():
-                            genero_encontrado = True
-                        else:
-                            for a in ancestros:
-                                if a.get('rank', '').lower() == 'genus' and self.genero in a.get('name', '').lower():
-                                    genero_encontrado = True
-                                    break
-                        if not genero_encontrado:
-                            print(f"Descartando {nombre_cientifico} por no coincidir con género {self.genero}")
-                            continue
+            plantas = []
+            try:
+                for resultados in paginas:
+                    logger.debug("Página de %d observaciones recibida", len(resultados))
+                    validas = self._procesar_pagina(resultados, lat, lon, radio, ordenar_por_distancia)
+                    plantas.extend(validas)
+                    if al_procesar_pagina is not None and validas:
+                        al_procesar_pagina([registro for _, registro in validas])
+            except LimiteTasaExcedido as e:
+                # Se conservan las páginas ya procesadas
+                logger.warning("Búsqueda cortada por el limitador de peticiones: %s", e)
+                self.espera_limite_tasa = e.espera
+            except requests.exceptions.RequestException as e:
+                # Se conservan las páginas ya procesadas
+                logger.error("Error en API: %s", e)
 
-                    # Registro final
-                    registro = {
-                        'nombre': nombre_cientifico,
-                        'nombre_comun': taxon.get('preferred_common_name', 'N/A'),
-                        'distancia': f"{distancia:.1f} km",
-                        'fecha': obs.get('observed_on', 'N/A'),
-                        'imagen': obs.get('photos', [{}])[0].get('url', ''),
-                        'coordenadas': f"{planta_lat}, {planta_lon}",
-                        'calidad': obs.get('quality_grade', 'N/A')
-                    }
-                    plantas.append(registro)
-                    print(f"Añadida planta: {nombre_cientifico} a {distancia:.1f} km")
-            
-            print(f"\nTotal de registros válidos dentro del radio: {len(plantas)}")
-            return pd.DataFrame(plantas)
+            if ordenar_por_distancia:
+                plantas.sort(key=lambda p: p[0])
+            plantas = [registro for _, registro in plantas]
+            logger.info("Total de registros válidos dentro del radio: %d", len(plantas))
+            return pd.DataFrame(plantas), self.espera_limite_tasa
 
         except Exception as e:
-            print(f"Error crítico: {str(e)}")
-            return pd.DataFrame()
+            logger.exception("Error crítico: %s", e)
+            return pd.DataFrame(), self.espera_limite_tasa
 
 # Ejemplo de uso:
 if __name__ == "__main__":
@@ -0,0 +1,56 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+
+# Nivel por defecto de toda la aplicación (DEBUG, INFO, WARNING...)
+NIVEL_POR_DEFECTO = os.environ.get("HUNTERLEAF_LOG_LEVEL", "INFO").upper()
+# Si se define, la traza de ancestros se escribe en este archivo desde un hilo aparte
+RUTA_TRAZA_ANCESTROS = os.environ.get("HUNTERLEAF_TRAZA_ANCESTROS", "")
+
+_raiz = logging.getLogger("hunterleaf")
+_listener = None
+
+
+def configurar_registro(nivel=None):
+    """Configura el logger raíz de la aplicación una sola vez (salida por stderr)."""
+    if not _raiz.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"))
+        _raiz.addHandler(handler)
+        _raiz.propagate = False
+    _raiz.setLevel(nivel or NIVEL_POR_DEFECTO)
+
+
+def obtener_logger(nombre):
+    """Devuelve el logger de un módulo, colgado de 'hunterleaf'."""
+    configurar_registro()
+    return logging.getLogger(f"hunterleaf.{nombre}")
+
+
+def configurar_traza_ancestros(ruta=None):
+    """
+    Activa la traza de ancestros (antes ancestros_log.txt) y devuelve su logger.
+
+    Los registros se encolan en memoria y un QueueListener los añade al archivo desde su
+    propio hilo, así que las peticiones no esperan al disco y varios workers pueden escribir
+    en el mismo archivo sin truncarlo. Sin ruta la traza queda desactivada y no cuesta nada.
+    """
+    global _listener
+    traza = logging.getLogger("hunterleaf.ancestros")
+    traza.propagate = False
+    ruta = ruta if ruta is not None else RUTA_TRAZA_ANCESTROS
+    if not ruta:
+        traza.setLevel(logging.CRITICAL + 1)
+        return traza
+    if _listener is None:
+        cola = queue.SimpleQueue()
+        archivo = logging.FileHandler(ruta, mode="a", encoding="utf-8")
+        archivo.setFormatter(logging.Formatter("%(asctime)s %(process)d %(message)s"))
+        _listener = logging.handlers.QueueListener(cola, archivo)
+        _listener.start()
+        atexit.register(_listener.stop)
+        traza.addHandler(logging.handlers.QueueHandler(cola))
+    traza.setLevel(logging.INFO)
+    return traza
@@ -0,0 +1,175 @@
+import hashlib
+import http.client
+import json
+import os
+import random
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+import requests
+from requests.structures import CaseInsensitiveDict
+from registro import obtener_logger
+
+logger = obtener_logger(__name__)
+
+GRABAR = "grabar"
+REPRODUCIR = "reproducir"
+# Parámetros con credenciales: no forman parte de la clave y no se escriben en las fixtures
+PARAMETROS_SECRETOS = frozenset({"api-key", "key", "token"})
+# Cabeceras de la respuesta que se guardan (el resto no influye en la app)
+CABECERAS_GUARDADAS = ("Content-Type", "Retry-After")
+
+
+def _sin_secretos(parametros):
+    return sorted((str(k), str(v)) for k, v in parametros if k not in PARAMETROS_SECRETOS)
+
+
+def clave_peticion(url, params=None):
+    """
+    Identifica una petición GET por su URL y sus parámetros ordenados, sin credenciales.
+
+    Los parámetros pueden venir en `params` o ya en la query de la URL (geopy los pone ahí);
+    las dos formas dan la misma clave.
+    """
+    partes = urlsplit(url)
+    parametros = parse_qsl(partes.query, keep_blank_values=True)
+    if params:
+        parametros += list(params.items()) if isinstance(params, dict) else list(params)
+    base = urlunsplit((partes.scheme, partes.netloc, partes.path, "", ""))
+    texto = base + "?" + urlencode(_sin_secretos(parametros))
+    return hashlib.sha1(texto.encode("utf-8")).hexdigest()
+
+
+def construir_respuesta(url, estado, cuerpo, cabeceras=None):
+    """Crea un requests.Response como el que devolvería la red, para servirlo sin conexión."""
+    respuesta = requests.Response()
+    respuesta.status_code = estado
+    respuesta.reason = http.client.responses.get(estado, "")
+    respuesta._content = cuerpo.encode("utf-8") if isinstance(cuerpo, str) else cuerpo
+    respuesta.encoding = "utf-8"
+    respuesta.url = url
+    respuesta.headers = CaseInsensitiveDict(cabeceras or {})
+    return respuesta
+
+
+class Reproductor:
+    """
+    Sustituto local de los servicios externos para pruebas y benchmarks.
+
+    En modo "grabar" las peticiones que no tienen fixture van a la red y su respuesta se
+    guarda en `directorio/<host>/<sha1>.json`; las que ya la tienen se sirven del disco,
+    así que grabar dos veces no repite peticiones. En modo "reproducir" nunca se sale a la
+    red: lo que falta se resuelve con `al_faltar(url, params)` (que devuelve un objeto JSON
+    o None) o con un 404.
+
+    Para simular un servicio real se puede añadir una latencia uniforme entre
+    `latencia[0]` y `latencia[1]` segundos, responder 503 con probabilidad `tasa_errores`
+    y lanzar un Timeout con probabilidad `tasa_timeouts`. Los fallos inyectados pasan por
+    los reintentos de cliente_http igual que los de verdad.
+    """
+
+    def __init__(self, directorio, modo=REPRODUCIR, latencia=(0.0, 0.0), tasa_errores=0.0,
+                 tasa_timeouts=0.0, al_faltar=None, semilla=None):
+        if modo not in (GRABAR, REPRODUCIR):
+            raise ValueError(f"Modo de reproducción desconocido: {modo}")
+        self.directorio = directorio
+        self.modo = modo
+        self.latencia = latencia
+        self.tasa_errores = tasa_errores
+        self.tasa_timeouts = tasa_timeouts
+        self.al_faltar = al_faltar
+        self._azar = random.Random(semilla)
+        self._lock = threading.Lock()
+        self.reiniciar_contadores()
+
+    def reiniciar_contadores(self):
+        with self._lock:
+            self.llamadas = {}
+            self.servidas = 0
+            self.grabadas = 0
+            self.faltantes = 0
+            self.errores_inyectados = 0
+            self.timeouts_inyectados = 0
+
+    def _ruta(self, url, params):
+        host = urlsplit(url).netloc
+        return os.path.join(self.directorio, host, clave_peticion(url, params) + ".json")
+
+    def _sortear(self):
+        with self._lock:
+            return self._azar.random(), self._azar.random(), self._azar.uniform(*self.latencia)
+
+    def get(self, session, url, params=None, headers=None, timeout=None, **kwargs):
+        """Sustituye a session.get dentro de ClienteHTTP."""
+        host = urlsplit(url).netloc
+        with self._lock:
+            self.llamadas[host] = self.llamadas.get(host, 0) + 1
+        ruta = self._ruta(url, params)
+        fixture = None
+        if os.path.exists(ruta):
+            with open(ruta, encoding="utf-8") as f:
+                fixture = json.load(f)
+
+        if fixture is None and self.modo == GRABAR:
+            respuesta = session.get(url, params=params, headers=headers, timeout=timeout, **kwargs)
+            # Los errores transitorios no se graban: se volverán a pedir la próxima vez
+            if respuesta.status_code < 500 and respuesta.status_code != 429:
+                self._guardar(ruta, url, params, respuesta)
+            return respuesta
+
+        azar_timeout, azar_error, retardo = self._sortear()
+        if retardo > 0:
+            time.sleep(retardo)
+        if azar_timeout < self.tasa_timeouts:
+            with self._lock:
+                self.timeouts_inyectados += 1
+            raise requests.exceptions.ReadTimeout(f"Timeout inyectado en {url}")
+        if azar_error < self.tasa_errores:
+            with self._lock:
+                self.errores_inyectados += 1
+            return construir_respuesta(url, 503, "Servicio no disponible (error inyectado)")
+
+        if fixture is not None:
+            with self._lock:
+                self.servidas += 1
+            return construir_respuesta(fixture["url"], fixture["estado"], fixture["cuerpo"], fixture["cabeceras"])
+
+        with self._lock:
+            self.faltantes += 1
+        datos = self.al_faltar(url, params) if self.al_faltar is not None else None
+        if datos is None:
+            logger.debug("Sin fixture para %s %s", url, params)
+            return construir_respuesta(url, 404, json.dumps({"error": "Sin fixture"}),
+                                       {"Content-Type": "application/json"})
+        return construir_respuesta(url, 200, json.dumps(datos, ensure_ascii=False),
+                                   {"Content-Type": "application/json"})
+
+    def _guardar(self, ruta, url, params, respuesta):
+        parametros = list(params.items()) if isinstance(params, dict) else list(params or [])
+        fixture = {
+            "url": url,
+            "params": _sin_secretos(parametros),
+            "estado": respuesta.status_code,
+            "cabeceras": {c: respuesta.headers[c] for c in CABECERAS_GUARDADAS if c in respuesta.headers},
+            "cuerpo": respuesta.text,
+        }
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump(fixture, f, ensure_ascii=False, indent=1)
+        os.replace(temporal, ruta)
+        with self._lock:
+            self.grabadas += 1
+        logger.debug("Fixture grabada para %s en %s", url, ruta)
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "modo": self.modo,
+                "llamadas": dict(self.llamadas),
+                "servidas": self.servidas,
+                "grabadas": self.grabadas,
+                "faltantes": self.faltantes,
+                "errores_inyectados": self.errores_inyectados,
+                "timeouts_inyectados": self.timeouts_inyectados,
+            }
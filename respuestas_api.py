@@ -0,0 +1,76 @@
+import gzip
+import hashlib
+import json
+from flask import Response
+
+try:
+    import brotli  # Opcional: si no está instalado solo se comprime con gzip
+except ImportError:
+    brotli = None
+
+# Por debajo de este tamaño comprimir no compensa
+MIN_BYTES_COMPRESION = 1024
+# Decimales de las coordenadas (~10 cm)
+DECIMALES_COORDENADAS = 6
+
+
+def campos_pedidos(parametro, disponibles):
+    """
+    Interpreta el parámetro `campos` ("nombre,fecha") y devuelve los campos a incluir, en el
+    orden de `disponibles`. Sin parámetro se devuelven todos; los desconocidos se ignoran.
+    """
+    if not parametro:
+        return list(disponibles)
+    pedidos = {c.strip() for c in parametro.split(",")}
+    return [c for c in disponibles if c in pedidos]
+
+
+def feature(lat, lon, propiedades):
+    """Feature GeoJSON de un punto; sin coordenadas numéricas (p. ej. Trefle) la geometría es null."""
+    try:
+        geometria = {
+            "type": "Point",
+            "coordinates": [round(float(lon), DECIMALES_COORDENADAS), round(float(lat), DECIMALES_COORDENADAS)]
+        }
+    except (TypeError, ValueError):
+        geometria = None
+    return {"type": "Feature", "geometry": geometria, "properties": propiedades}
+
+
+def feature_collection(features, **extra):
+    """FeatureCollection GeoJSON; `extra` se añade como miembros adicionales (paginación, fuente...)."""
+    return dict({"type": "FeatureCollection", "features": features}, **extra)
+
+
+def respuesta_json(datos, peticion, estado=200, tipo="application/geo+json"):
+    """
+    Serializa `datos` en JSON compacto y construye la respuesta con ETag, 304 y compresión.
+
+    El ETag es débil porque identifica el contenido y no los bytes: es el mismo con y sin
+    compresión. Si coincide con If-None-Match se responde 304 sin cuerpo. El cuerpo se
+    comprime con br (si está instalado el paquete brotli) o gzip según Accept-Encoding.
+    """
+    # Se aceptan cuerpos ya serializados (p. ej. las teselas guardadas en disco)
+    if isinstance(datos, bytes):
+        cuerpo = datos
+    else:
+        cuerpo = json.dumps(datos, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    etag = hashlib.sha1(cuerpo).hexdigest()
+    cabeceras = {
+        "ETag": f'W/"{etag}"',
+        # Los clientes pueden guardar la respuesta pero deben revalidarla con If-None-Match
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding"
+    }
+    # If-None-Match usa comparación débil (RFC 9110), así que se aceptan etiquetas W/ y fuertes
+    if estado == 200 and peticion.if_none_match.contains_weak(etag):
+        return Response(status=304, headers=cabeceras)
+
+    if len(cuerpo) >= MIN_BYTES_COMPRESION:
+        if brotli is not None and "br" in peticion.accept_encodings:
+            cuerpo = brotli.compress(cuerpo, quality=5)
+            cabeceras["Content-Encoding"] = "br"
+        elif "gzip" in peticion.accept_encodings:
+            cuerpo = gzip.compress(cuerpo, compresslevel=6)
+            cabeceras["Content-Encoding"] = "gzip"
+    return Response(cuerpo, status=estado, headers=cabeceras, mimetype=tipo)
@@ -0,0 +1,151 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from registro import obtener_logger
+
+logger = obtener_logger(__name__)
+
+# Clave de orden de las observaciones sin fecha válida (van detrás en orden ascendente)
+SIN_FECHA = (1, datetime.min)
+
+
+def clave_fecha(planta):
+    """Clave de orden por fecha_observacion, igual que la de /buscar_area: (0, fecha) o (1, datetime.min)."""
+    try:
+        return (0, datetime.strptime(planta.get("fecha_observacion", "Fecha desconocida"), "%Y-%m-%d"))
+    except Exception:
+        return SIN_FECHA
+
+
+def redondear_bbox(swlat, swlng, nelat, nelng, decimales=5):
+    """Normaliza el bbox para usarlo como clave (~1 m de precisión)."""
+    return tuple(round(float(c), decimales) for c in (swlat, swlng, nelat, nelng))
+
+
+class ResultadoArea:
+    """
+    Observaciones de un área ya filtradas y ordenadas, listas para servir por páginas.
+
+    `hay_mas` indica que la descarga se limitó a `limite` observaciones por género y que
+    la fuente puede tener más. En el modo "todas", `fuentes` guarda la situación de cada
+    fuente ({fuente: "completa" | "parcial" | "agotada" | "error"}).
+    """
+
+    def __init__(self, plantas, limite=None, hay_mas=False, fuentes=None):
+        self.plantas = plantas
+        self.limite = limite
+        self.hay_mas = hay_mas
+        self.fuentes = fuentes
+        self.creado = time.time()
+
+    def total_paginas(self, por_pagina):
+        paginas = math.ceil(len(self.plantas) / por_pagina)
+        # Con más datos pendientes se ofrece siempre una página siguiente
+        return paginas + 1 if self.hay_mas else paginas
+
+    def pagina(self, numero, por_pagina):
+        inicio = (numero - 1) * por_pagina
+        return self.plantas[inicio:inicio + por_pagina]
+
+
+class CacheResultadosArea:
+    """
+    Caché LRU con caducidad de los resultados de /buscar_area.
+
+    Cada búsqueda se guarda en dos niveles: las observaciones descargadas de un área y
+    fuente (con la fuente deducida y la fecha interpretada una sola vez) y, derivadas de
+    ellas, las listas ya filtradas y ordenadas por cada combinación de filtro y orden.
+    Así pasar de página es solo un corte de lista y cambiar de orden no vuelve a descargar.
+    """
+
+    def __init__(self, max_entradas=64, ttl=300):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.aciertos = 0
+        self.fallos = 0
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _buscar(self, clave):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and time.time() - entrada.creado < self.ttl:
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return entrada
+            self.fallos += 1
+            return None
+
+    def tiene(self, bbox, fuente):
+        """Indica si hay observaciones vigentes de `bbox` y `fuente`, sin contar acierto ni fallo."""
+        with self._lock:
+            entrada = self._entradas.get(("descarga", bbox, fuente))
+            return entrada is not None and time.time() - entrada.creado < self.ttl
+
+    def _guardar(self, clave, entrada):
+        with self._lock:
+            self._entradas[clave] = entrada
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+        return entrada
+
+    def descargadas(self, bbox, fuente, descargar, limite=None):
+        """
+        Devuelve el ResultadoArea con las observaciones de `bbox` y `fuente`.
+
+        `descargar(limite)` debe devolver (plantas, hay_mas, fuentes), con `fuentes` la situación
+        de cada fuente en el modo "todas" (o None). Si la entrada guardada se limitó
+        a menos de `limite` observaciones por género y la fuente tenía más, se descarga de nuevo.
+        """
+        clave = ("descarga", bbox, fuente)
+        entrada = self._buscar(clave)
+        if entrada is not None and (not entrada.hay_mas or limite is None
+                                    or (entrada.limite is not None and entrada.limite >= limite)):
+            return entrada
+
+        plantas, hay_mas, fuentes = descargar(limite)
+        for planta in plantas:
+            if "fuente" not in planta:
+                if planta.get("descripcion", "Sin descripción") == "Sin descripción":
+                    planta["fuente"] = "iNaturalist"
+                else:
+                    planta["fuente"] = "GBIF"
+        # Se guarda la clave de orden junto a cada planta para no volver a interpretar fechas
+        decoradas = [(clave_fecha(planta), planta) for planta in plantas]
+        self._invalidar_derivadas(bbox, fuente)
+        return self._guardar(clave, ResultadoArea(decoradas, limite, hay_mas, fuentes))
+
+    def _invalidar_derivadas(self, bbox, fuente):
+        with self._lock:
+            for clave in [c for c in self._entradas if c[0] == "orden" and c[1] == bbox and c[2] == fuente]:
+                del self._entradas[clave]
+
+    def ordenadas(self, bbox, fuente, filtro_fuente, orden, descargar, limite=None):
+        """Devuelve el ResultadoArea filtrado por `filtro_fuente` ('mixta' para todas) y ordenado por fecha."""
+        base = self.descargadas(bbox, fuente, descargar, limite)
+        clave = ("orden", bbox, fuente, filtro_fuente, orden)
+        entrada = self._buscar(clave)
+        if entrada is not None and entrada.creado >= base.creado:
+            return entrada
+
+        decoradas = base.plantas
+        if filtro_fuente != "mixta":
+            decoradas = [d for d in decoradas if d[1].get("fuente") == filtro_fuente]
+        # sort es estable también con reverse, así que se conserva el orden de la fuente entre iguales
+        decoradas = sorted(decoradas, key=lambda d: d[0], reverse=(orden == "desc"))
+        resultado = ResultadoArea([planta for _, planta in decoradas], base.limite, base.hay_mas, base.fuentes)
+        logger.debug("Resultados de área ordenados: %d (%s, %s)", len(resultado.plantas), filtro_fuente, orden)
+        return self._guardar(clave, resultado)
+
+    def estadisticas(self):
+        with self._lock:
+            total = self.aciertos + self.fallos
+            return {
+                "entradas": len(self._entradas),
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "tasa_aciertos": round(self.aciertos / total, 3) if total else None
+            }
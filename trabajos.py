@@ -0,0 +1,352 @@
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from limitador_tasa import PRIORIDAD_SEGUNDO_PLANO, con_prioridad
+from registro import obtener_logger
+
+logger = obtener_logger(__name__)
+
+# Estados de un trabajo
+EN_CURSO = "en_curso"
+TERMINADO = "terminado"
+FALLIDO = "fallido"
+# Segundos entre consultas a la base mientras se esperan eventos de un trabajo de otro proceso
+ESPERA_SONDEO = 0.25
+
+
+def formato_sse(indice, evento, datos):
+    """Serializa un evento en el formato de Server-Sent Events; `indice` es el id para Last-Event-ID."""
+    return f"id: {indice}\nevent: {evento}\ndata: {json.dumps(datos, ensure_ascii=False, separators=(',', ':'))}\n\n"
+
+
+def _serializar(datos):
+    return json.dumps(datos, ensure_ascii=False, separators=(",", ":"))
+
+
+def _proceso_vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class AlmacenTrabajos:
+    """
+    Estado y eventos de los trabajos en SQLite, compartidos por todos los workers de la máquina.
+
+    El trabajo se ejecuta en el proceso que lo lanzó, pero la petición que lee sus eventos
+    puede llegar a cualquier otro worker de gunicorn: por eso cada evento se escribe aquí
+    además de en memoria. Igual que LimitadorTasa, no necesita servicios externos.
+    """
+
+    def __init__(self, db_file="trabajos.db"):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _conexion(self):
+        # La conexión se abre al primer uso y de nuevo tras un fork (workers de gunicorn)
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.db_file, timeout=10, isolation_level=None, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript('''
+                CREATE TABLE IF NOT EXISTS trabajos (
+                    id TEXT PRIMARY KEY,
+                    tipo TEXT NOT NULL,
+                    estado TEXT NOT NULL,
+                    creado REAL NOT NULL,
+                    terminado REAL,
+                    pid INTEGER NOT NULL,
+                    resultado TEXT
+                );
+                CREATE TABLE IF NOT EXISTS eventos (
+                    trabajo TEXT NOT NULL,
+                    indice INTEGER NOT NULL,
+                    evento TEXT NOT NULL,
+                    datos TEXT NOT NULL,
+                    PRIMARY KEY (trabajo, indice)
+                ) WITHOUT ROWID;
+            ''')
+            self._pid = os.getpid()
+        return self._conn
+
+    def _transaccion(self, funcion, *args):
+        with self._lock:
+            conn = self._conexion()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                resultado = funcion(conn, *args)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            return resultado
+
+    def _consultar(self, sql, parametros=()):
+        with self._lock:
+            return self._conexion().execute(sql, parametros).fetchall()
+
+    def crear(self, trabajo):
+        self._transaccion(lambda conn: conn.execute(
+            "INSERT INTO trabajos (id, tipo, estado, creado, pid) VALUES (?, ?, ?, ?, ?)",
+            (trabajo.id, trabajo.tipo, trabajo.estado, trabajo.creado, os.getpid())
+        ))
+
+    def publicar(self, id_trabajo, indice, evento, datos, estado=None, terminado=None):
+        """Guarda el evento `indice`; con `estado` cierra el trabajo en la misma transacción."""
+        def escribir(conn):
+            conn.execute("INSERT INTO eventos VALUES (?, ?, ?, ?)", (id_trabajo, indice, evento, _serializar(datos)))
+            if estado is not None:
+                conn.execute("UPDATE trabajos SET estado = ?, terminado = ? WHERE id = ?",
+                             (estado, terminado, id_trabajo))
+        self._transaccion(escribir)
+
+    def guardar_resultado(self, id_trabajo, datos):
+        self._transaccion(lambda conn: conn.execute(
+            "UPDATE trabajos SET resultado = ? WHERE id = ?", (_serializar(datos), id_trabajo)
+        ))
+
+    def resultado(self, id_trabajo):
+        filas = self._consultar("SELECT resultado FROM trabajos WHERE id = ?", (id_trabajo,))
+        return json.loads(filas[0][0]) if filas and filas[0][0] is not None else None
+
+    def leer(self, id_trabajo):
+        """(tipo, estado, pid) del trabajo o None si no existe."""
+        filas = self._consultar("SELECT tipo, estado, pid FROM trabajos WHERE id = ?", (id_trabajo,))
+        return filas[0] if filas else None
+
+    def eventos(self, id_trabajo, desde=0):
+        filas = self._consultar(
+            "SELECT evento, datos FROM eventos WHERE trabajo = ? AND indice >= ? ORDER BY indice",
+            (id_trabajo, desde)
+        )
+        return [(evento, json.loads(datos)) for evento, datos in filas]
+
+    def contar_eventos(self, id_trabajo):
+        return self._consultar("SELECT COUNT(*) FROM eventos WHERE trabajo = ?", (id_trabajo,))[0][0]
+
+    def abandonar(self, id_trabajo, mensaje):
+        """Cierra con un evento "error" un trabajo en curso cuyo proceso ya no existe."""
+        def cerrar(conn):
+            cambiado = conn.execute("UPDATE trabajos SET estado = ?, terminado = ? WHERE id = ? AND estado = ?",
+                                    (FALLIDO, time.time(), id_trabajo, EN_CURSO)).rowcount
+            if cambiado:
+                indice = conn.execute("SELECT COUNT(*) FROM eventos WHERE trabajo = ?", (id_trabajo,)).fetchone()[0]
+                conn.execute("INSERT INTO eventos VALUES (?, ?, ?, ?)",
+                             (id_trabajo, indice, "error", _serializar({"mensaje": mensaje})))
+        self._transaccion(cerrar)
+
+    def purgar(self, ttl, max_trabajos):
+        """Olvida los terminados hace más de `ttl` s y, si sobran, los terminados más antiguos."""
+        def borrar(conn):
+            conn.execute('''
+                DELETE FROM trabajos WHERE terminado IS NOT NULL AND (terminado < ? OR id NOT IN (
+                    SELECT id FROM trabajos ORDER BY creado DESC LIMIT ?
+                ))
+            ''', (time.time() - ttl, max_trabajos))
+            conn.execute("DELETE FROM eventos WHERE trabajo NOT IN (SELECT id FROM trabajos)")
+        self._transaccion(borrar)
+
+    def contar(self):
+        return self._consultar("SELECT COUNT(*) FROM trabajos")[0][0]
+
+
+class Trabajo:
+    """
+    Búsqueda que se ejecuta en segundo plano y publica sus resultados como una lista de eventos.
+
+    Los eventos se guardan todos, así que un cliente que se conecta tarde o se reconecta
+    (con Last-Event-ID) recibe también los anteriores. Con `almacen` se escriben además en
+    SQLite para que los lean los demás workers (ver TrabajoGuardado).
+    """
+
+    def __init__(self, tipo, almacen=None):
+        self.id = uuid.uuid4().hex
+        self.tipo = tipo
+        self.estado = EN_CURSO
+        self.creado = time.time()
+        self.terminado = None
+        self.eventos = []
+        self.resultado = None
+        self._almacen = almacen
+        self._condicion = threading.Condition()
+
+    def publicar(self, evento, datos):
+        with self._condicion:
+            if self._almacen is not None:
+                self._almacen.publicar(self.id, len(self.eventos), evento, datos)
+            self.eventos.append((evento, datos))
+            self._condicion.notify_all()
+
+    def finalizar(self, estado, evento, datos):
+        with self._condicion:
+            terminado = time.time()
+            if self._almacen is not None:
+                self._almacen.publicar(self.id, len(self.eventos), evento, datos, estado, terminado)
+            self.eventos.append((evento, datos))
+            self.estado = estado
+            self.terminado = terminado
+            self._condicion.notify_all()
+
+    def guardar_resultado(self, datos):
+        """Deja `datos` (serializables en JSON) para GestorTrabajos.resultado, sin publicarlos como evento."""
+        if self._almacen is not None:
+            self._almacen.guardar_resultado(self.id, datos)
+        self.resultado = datos
+
+    def esperar_eventos(self, desde, timeout):
+        """Devuelve los eventos a partir del índice `desde`, esperando hasta `timeout` s si aún no hay."""
+        with self._condicion:
+            self._condicion.wait_for(lambda: len(self.eventos) > desde or self.estado != EN_CURSO, timeout)
+            return self.eventos[desde:], self.estado != EN_CURSO
+
+    def resumen(self):
+        return {"id": self.id, "tipo": self.tipo, "estado": self.estado, "eventos": len(self.eventos)}
+
+
+class TrabajoGuardado:
+    """
+    Trabajo lanzado por otro worker, leído de AlmacenTrabajos con la misma interfaz que Trabajo.
+
+    Como no hay aviso entre procesos, la espera de eventos consulta la base cada
+    ESPERA_SONDEO segundos. Si el proceso que ejecutaba el trabajo ya no existe (un worker
+    reiniciado), el trabajo se cierra con un error en lugar de dejar al cliente esperando.
+    """
+
+    def __init__(self, almacen, id_trabajo, tipo):
+        self.id = id_trabajo
+        self.tipo = tipo
+        self._almacen = almacen
+
+    def esperar_eventos(self, desde, timeout):
+        limite = time.monotonic() + timeout
+        while True:
+            fila = self._almacen.leer(self.id)
+            # El estado se lee antes que los eventos: si ya había terminado, el último está incluido
+            eventos = self._almacen.eventos(self.id, desde)
+            if fila is None:
+                return eventos, True
+            _, estado, pid = fila
+            if eventos or estado != EN_CURSO:
+                return eventos, estado != EN_CURSO
+            if not _proceso_vivo(pid):
+                logger.warning("El proceso %d del trabajo %s ya no existe", pid, self.id)
+                self._almacen.abandonar(self.id, "La búsqueda se interrumpió; vuelva a intentarlo.")
+                continue
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                return [], False
+            time.sleep(min(ESPERA_SONDEO, restante))
+
+    def resumen(self):
+        fila = self._almacen.leer(self.id)
+        estado = fila[1] if fila else FALLIDO
+        return {"id": self.id, "tipo": self.tipo, "estado": estado, "eventos": self._almacen.contar_eventos(self.id)}
+
+
+class GestorTrabajos:
+    """
+    Ejecuta las búsquedas en un pool de hilos propio, separado de los workers web.
+
+    `lanzar(tipo, funcion, ...)` devuelve el Trabajo al momento; la función recibe el trabajo
+    como primer argumento para publicar el progreso y lo que devuelve se publica como evento
+    "fin" (o "error" si lanza una excepción). Se conservan como mucho `max_trabajos` y los
+    terminados se olvidan pasados `ttl` segundos.
+
+    Con `db_file` el estado y los eventos se guardan en SQLite (AlmacenTrabajos), así que
+    `obtener` encuentra también los trabajos lanzados por otros workers de gunicorn; sin él
+    solo se ven los del propio proceso.
+
+    Las peticiones de los trabajos esperan turno en el limitador con `prioridad`, detrás
+    de las búsquedas síncronas que tienen un worker web ocupado.
+    """
+
+    def __init__(self, max_hilos=4, max_trabajos=200, ttl=600, prioridad=PRIORIDAD_SEGUNDO_PLANO,
+                 db_file="trabajos.db"):
+        self.max_trabajos = max_trabajos
+        self.prioridad = prioridad
+        self.ttl = ttl
+        self.lanzados = 0
+        self.fallidos = 0
+        self.almacen = AlmacenTrabajos(db_file) if db_file else None
+        self._trabajos = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_hilos, thread_name_prefix="trabajo")
+
+    def lanzar(self, tipo, funcion, *args, **kwargs):
+        trabajo = Trabajo(tipo, self.almacen)
+        with self._lock:
+            self._purgar()
+            self._trabajos[trabajo.id] = trabajo
+            self.lanzados += 1
+        if self.almacen is not None:
+            self.almacen.purgar(self.ttl, self.max_trabajos)
+            self.almacen.crear(trabajo)
+        # Contexto nuevo: el trabajo no hereda la prioridad ni los tiempos de la petición que lo lanza
+        self._pool.submit(contextvars.Context().run, self._ejecutar, trabajo, funcion, args, kwargs)
+        logger.debug("Trabajo %s lanzado (%s)", trabajo.id, tipo)
+        return trabajo
+
+    def _ejecutar(self, trabajo, funcion, args, kwargs):
+        inicio = time.perf_counter()
+        try:
+            with con_prioridad(self.prioridad):
+                resultado = funcion(trabajo, *args, **kwargs)
+        except Exception as e:
+            logger.exception("Error en el trabajo %s (%s): %s", trabajo.id, trabajo.tipo, e)
+            with self._lock:
+                self.fallidos += 1
+            trabajo.finalizar(FALLIDO, "error", {"mensaje": str(e)})
+            return
+        trabajo.finalizar(TERMINADO, "fin", resultado if resultado is not None else {})
+        logger.info("Trabajo %s (%s) terminado en %.2f s", trabajo.id, trabajo.tipo, time.perf_counter() - inicio)
+
+    def _purgar(self):
+        ahora = time.time()
+        for id_trabajo in [i for i, t in self._trabajos.items() if t.terminado and ahora - t.terminado > self.ttl]:
+            del self._trabajos[id_trabajo]
+        # Si aun así hay demasiados se olvidan los más antiguos ya terminados
+        terminados = [i for i, t in self._trabajos.items() if t.terminado]
+        while len(self._trabajos) >= self.max_trabajos and terminados:
+            del self._trabajos[terminados.pop(0)]
+
+    def obtener(self, id_trabajo):
+        """El Trabajo de este proceso, un TrabajoGuardado si lo lanzó otro worker, o None."""
+        with self._lock:
+            trabajo = self._trabajos.get(id_trabajo)
+        if trabajo is not None or self.almacen is None:
+            return trabajo
+        fila = self.almacen.leer(id_trabajo)
+        return TrabajoGuardado(self.almacen, id_trabajo, fila[0]) if fila else None
+
+    def resultado(self, id_trabajo):
+        """Lo que el trabajo dejó con guardar_resultado, lo lanzara este proceso u otro; None si nada."""
+        with self._lock:
+            trabajo = self._trabajos.get(id_trabajo)
+        if trabajo is not None and trabajo.resultado is not None:
+            return trabajo.resultado
+        return self.almacen.resultado(id_trabajo) if self.almacen is not None else None
+
+    def estadisticas(self):
+        with self._lock:
+            en_curso = sum(1 for t in self._trabajos.values() if t.estado == EN_CURSO)
+            estadisticas = {
+                "lanzados": self.lanzados,
+                "fallidos": self.fallidos,
+                "en_curso": en_curso,
+                "guardados": len(self._trabajos)
+            }
+        if self.almacen is not None:
+            # Los de todos los workers de la máquina
+            estadisticas["guardados_compartidos"] = self.almacen.contar()
+        return estadisticas